@@ -0,0 +1,235 @@
+""" This module holds the boxsup-benchmark command. It measures the
+    throughput of the NasaBoxSupDataset on a synthetic Images/Labels tree
+    or on a given root_dir:
+        decode: png decoding of the images
+        label: loading of the .mat and png labels, the png stage is skipped
+            if the root_dir has no png labels
+        getitem: NasaBoxSupDataset.__getitem__
+        transforms: every denoise transform, ToTensor and ToCompactTensor
+        dataloader: full DataLoader iteration for several num_workers
+    The results are written as JSON. A previous result can be passed as
+    baseline, slower stages are reported and fail the command.
+"""
+
+from __future__ import absolute_import
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from PIL import Image
+from .decode import decode_image, decode_label
+from .nasa_box_sup_dataset import NasaBoxSupDataset
+from .transforms import denoise
+from .transforms.utils import ToTensor, ToCompactTensor
+
+CLASSFILE = 'classes_bxsp.txt'
+
+
+def make_synthetic_tree(root_dir, count=32, height=512, width=512,
+                        num_classes=4, seed=0):
+    """ Writes a root_dir with noisy images, box masks as .mat and png and a
+        classes file.
+    """
+    import scipy.io as sio  # pylint: disable=import-outside-toplevel
+    rng = np.random.default_rng(seed)
+    root_dir = Path(root_dir)
+    (root_dir / 'Images').mkdir(parents=True, exist_ok=True)
+    (root_dir / 'Labels').mkdir(parents=True, exist_ok=True)
+    ramp = np.linspace(0, 1, width)[np.newaxis, :, np.newaxis]
+    for index in range(count):
+        image = np.clip(ramp * 0.6 + rng.normal(0.2, 0.1, (height, width, 3)),
+                        0, 1)
+        Image.fromarray((image * 255).astype(np.uint8)).save(
+            root_dir / 'Images' / f'sample{index:06d}.png')
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for _ in range(rng.integers(1, 5)):
+            top = rng.integers(0, height // 2)
+            left = rng.integers(0, width // 2)
+            mask[top:top + rng.integers(8, height // 2),
+                 left:left + rng.integers(8, width // 2)] = \
+                rng.integers(1, num_classes)
+        sio.savemat(root_dir / 'Labels' / f'sample{index:06d}_label.mat',
+                    {'mask_data': mask})
+        Image.fromarray(mask).save(
+            root_dir / 'Labels' / f'sample{index:06d}_label.png')
+    with open(root_dir / 'Labels' / CLASSFILE, 'w') as classfile:
+        classfile.write('name,value\n')
+        for value in range(num_classes):
+            classfile.write(f'class{value},{value}\n')
+    return root_dir
+
+
+def measure(func, count, warmup=1):
+    """ Calls func(index) for every index and reports the latencies.
+
+    Returns:
+        dict: samples, samples_per_sec and latency mean/p50/p90/p99 in ms.
+    """
+    for index in range(min(warmup, count)):
+        func(index)
+    latencies = np.empty(count)
+    start = time.perf_counter()
+    for index in range(count):
+        tic = time.perf_counter()
+        func(index)
+        latencies[index] = time.perf_counter() - tic
+    total = time.perf_counter() - start
+    return {'samples': count,
+            'samples_per_sec': count / total,
+            'mean_ms': float(latencies.mean() * 1e3),
+            'p50_ms': float(np.percentile(latencies, 50) * 1e3),
+            'p90_ms': float(np.percentile(latencies, 90) * 1e3),
+            'p99_ms': float(np.percentile(latencies, 99) * 1e3)}
+
+
+def _guarded(func):
+    try:
+        return func()
+    except Exception as error:  # pylint: disable=broad-except
+        return {'error': f'{type(error).__name__}: {error}'}
+
+
+def measure_loader(dataset, num_workers, batch_size=4):
+    """ Measures one epoch of a DataLoader, latency is per batch."""
+    loader = DataLoader(dataset, batch_size=batch_size,
+                        num_workers=num_workers)
+    latencies = []
+    start = tic = time.perf_counter()
+    for _ in loader:
+        latencies.append(time.perf_counter() - tic)
+        tic = time.perf_counter()
+    total = time.perf_counter() - start
+    latencies = np.array(latencies)
+    return {'samples': len(dataset),
+            'samples_per_sec': len(dataset) / total,
+            'first_batch_ms': float(latencies[0] * 1e3),
+            'p50_ms': float(np.percentile(latencies, 50) * 1e3),
+            'p99_ms': float(np.percentile(latencies, 99) * 1e3)}
+
+
+def run(root_dir, count=None, workers=(0, 2, 4), transform_samples=4,
+        classfile=CLASSFILE):
+    """ Runs all benchmarks on a root_dir.
+
+    Args:
+        root_dir (string): Directory with img folder and label folder.
+        count (int, optional): Number of samples, defaults to all.
+        workers (tuple): num_workers of the DataLoader runs.
+        transform_samples (int): Number of samples of the slow transforms.
+        classfile (string): Name of the classes file in the label folder.
+
+    Returns:
+        dict: environment and results of every stage.
+    """
+    dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                                target_transfrom=np.asarray)
+    count = len(dataset) if count is None else min(count, len(dataset))
+    images = [path for path, _ in dataset.imgs[:count]]
+    masks = [path for _, path in dataset.imgs[:count]]
+    png_masks = [path.with_suffix('.png') for path in masks]
+
+    results = {}
+    results['decode'] = measure(lambda i: decode_image(images[i]), count)
+    results['label_mat'] = measure(lambda i: decode_label(masks[i]), count)
+    if all(path.exists() for path in png_masks):
+        results['label_png'] = _guarded(lambda: measure(
+            lambda i: decode_label(png_masks[i], 'image'), count))
+    else:
+        results['label_png'] = {'skipped': 'no png labels'}
+    results['getitem'] = measure(dataset.__getitem__, count)
+
+    samples = [{'image': decode_image(images[i]),
+                'label': decode_label(masks[i])}
+               for i in range(min(transform_samples, count))]
+    for name in ('TotalVariation', 'TotalVariation2', 'Wavelet'):
+        results[name] = _guarded(lambda name=name: measure(
+            lambda i, t=getattr(denoise, name)(): t(samples[i]),
+            len(samples)))
+    results['ToTensor'] = _guarded(lambda: measure(
+        lambda i: ToTensor()({'image': samples[i]['image'],
+                              'label': samples[i]['label'][..., np.newaxis]}),
+        len(samples)))
+    results['ToCompactTensor'] = measure(
+        lambda i: ToCompactTensor()(samples[i]), len(samples))
+
+    subset = torch.utils.data.Subset(dataset, range(count))
+    for num_workers in workers:
+        results[f'dataloader_{num_workers}'] = _guarded(
+            lambda num_workers=num_workers: measure_loader(subset,
+                                                           num_workers))
+
+    return {'environment': {'python': platform.python_version(),
+                            'numpy': np.__version__,
+                            'torch': torch.__version__,
+                            'machine': platform.machine(),
+                            'cpus': os.cpu_count()},
+            'results': results}
+
+
+def compare(results, baseline, tolerance=0.1):
+    """ Lists the stages whose samples_per_sec dropped by more than tolerance
+        compared to the baseline.
+    """
+    regressions = []
+    for stage, result in results['results'].items():
+        before = baseline['results'].get(stage, {}).get('samples_per_sec')
+        after = result.get('samples_per_sec')
+        if before and after and after < before * (1 - tolerance):
+            regressions.append(
+                {'stage': stage, 'baseline': before, 'current': after,
+                 'change': after / before - 1})
+    return regressions
+
+
+def main(argv=None):
+    """ Command line entry point of the benchmark."""
+    parser = argparse.ArgumentParser(
+        description='Measures the loading and transform throughput.')
+    parser.add_argument('--root-dir', default=None,
+                        help='dataset to use, a synthetic one if not given')
+    parser.add_argument('--classfile', default=CLASSFILE,
+                        help='classes file of --root-dir')
+    parser.add_argument('--count', type=int, default=32)
+    parser.add_argument('--size', type=int, nargs=2, default=(512, 512),
+                        metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--output', default=None, help='JSON result file')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root_dir, classfile = args.root_dir, args.classfile
+        if root_dir is None:
+            root_dir = make_synthetic_tree(tmp_dir, args.count, *args.size)
+            classfile = CLASSFILE
+        results = run(root_dir, args.count, tuple(args.workers),
+                      classfile=classfile)
+
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as output:
+            output.write(text)
+    if args.baseline is not None:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  args.tolerance)
+        for regression in regressions:
+            print(f"{regression['stage']}: {regression['change']:+.1%} "
+                  f"samples/sec", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
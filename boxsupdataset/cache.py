@@ -0,0 +1,382 @@
+""" This module holds the stores of pre-decoded samples. Both decode every
+    image and label of a NasaBoxSupDataset once into a single uint8 buffer,
+    from which every epoch and every DataLoader worker reads zero-copy views
+    instead of decoding the files again:
+        SampleCache: The buffer is a file on disk, which is memory-mapped.
+        SharedSampleStore: The buffer is a shared memory block in RAM.
+"""
+
+from __future__ import absolute_import
+from multiprocessing import shared_memory
+from pathlib import Path
+import os
+import time
+import numpy as np
+from .decode import decode_sample, sample_shapes
+from .utils import atomic_write
+
+
+def source_stats(items):
+    """ Size and mtime_ns of the image and label file of every item.
+
+    Returns:
+        ndarray: N x 2 x 2 int64, [image, label] x [size, mtime_ns]
+    """
+    stats = np.zeros((len(items), 2, 2), dtype=np.int64)
+    for index, item in enumerate(items):
+        for slot, path in enumerate(item):
+            stat = os.stat(path)
+            stats[index, slot] = stat.st_size, stat.st_mtime_ns
+    return stats
+
+
+class PackedSamples(object):
+    """ Base of the stores, which keep all samples back to back in one uint8
+    buffer. The index holds offset and shape of every image and label, and
+    size and mtime of the files they were decoded from.
+    """
+
+    def __len__(self):
+        return len(self.index['sources'])
+
+    def __getitem__(self, idx):
+        data = self._buffer()
+        offsets, shapes = self.index['offsets'][idx], self.index['shapes'][idx]
+        img = self._view(data, offsets[0], shapes[0])
+        mask = self._view(data, offsets[1], shapes[1])
+        return img, mask
+
+    def _buffer(self):
+        raise NotImplementedError
+
+    def update(self, items, labeltype='mask', stale=()):
+        """ Brings the store in line with changed items. Samples whose
+            sources are still in items and not stale are kept, all others
+            are decoded.
+
+        Args:
+            items (list): (image path, label path) tuples of the dataset.
+            labeltype (string): 'mask' or 'image'.
+            stale (iterable): (image path, label path) tuples whose files
+                changed.
+
+        Returns:
+            PackedSamples: the store for items.
+        """
+        raise NotImplementedError
+
+    def _reusable(self, items, stats, labeltype, stale):
+        """ Position of every item which can be kept by update, its files
+            need the size and mtime they were decoded with.
+        """
+        if str(self.index['labeltype']) != labeltype or \
+                'stats' not in self.index:
+            return {}
+        stale = {(str(img), str(mask)) for img, mask in stale}
+        known = {tuple(source): index for index, source
+                 in enumerate(self.index['sources'].tolist())
+                 if tuple(source) not in stale}
+        reusable = {}
+        for (img, mask), stat in zip(items, stats):
+            source = (str(img), str(mask))
+            old = known.get(source)
+            if old is not None and \
+                    np.array_equal(self.index['stats'][old], stat):
+                reusable[source] = old
+        return reusable
+
+    @staticmethod
+    def _view(data, offset, shape):
+        shape = tuple(int(dim) for dim in shape if dim > 0)
+        size = int(np.prod(shape))
+        return data[offset:offset + size].reshape(shape)
+
+    def matches(self, items, labeltype='mask'):
+        """ Checks if the store was built from the given items and their
+            files did not change since, by size and mtime.
+
+        Args:
+            items (list): (image path, label path) tuples of the dataset.
+            labeltype (string): 'mask' or 'image'.
+        """
+        sources = [[str(img), str(mask)] for img, mask in items]
+        return str(self.index['labeltype']) == labeltype and \
+            self.index['sources'].tolist() == sources and \
+            'stats' in self.index and \
+            np.array_equal(self.index['stats'], source_stats(items))
+
+
+class SampleCache(PackedSamples):
+    """ On-disk store of pre-decoded samples.
+
+    All images and labels are written back to back into one uint8 file. An
+    index holds offset and shape of every array, so a sample is a reshaped
+    slice of the memory map. The memory map is opened lazily in every process,
+    which lets forked or spawned workers share the page cache instead of
+    holding their own copy. The returned arrays are read-only.
+
+    Every build writes a new data file, samples.<version>.u8, which is named
+    in the index together with its size. The index is replaced last, so a
+    reader sees either the old or the new pair, never a mix of both.
+
+    Args:
+        cache_dir (string): Directory which holds the store files.
+    """
+    DATA_PREFIX = 'samples'
+    DATA_SUFFIX = '.u8'
+    INDEX_FILE = 'index.npz'
+
+    def __init__(self, cache_dir) -> None:
+        self.cache_dir = Path(cache_dir)
+        self._data = None
+        self._index = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def _buffer(self):
+        if self._data is None:
+            try:
+                self._data = self._map()
+            except FileNotFoundError:
+                # a build replaced the data file after the index was read
+                self._index = None
+                self._data = self._map()
+        return self._data
+
+    def _map(self):
+        """ Maps the data file named in the index and checks its size."""
+        data = np.memmap(self.data_path, dtype=np.uint8, mode='r')
+        if len(data) < int(self.index['data_size']):
+            raise RuntimeError(f'{self.data_path} is shorter than its '
+                               f'index!')
+        return data
+
+    @property
+    def data_path(self):
+        """ data_path Getter, the data file named in the index."""
+        return self.cache_dir / str(self.index['data_file'])
+
+    @property
+    def index(self):
+        """ index Getter, loads the index file on first access."""
+        if self._index is None:
+            with np.load(self.cache_dir / self.INDEX_FILE) as index:
+                self._index = {key: index[key] for key in index.files}
+        return self._index
+
+    def exists(self):
+        """ Checks if the index and the data file it names are present."""
+        if not (self.cache_dir / self.INDEX_FILE).exists():
+            return False
+        self._data = None
+        self._index = None
+        return 'data_file' in self.index and self.data_path.exists()
+
+    def matches(self, items, labeltype='mask'):
+        """ Checks if the store files exist and were built from the given
+            items.
+        """
+        return self.exists() and super().matches(items, labeltype)
+
+    def build(self, items, labeltype='mask'):
+        """ Decodes all items into a new data file and switches the index to
+            it. Data files of earlier builds are removed, processes which
+            mapped them keep reading them until they reopen the store.
+
+        Args:
+            items (list): (image path, label path) tuples of the dataset.
+            labeltype (string): 'mask' or 'image'.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        version = f'{time.time_ns():x}{os.getpid():x}'
+        data_path = self.cache_dir / \
+            f'{self.DATA_PREFIX}.{version}{self.DATA_SUFFIX}'
+        stats = source_stats(items)
+        offsets = np.zeros((len(items), 2), dtype=np.int64)
+        shapes = np.zeros((len(items), 2, 3), dtype=np.int64)
+        offset = 0
+        with atomic_write(data_path) as data_file:
+            for index, (img_path, mask_path) in enumerate(items):
+                arrays = decode_sample(img_path, mask_path, labeltype)
+                for slot, array in enumerate(arrays):
+                    array = np.ascontiguousarray(array)
+                    offsets[index, slot] = offset
+                    shapes[index, slot, :array.ndim] = array.shape
+                    data_file.write(memoryview(array).cast('B'))
+                    offset += array.size
+        self._write_index(offsets, shapes, stats, items, labeltype,
+                          data_path.name, offset)
+        for path in self.cache_dir.glob(f'{self.DATA_PREFIX}*'
+                                        f'{self.DATA_SUFFIX}'):
+            if path.name != data_path.name:
+                try:
+                    path.unlink()
+                except OSError:
+                    # still mapped on systems which lock open files
+                    pass
+
+    def _write_index(self, offsets, shapes, stats, items, labeltype,
+                     data_file, data_size):
+        index_path = self.cache_dir / self.INDEX_FILE
+        sources = np.array([[str(img), str(mask)] for img, mask in items],
+                           dtype=str).reshape(-1, 2)
+        with atomic_write(index_path) as index_file:
+            np.savez(index_file, offsets=offsets, shapes=shapes,
+                     stats=stats, sources=sources,
+                     labeltype=np.array(labeltype),
+                     data_file=np.array(data_file),
+                     data_size=np.array(data_size))
+        self._data = None
+        self._index = None
+
+    def update(self, items, labeltype='mask', stale=()):
+        """ Appends the new and stale samples to the data file and rewrites
+            the index, kept samples are not read at all. The replaced bytes
+            stay in the file until it holds more than twice the live data,
+            then the store is built again. Workers which mapped the store
+            before see the update when they are started again.
+        """
+        stats = source_stats(items)
+        known = self._reusable(items, stats, labeltype, stale) \
+            if self.exists() else {}
+        if not known:
+            self.build(items, labeltype)
+            return self
+        data_path = self.data_path
+        offsets = np.zeros((len(items), 2), dtype=np.int64)
+        shapes = np.zeros((len(items), 2, 3), dtype=np.int64)
+        offset = os.path.getsize(data_path)
+        live = 0
+        with open(data_path, 'ab') as data_file:
+            for index, (img_path, mask_path) in enumerate(items):
+                old = known.get((str(img_path), str(mask_path)))
+                if old is not None:
+                    offsets[index] = self.index['offsets'][old]
+                    shapes[index] = self.index['shapes'][old]
+                    live += sum(int(np.prod([dim for dim in shape if dim]))
+                                for shape in shapes[index])
+                    continue
+                arrays = decode_sample(img_path, mask_path, labeltype)
+                for slot, array in enumerate(arrays):
+                    array = np.ascontiguousarray(array)
+                    offsets[index, slot] = offset
+                    shapes[index, slot, :array.ndim] = array.shape
+                    data_file.write(memoryview(array).cast('B'))
+                    offset += array.size
+                    live += array.size
+        if offset > 2 * live:
+            self.build(items, labeltype)
+        else:
+            self._write_index(offsets, shapes, stats, items, labeltype,
+                              data_path.name, offset)
+        return self
+
+
+class SharedSampleStore(PackedSamples):
+    """ In-RAM store of pre-decoded samples in a shared memory block.
+
+    The shapes are read from the file headers first, so the block is
+    allocated once and every sample is decoded straight into it. Workers
+    receive only the name of the block and the index when the dataset is
+    pickled and attach to the block without copying it, forked workers
+    simply inherit the mapping. The returned arrays are read-only views into
+    the block.
+
+    Args:
+        items (list): (image path, label path) tuples of the dataset.
+        labeltype (string): 'mask' or 'image'.
+        reuse (SharedSampleStore, optional): Store whose samples are copied
+            instead of decoded, see update.
+        stale (iterable): (image path, label path) tuples which are decoded
+            again although reuse holds them.
+    """
+
+    def __init__(self, items, labeltype='mask', reuse=None,
+                 stale=()) -> None:
+        stats = source_stats(items)
+        known = {} if reuse is None else \
+            reuse._reusable(items, stats, labeltype, stale)
+        olds = [known.get((str(img_path), str(mask_path)))
+                for img_path, mask_path in items]
+        offsets = np.zeros((len(items), 2), dtype=np.int64)
+        shapes = np.zeros((len(items), 2, 3), dtype=np.int64)
+        offset = 0
+        for index, (img_path, mask_path) in enumerate(items):
+            if olds[index] is not None:
+                sample = [[dim for dim in shape if dim]
+                          for shape in reuse.index['shapes'][olds[index]]]
+            else:
+                sample = sample_shapes(img_path, mask_path, labeltype)
+            for slot, shape in enumerate(sample):
+                offsets[index, slot] = offset
+                shapes[index, slot, :len(shape)] = shape
+                offset += int(np.prod(shape))
+        sources = np.array([[str(img), str(mask)] for img, mask in items],
+                           dtype=str).reshape(-1, 2)
+        self.index = {'offsets': offsets, 'shapes': shapes, 'stats': stats,
+                      'sources': sources, 'labeltype': np.array(labeltype)}
+
+        self._shm = shared_memory.SharedMemory(create=True,
+                                               size=max(offset, 1))
+        self._owner = os.getpid()
+        self._data = np.ndarray((offset,), np.uint8, self._shm.buf)
+        for index, (img_path, mask_path) in enumerate(items):
+            if olds[index] is not None:
+                arrays = reuse[olds[index]]
+            else:
+                arrays = decode_sample(img_path, mask_path, labeltype)
+            for slot, array in enumerate(arrays):
+                view = self._view(self._data, offsets[index, slot],
+                                  shapes[index, slot])
+                if view.shape != array.shape:
+                    raise RuntimeError(f'{[img_path, mask_path][slot]} does '
+                                       f'not match its header!')
+                np.copyto(view, array)
+        self._data.flags.writeable = False
+
+    def __getstate__(self):
+        return {'index': self.index, 'name': self._shm.name,
+                'size': len(self._data)}
+
+    def __setstate__(self, state):
+        self.index = state['index']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = None
+        self._data = np.ndarray((state['size'],), np.uint8, self._shm.buf)
+        self._data.flags.writeable = False
+
+    def __del__(self):
+        self.close()
+
+    def _buffer(self):
+        return self._data
+
+    def update(self, items, labeltype='mask', stale=()):
+        """ Allocates a new block, kept samples are copied from this block
+            and this block is released. Workers which attached to it before
+            keep their mapping until they are started again.
+        """
+        store = SharedSampleStore(items, labeltype, reuse=self, stale=stale)
+        self.close()
+        return store
+
+    @property
+    def nbytes(self):
+        """ Size of the shared memory block."""
+        return len(self._data)
+
+    def close(self):
+        """ Releases the shared memory, the creating process (not a forked
+            copy) also removes it.
+        """
+        shm = getattr(self, '_shm', None)
+        if shm is None:
+            return
+        self._data = None
+        self._shm = None
+        shm.close()
+        if self._owner == os.getpid():
+            shm.unlink()
@@ -0,0 +1,147 @@
+""" This module holds the boxsup-convert-labels command. It converts the .mat
+    labels of a root_dir into .npy files next to them:
+        Labels/<name>_label.mat -> Labels/<name>_label.npy
+    A .npy file is read with a single np.load instead of parsing the MATLAB
+    container. Every converted label is compared with its source before it
+    is kept, and size and mtime of the source are stored in an index file, so
+    pair_files only prefers a .npy label while its .mat source is unchanged.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from .decode import decode_label
+from .utils import atomic_write
+
+INDEX_FILE = 'converted_labels.json'
+
+
+def load_index(label_dir):
+    """ Reads the conversion index of a Labels folder.
+
+    Returns:
+        dict: .mat name -> size and mtime of the converted source
+    """
+    path = Path(label_dir) / INDEX_FILE
+    if not path.exists():
+        return {}
+    with open(path) as index_file:
+        return json.load(index_file)
+
+
+def is_current(record, mat_entry):
+    """ Checks if a conversion record matches the os.DirEntry of the .mat."""
+    if record is None:
+        return False
+    stat = mat_entry.stat()
+    return record['size'] == stat.st_size and \
+        record['mtime'] == stat.st_mtime_ns
+
+
+def select_labels(label_dir, mat_labels, npy_labels):
+    """ Uses the .npy label of a pair if it was converted from the current
+        .mat label, otherwise the .mat label. A .npy label without .mat
+        label, e.g. in a pyramid level, is used as is.
+
+    Args:
+        label_dir (string): Labels folder with the conversion index.
+        mat_labels (dict): key of the pair -> os.DirEntry of the .mat label.
+        npy_labels (dict): key of the pair -> os.DirEntry of the .npy label.
+    """
+    if not npy_labels:
+        return mat_labels
+    index = load_index(label_dir)
+    labels = {key: entry for key, entry in npy_labels.items()
+              if key not in mat_labels}
+    for key, entry in mat_labels.items():
+        npy = npy_labels.get(key)
+        labels[key] = npy if npy is not None and \
+            is_current(index.get(entry.name), entry) else entry
+    return labels
+
+
+def convert_label(mat_path, verify=True):
+    """ Writes the .npy file of a .mat label atomically. The label keeps the
+        dtype it is stored with, so reading the .npy file casts it like
+        reading the .mat file.
+
+    Returns:
+        dict: size and mtime of the source.
+
+    Raises:
+        RuntimeError: if the written file does not match the source in dtype
+            or values.
+    """
+    mat_path = Path(mat_path)
+    stat = os.stat(mat_path)
+    mask = decode_label(mat_path, 'mask', dtype=None)
+    npy_path = mat_path.with_suffix('.npy')
+    with atomic_write(npy_path, 'w+b') as npy_file:
+        np.save(npy_file, np.ascontiguousarray(mask))
+        if verify:
+            npy_file.seek(0)
+            converted = np.load(npy_file)
+            floating = mask.dtype.kind in 'fc'
+            if converted.dtype != mask.dtype or \
+                    not np.array_equal(converted, mask, equal_nan=floating):
+                raise RuntimeError(f'{npy_path} does not match {mat_path}!')
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def convert_labels(root_dir, workers=None, verify=True, force=False):
+    """ Converts all .mat labels of a root_dir, which are not converted yet
+        or changed since their conversion.
+
+    Args:
+        root_dir (string): Directory with img folder and label folder.
+        workers (int, optional): Number of converting threads.
+        verify (bool): Compare every written file with its source.
+        force (bool): Convert all labels again.
+
+    Returns:
+        int: number of converted labels.
+    """
+    label_dir = Path(root_dir) / 'Labels'
+    index = load_index(label_dir)
+    with os.scandir(label_dir) as entries:
+        mats = [entry for entry in entries
+                if entry.name.endswith('.mat') and entry.is_file()]
+    index = {entry.name: index[entry.name] for entry in mats
+             if entry.name in index}
+    todo = [entry for entry in mats
+            if force or not is_current(index.get(entry.name), entry) or
+            not os.path.exists(Path(entry.path).with_suffix('.npy'))]
+
+    with ThreadPoolExecutor(workers) as pool:
+        for entry, record in zip(todo, pool.map(
+                lambda entry: convert_label(entry.path, verify), todo)):
+            index[entry.name] = record
+
+    with atomic_write(label_dir / INDEX_FILE, 'w') as index_file:
+        json.dump(index, index_file)
+    return len(todo)
+
+
+def main(argv=None):
+    """ Command line entry point of the label conversion."""
+    parser = argparse.ArgumentParser(
+        description='Converts the .mat labels of a root_dir to .npy.')
+    parser.add_argument('root_dir')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-verify', action='store_true',
+                        help='skip the comparison with the .mat labels')
+    parser.add_argument('--force', action='store_true',
+                        help='convert unchanged labels again')
+    args = parser.parse_args(argv)
+    count = convert_labels(args.root_dir, args.workers, not args.no_verify,
+                           args.force)
+    print(f'{count} labels converted', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+""" This module holds the functions which decode the images and labels of the
+    NasaBoxSupDataset into uint8 ndarrays. They are shared by the cache and
+    the manifest, which both need the decoded data outside of __getitem__.
+    scipy is only imported once a .mat label is read. Masks converted by
+    boxsup-convert-labels are read as .npy files.
+"""
+
+from __future__ import absolute_import
+import numpy as np
+from PIL import Image
+
+
+def _scipy_io():
+    import scipy.io  # pylint: disable=import-outside-toplevel
+    return scipy.io
+
+
+def is_npy(mask_path):
+    """ Checks if a path or file object holds a .npy array."""
+    if hasattr(mask_path, 'read'):
+        position = mask_path.tell()
+        magic = mask_path.read(len(np.lib.format.MAGIC_PREFIX))
+        mask_path.seek(position)
+        return magic == np.lib.format.MAGIC_PREFIX
+    return str(mask_path).endswith('.npy')
+
+
+def decode_image(img_path):
+    """ Decodes a png image into a H x W x 3 uint8 ndarray."""
+    return np.asarray(Image.open(img_path).convert('RGB'))
+
+
+def decode_label(mask_path, labeltype='mask', dtype=np.uint8):
+    """ Decodes a label (.mat or .npy for 'mask', .png for 'image') into an
+        uint8 ndarray, dtype=None keeps the stored dtype.
+    """
+    if labeltype == 'mask' and is_npy(mask_path):
+        mask = np.load(mask_path)
+    elif labeltype == 'mask':
+        mask = _scipy_io().loadmat(mask_path)['mask_data']
+    else:
+        mask = np.asarray(Image.open(mask_path))
+    return mask if dtype is None else mask.astype(dtype, copy=False)
+
+
+def decode_sample(img_path, mask_path, labeltype='mask'):
+    """ Decodes an image/label pair into uint8 ndarrays.
+
+    Args:
+        img_path (string): Path of the png image.
+        mask_path (string): Path of the label (.mat, .npy or .png).
+        labeltype (string): 'mask' or 'image', see NasaBoxSupDataset.
+
+    Returns:
+        tuple: image as H x W x 3 and label as H x W (x C) uint8 ndarray.
+    """
+    return decode_image(img_path), decode_label(mask_path, labeltype)
+
+
+def sample_shapes(img_path, mask_path, labeltype='mask'):
+    """ Reads the shapes of an image/label pair from the file headers,
+        without decoding the data.
+
+    Returns:
+        tuple: shape of the decoded image and of the decoded label.
+    """
+    with Image.open(img_path) as image:
+        img_shape = (image.height, image.width, 3)
+    if labeltype == 'mask' and is_npy(mask_path):
+        mask_shape = np.load(mask_path, mmap_mode='r').shape
+    elif labeltype == 'mask':
+        shapes = {name: shape
+                  for name, shape, _ in _scipy_io().whosmat(mask_path)}
+        mask_shape = tuple(shapes['mask_data'])
+    else:
+        with Image.open(mask_path) as mask:
+            bands = len(mask.getbands())
+            mask_shape = (mask.height, mask.width) + \
+                ((bands,) if bands > 1 else ())
+    return img_shape, mask_shape
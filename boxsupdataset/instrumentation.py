@@ -0,0 +1,130 @@
+""" This module holds the StageTimer class, which records the wall time of
+    the stages of NasaBoxSupDataset.__getitem__ (image decode, label load,
+    transform and target_transform). The records are kept in a shared memory
+    block with one row per DataLoader worker, so the main process sees the
+    aggregated numbers of all workers. Only the reader threads inside of one
+    process share a row, they are serialized by a lock of the process.
+"""
+
+from __future__ import absolute_import
+from multiprocessing import shared_memory
+import math
+import os
+import threading
+import numpy as np
+from torch.utils.data import get_worker_info
+
+STAGES = ('image', 'label_mat', 'label_npy', 'label_png', 'label_packed',
+          'cache', 'transform', 'target_transform')
+
+
+class StageTimer(object):
+    """ Collects count, time, bytes read and a latency histogram per stage.
+
+    The histogram has BINS_PER_OCTAVE logarithmic bins per doubling of the
+    latency, starting at one microsecond, so the percentiles are accurate to
+    about 10 percent.
+
+    Args:
+        stages (tuple): Names of the stages.
+        max_workers (int): Largest number of DataLoader workers.
+        callback (callable, optional): Called with stage, seconds and bytes
+            for every record, e.g. to export to a metrics pipeline. It runs
+            inside the worker process.
+    """
+    BINS_PER_OCTAVE = 4
+    BINS = 128
+    FIELDS = 3
+
+    def __init__(self, stages=STAGES, max_workers=64, callback=None) -> None:
+        assert callback is None or callable(callback), \
+            'callback needs to be a callable.'
+        self.stages = tuple(stages)
+        self.callback = callback
+        self._index = {stage: index for index, stage in enumerate(self.stages)}
+        self._shape = (max_workers + 1, len(self.stages),
+                       self.FIELDS + self.BINS)
+        size = int(np.prod(self._shape)) * np.dtype(np.float64).itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._owner = os.getpid()
+        self._array = np.ndarray(self._shape, np.float64, self._shm.buf)
+        self._array[:] = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'stages': self.stages, 'callback': self.callback,
+                'name': self._shm.name, 'shape': self._shape}
+
+    def __setstate__(self, state):
+        self.stages = state['stages']
+        self.callback = state['callback']
+        self._index = {stage: index for index, stage in enumerate(self.stages)}
+        self._shape = state['shape']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = None
+        self._array = np.ndarray(self._shape, np.float64, self._shm.buf)
+        self._lock = threading.Lock()
+
+    def __del__(self):
+        self.close()
+
+    def record(self, stage, seconds, nbytes=0):
+        """ Adds one measurement of a stage."""
+        worker = get_worker_info()
+        row = self._array[0 if worker is None else worker.id + 1,
+                          self._index[stage]]
+        micros = seconds * 1e6
+        bin_index = 0 if micros <= 1 else \
+            int(math.log2(micros) * self.BINS_PER_OCTAVE) + 1
+        with self._lock:
+            row[0] += 1
+            row[1] += seconds
+            row[2] += nbytes
+            row[self.FIELDS + min(bin_index, self.BINS - 1)] += 1
+        if self.callback is not None:
+            self.callback(stage, seconds, nbytes)
+
+    def stats(self):
+        """ Aggregated numbers of all processes.
+
+        Returns:
+            dict: stage -> count, total_s, mean_ms, p50_ms, p99_ms and bytes
+        """
+        totals = self._array.sum(axis=0)
+        result = {}
+        for stage, row in zip(self.stages, totals):
+            count = int(row[0])
+            if not count:
+                continue
+            result[stage] = {'count': count,
+                             'total_s': float(row[1]),
+                             'mean_ms': float(row[1] / count * 1e3),
+                             'p50_ms': self._percentile(row, 0.5),
+                             'p99_ms': self._percentile(row, 0.99),
+                             'bytes': int(row[2])}
+        return result
+
+    def _percentile(self, row, quantile):
+        cumulative = np.cumsum(row[self.FIELDS:])
+        bin_index = int(np.searchsorted(cumulative, quantile * cumulative[-1]))
+        if bin_index == 0:
+            return 1e-3
+        # geometric center of the bin in ms
+        return 2 ** ((bin_index - 0.5) / self.BINS_PER_OCTAVE) * 1e-3
+
+    def reset(self):
+        """ Clears all records."""
+        self._array[:] = 0
+
+    def close(self):
+        """ Releases the shared memory, the creating process (not a forked
+            copy) also removes it.
+        """
+        shm = getattr(self, '_shm', None)
+        if shm is None:
+            return
+        self._array = None
+        self._shm = None
+        shm.close()
+        if self._owner == os.getpid():
+            shm.unlink()
@@ -0,0 +1,235 @@
+""" This module holds the label helpers of the NasaBoxSupDataset:
+        ClassTable: Reads the classes file into typed columns, without
+            pandas.
+        ClassEncoder: Maps mask values or label colors to contiguous class
+            indices with a lookup table built from the classes table.
+        PackedLabel: Stores a label run-length encoded or bit-packed and
+            decodes it on demand.
+"""
+
+from __future__ import absolute_import
+import csv
+import hashlib
+import numpy as np
+
+VALUE_COLUMNS = ('value', 'id', 'class_id', 'label', 'index')
+COLOR_COLUMNS = (('r', 'g', 'b'), ('red', 'green', 'blue'))
+
+
+def _find_column(columns, candidates):
+    names = {str(column).strip().lower(): column for column in columns}
+    for candidate in candidates:
+        if candidate in names:
+            return names[candidate]
+    return None
+
+
+def _is_integer(classes, column):
+    return np.issubdtype(np.asarray(classes[column]).dtype, np.integer)
+
+
+def _parse_column(values):
+    """ Converts the strings of a column to int64, float64 or str, like the
+        type inference of pandas.read_csv.
+    """
+    for dtype in (np.int64, np.float64):
+        try:
+            return np.array([dtype(value) for value in values], dtype=dtype)
+        except (ValueError, OverflowError):
+            continue
+    return np.array(values, dtype=str)
+
+
+class ClassTable(object):
+    """ Table of the classes file.
+
+    The file is a comma separated table with a header row. Every column is
+    an ndarray of int64, float64 or str, accessed by its name like the
+    column of a DataFrame.
+
+    Args:
+        path (string): Path of the classes file.
+    """
+    def __init__(self, path) -> None:
+        with open(path, newline='') as classfile:
+            rows = [row for row in csv.reader(classfile) if row]
+        assert rows, \
+            "the classes file needs a header row"
+        header, rows = rows[0], rows[1:]
+        assert all(len(row) == len(header) for row in rows), \
+            "every row of the classes file needs a value for every column"
+        self.columns = header
+        self._data = {column: _parse_column([row[index] for row in rows])
+                      for index, column in enumerate(header)}
+        self._length = len(rows)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, column) -> np.ndarray:
+        return self._data[column]
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(columns={self.columns}, ' \
+               f'rows={self._length})'
+
+    def to_dataframe(self):
+        """ Converts the table into a pandas DataFrame."""
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+        return pd.DataFrame({column: self._data[column]
+                             for column in self.columns})
+
+
+def pack_colors(label):
+    """ Packs the colors of a H x W x C label into H x W int64 as 0xRRGGBB."""
+    label = label[..., :3].astype(np.int64)
+    return (label[..., 0] << 16) | (label[..., 1] << 8) | label[..., 2]
+
+
+class ClassEncoder(object):
+    """ Encodes labels to the contiguous class index of the classes table.
+
+    The class index is the row of a class in the table. Masks are mapped by
+    the value column of the table (value, id, class_id, label or index, else
+    the first other integer column, else the row itself). Color labels are
+    mapped by the r, g, b (or red, green, blue) columns. Unknown values get
+    ignore_index.
+
+    Args:
+        classes (ClassTable): Table of the classes file, a DataFrame works
+            as well.
+        value_column (string, optional): Column with the mask values.
+        ignore_index (int): Class index of unknown values.
+    """
+    def __init__(self, classes, value_column=None,
+                 ignore_index: int = 255) -> None:
+        assert 0 <= ignore_index <= 255, \
+            "ignore_index needs to fit into uint8"
+        columns = list(classes.columns)
+        if value_column is None:
+            color_names = {name for names in COLOR_COLUMNS for name in names}
+            integer_columns = [
+                column for column in columns
+                if _is_integer(classes, column) and
+                str(column).strip().lower() not in color_names]
+            value_column = _find_column(integer_columns, VALUE_COLUMNS)
+            if value_column is None and integer_columns:
+                value_column = integer_columns[0]
+        if value_column is None:
+            values = np.arange(len(classes))
+        else:
+            values = np.asarray(classes[value_column]).astype(np.int64)
+        assert len(values) <= ignore_index, \
+            "too many classes for an uint8 class index"
+        self.ignore_index = ignore_index
+        self.num_classes = len(values)
+        self.lut = np.full(max(256, int(values.max(initial=0)) + 1),
+                           ignore_index, dtype=np.uint8)
+        self.lut[values] = np.arange(len(values), dtype=np.uint8)
+
+        self.colors = None
+        for names in COLOR_COLUMNS:
+            color_columns = [_find_column(columns, (name,)) for name in names]
+            if None not in color_columns:
+                colors = np.stack([np.asarray(classes[column])
+                                   for column in color_columns], axis=-1)
+                colors = pack_colors(colors)
+                order = np.argsort(colors)
+                self.colors = (colors[order], order.astype(np.uint8))
+                break
+
+    def __call__(self, label) -> np.ndarray:
+        label = np.asarray(label)
+        if label.ndim == 3:
+            return self.encode_colors(label)
+        if label.size and label.max() >= len(self.lut):
+            lut = np.full(int(label.max()) + 1, self.ignore_index, np.uint8)
+            lut[:len(self.lut)] = self.lut
+            self.lut = lut
+        return self.lut[label]
+
+    def fingerprint(self):
+        """ Digest of the mapping, equal for encoders which encode every
+            label the same way.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        lut = self.lut
+        # the lut grows with unknown values, which map to ignore_index
+        known = np.flatnonzero(lut != self.ignore_index)
+        lut = lut[:max(256, known[-1] + 1 if len(known) else 0)]
+        digest.update(np.array([self.ignore_index]).tobytes())
+        digest.update(lut.tobytes())
+        if self.colors is not None:
+            for array in self.colors:
+                digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def encode_colors(self, label):
+        """ Maps a color label to class indices."""
+        if self.colors is None:
+            raise RuntimeError('the classes table has no color columns!')
+        colors, classes = self.colors
+        packed = pack_colors(label)
+        index = np.minimum(np.searchsorted(colors, packed), len(colors) - 1)
+        return np.where(colors[index] == packed, classes[index],
+                        np.uint8(self.ignore_index))
+
+
+class PackedLabel(object):
+    """ Label stored run-length encoded ('rle') or bit-packed ('bitpack').
+
+    Run-length encoding suits labels of few large uniform regions like box
+    supervision masks. Bit-packing stores every value with 1, 2, 4 or 8 bits
+    depending on the largest value.
+    """
+    __slots__ = ('method', 'shape', 'dtype', 'values', 'lengths', 'bits')
+
+    METHODS = ('rle', 'bitpack')
+
+    def __init__(self, label, method='rle') -> None:
+        assert method in self.METHODS, \
+            "method needs to be 'rle' or 'bitpack'"
+        label = np.asarray(label)
+        self.method = method
+        self.shape = label.shape
+        self.dtype = label.dtype
+        flat = label.ravel()
+        if method == 'rle':
+            starts = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+            starts = np.concatenate(([0], starts)) if flat.size else starts
+            self.values = flat[starts]
+            self.lengths = np.diff(
+                np.concatenate((starts, [flat.size]))).astype(np.uint32)
+            self.bits = None
+        else:
+            assert label.dtype == np.uint8, \
+                "bitpack needs an uint8 label"
+            top = int(flat.max(initial=0))
+            self.bits = next(bits for bits in (1, 2, 4, 8) if top < 2 ** bits)
+            per_byte = 8 // self.bits
+            padded = np.zeros(-(-flat.size // per_byte) * per_byte, np.uint8)
+            padded[:flat.size] = flat
+            padded = padded.reshape(-1, per_byte)
+            shifts = np.arange(per_byte, dtype=np.uint8) * self.bits
+            self.values = np.bitwise_or.reduce(padded << shifts, axis=1)
+            self.lengths = None
+
+    @property
+    def nbytes(self):
+        """ Size of the encoded data."""
+        size = self.values.nbytes
+        return size if self.lengths is None else size + self.lengths.nbytes
+
+    def decode(self, dtype=None) -> np.ndarray:
+        """ Decodes the label, as uint8 or e.g. int64 array."""
+        dtype = self.dtype if dtype is None else dtype
+        if self.method == 'rle':
+            flat = np.repeat(self.values.astype(dtype, copy=False),
+                             self.lengths)
+        else:
+            per_byte = 8 // self.bits
+            shifts = np.arange(per_byte, dtype=np.uint8) * self.bits
+            mask = np.uint8((1 << self.bits) - 1)
+            flat = ((self.values[:, np.newaxis] >> shifts) & mask).ravel()
+            flat = flat[:int(np.prod(self.shape))].astype(dtype, copy=False)
+        return flat.reshape(self.shape)
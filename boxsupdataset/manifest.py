@@ -0,0 +1,320 @@
+""" This module holds the Manifest class and the pairing of image and label
+    files. The manifest is a persistent index of a NasaBoxSupDataset root_dir
+    with paths, sizes, content hashes, image shapes, label dtype, labeltype
+    and class histogram of every pair. Every pair is decoded once when it is
+    added, pairs which fail are recorded with their error. It is read when
+    present and only the changed files are processed when the Images or
+    Labels folder changed.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import hashlib
+import io
+import json
+import os
+import warnings
+import numpy as np
+from PIL import Image
+from .decode import decode_label
+from .convert import select_labels
+from .utils import atomic_write
+
+LABEL_SUFFIXES = {'mask': ('.mat',), 'image': ('.png',)}
+
+
+def image_key(name):
+    """ Name of the pair an image file belongs to."""
+    return name.split('.png')[0]
+
+
+def label_key(name):
+    """ Name of the pair a label file belongs to."""
+    return name.split('_label')[0]
+
+
+def scan_dir(path, suffixes, key):
+    """ Lists the files of a folder with one of the suffixes.
+
+    Returns:
+        dict: key of the pair -> os.DirEntry
+    """
+    files = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffixes) and entry.is_file():
+                files[key(entry.name)] = entry
+    return files
+
+
+def pair_files(root_dir, labeltype='mask'):
+    """ Pairs the images and labels of a root_dir by their name.
+
+    Images and labels are joined on the name of the pair, so a missing file
+    only drops its own pair, which is reported with a warning. .mat labels
+    are replaced by their .npy conversion, if it is up to date.
+
+    Returns:
+        dict: key of the pair -> (image os.DirEntry, label os.DirEntry)
+    """
+    if labeltype not in LABEL_SUFFIXES:
+        raise RuntimeError(f'{labeltype} is not defined!')
+    root_dir = Path(root_dir)
+    images = scan_dir(root_dir / 'Images', ('.png',), image_key)
+    suffixes = LABEL_SUFFIXES[labeltype]
+    if labeltype == 'mask':
+        # the .mat labels and their .npy conversions in one pass
+        found = scan_dir(root_dir / 'Labels', suffixes + ('.npy',),
+                         lambda name: (label_key(name),
+                                       os.path.splitext(name)[1]))
+        labels = select_labels(
+            root_dir / 'Labels',
+            {key: entry for (key, suffix), entry in found.items()
+             if suffix in suffixes},
+            {key: entry for (key, suffix), entry in found.items()
+             if suffix == '.npy'})
+    else:
+        labels = scan_dir(root_dir / 'Labels', suffixes, label_key)
+    orphans = sorted(images.keys() ^ labels.keys())
+    if orphans:
+        warnings.warn(f'{len(orphans)} images or labels without partner are '
+                      f'skipped: {orphans[:10]}')
+    return {key: (images[key], labels[key])
+            for key in images.keys() & labels.keys()}
+
+
+def snapshot(pairs):
+    """ Names, sizes and mtimes of paired files, see pair_files.
+
+    Returns:
+        dict: key of the pair -> [image name, label name, image size,
+            image mtime, label size, label mtime]
+    """
+    result = {}
+    for key, (img, mask) in pairs.items():
+        img_stat, mask_stat = img.stat(), mask.stat()
+        result[key] = [img.name, mask.name,
+                       img_stat.st_size, img_stat.st_mtime_ns,
+                       mask_stat.st_size, mask_stat.st_mtime_ns]
+    return result
+
+
+def compare_snapshots(old, new):
+    """ Differences of two snapshots.
+
+    Returns:
+        dict: sorted keys of the 'added', 'removed' and 'changed' pairs.
+    """
+    return {'added': sorted(new.keys() - old.keys()),
+            'removed': sorted(old.keys() - new.keys()),
+            'changed': sorted(key for key in new.keys() & old.keys()
+                              if new[key] != old[key])}
+
+
+def class_histogram(mask):
+    """ Counts the pixels of every label value. Color labels are counted per
+        color, which is packed as 0xRRGGBB.
+    """
+    if mask.ndim == 3:
+        mask = mask[..., :3].astype(np.int64)
+        mask = (mask[..., 0] << 16) | (mask[..., 1] << 8) | mask[..., 2]
+    values, counts = np.unique(mask, return_counts=True)
+    return {str(value): int(count) for value, count in zip(values, counts)}
+
+
+class Manifest(object):
+    """ Persistent index of the image/label pairs of a root_dir.
+
+    Args:
+        root_dir (string): Directory with img folder and label folder.
+        labeltype (string): 'mask' or 'image', see NasaBoxSupDataset.
+        path (string, optional): File of the manifest. Without path the
+            manifest is kept in memory only.
+        workers (int, optional): Number of threads which read new files.
+    """
+    VERSION = 2
+    DIRS = ('Images', 'Labels')
+
+    def __init__(self, root_dir, labeltype='mask', path=None,
+                 workers=None) -> None:
+        self.root_dir = Path(root_dir)
+        self.labeltype = labeltype
+        self.path = None if path is None else Path(path)
+        self.workers = workers
+        self.entries = {}
+        self.dir_mtimes = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        """ Reads the manifest file.
+
+        Returns:
+            bool: True if a manifest of the same version and labeltype was
+                found.
+        """
+        if self.path is None or not self.path.exists():
+            return False
+        with open(self.path) as manifest_file:
+            content = json.load(manifest_file)
+        if content.get('version') != self.VERSION or \
+                content.get('labeltype') != self.labeltype:
+            return False
+        self.entries = content['entries']
+        self.dir_mtimes = content['dirs']
+        return True
+
+    def save(self):
+        """ Writes the manifest file atomically. A read-only location only
+            results in a warning.
+        """
+        if self.path is None:
+            return
+        content = {'version': self.VERSION,
+                   'labeltype': self.labeltype,
+                   'dirs': self.dir_mtimes,
+                   'entries': self.entries}
+        try:
+            with atomic_write(self.path, 'w') as manifest_file:
+                json.dump(content, manifest_file)
+        except OSError as error:
+            warnings.warn(f'manifest could not be written: {error}')
+
+    def current_dir_mtimes(self):
+        """ mtimes of the Images and Labels folder."""
+        return {name: os.stat(self.root_dir / name).st_mtime_ns
+                for name in self.DIRS}
+
+    def update(self, force=False):
+        """ Brings the manifest up to date with the root_dir.
+
+        If the mtimes of the Images and Labels folder are unchanged, nothing
+        is listed at all. Otherwise the folders are paired again and only
+        pairs with a new size or mtime are read.
+
+        Args:
+            force (bool): Rescan even if the folders seem unchanged, e.g.
+                after files were rewritten in place.
+
+        Returns:
+            dict: keys of the 'added', 'removed' and 'changed' pairs.
+        """
+        changes = {'added': [], 'removed': [], 'changed': []}
+        dir_mtimes = self.current_dir_mtimes()
+        if not force and self.entries and dir_mtimes == self.dir_mtimes:
+            return changes
+
+        pairs = pair_files(self.root_dir, self.labeltype)
+        todo = []
+        for key, (img, mask) in pairs.items():
+            stat = (img.stat(), mask.stat())
+            entry = self.entries.get(key)
+            if entry is not None and entry['image'] == img.name and \
+                    entry['label'] == mask.name and \
+                    entry['image_size'] == stat[0].st_size and \
+                    entry['label_size'] == stat[1].st_size and \
+                    entry['image_mtime'] == stat[0].st_mtime_ns and \
+                    entry['label_mtime'] == stat[1].st_mtime_ns:
+                continue
+            changes['added' if entry is None else 'changed'].append(key)
+            todo.append((key, img, mask, stat))
+        changes['removed'] = sorted(self.entries.keys() - pairs.keys())
+        for key in changes['removed']:
+            del self.entries[key]
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            for key, entry in zip([job[0] for job in todo],
+                                  pool.map(self._read, todo)):
+                self.entries[key] = entry
+        self.dir_mtimes = dir_mtimes
+        return changes
+
+    def _read(self, job):
+        _, img, mask, (img_stat, mask_stat) = job
+        entry = {'image': img.name,
+                 'label': mask.name,
+                 'image_size': img_stat.st_size,
+                 'label_size': mask_stat.st_size,
+                 'image_mtime': img_stat.st_mtime_ns,
+                 'label_mtime': mask_stat.st_mtime_ns,
+                 'image_hash': None,
+                 'label_hash': None,
+                 'shape': None,
+                 'label_shape': None,
+                 'label_dtype': None,
+                 'classes': {},
+                 'error': None}
+        try:
+            with open(img.path, 'rb') as img_file:
+                img_data = img_file.read()
+            with open(mask.path, 'rb') as mask_file:
+                mask_data = mask_file.read()
+            entry['image_hash'] = hashlib.blake2b(img_data,
+                                                  digest_size=16).hexdigest()
+            entry['label_hash'] = hashlib.blake2b(mask_data,
+                                                  digest_size=16).hexdigest()
+            with Image.open(io.BytesIO(img_data)) as image:
+                entry['shape'] = [image.height, image.width,
+                                  len(image.getbands())]
+                image.convert('RGB')
+            label = decode_label(io.BytesIO(mask_data), self.labeltype,
+                                 dtype=None)
+            entry['label_shape'] = list(label.shape)
+            entry['label_dtype'] = str(label.dtype)
+            entry['classes'] = class_histogram(label)
+            if list(label.shape[:2]) != entry['shape'][:2]:
+                raise ValueError(f'label shape {list(label.shape)} does not '
+                                 f'match image shape {entry["shape"]}')
+        except Exception as error:  # pylint: disable=broad-except
+            entry['error'] = f'{type(error).__name__}: {error}'
+        return entry
+
+    def broken(self):
+        """ Keys of the pairs which could not be read, with their error."""
+        return {key: entry['error'] for key, entry in self.entries.items()
+                if entry.get('error')}
+
+    def duplicates(self):
+        """ Groups of pairs with identical image and label content.
+
+        Returns:
+            list: sorted key lists, the first key of a group is kept by
+                items(drop_duplicates=True).
+        """
+        groups = {}
+        for key in sorted(self.entries, key=lambda key:
+                          self.entries[key]['image']):
+            entry = self.entries[key]
+            if entry.get('error'):
+                continue
+            groups.setdefault((entry['image_hash'], entry['label_hash']),
+                              []).append(key)
+        return [keys for keys in groups.values() if len(keys) > 1]
+
+    def items(self, drop_broken=True, drop_duplicates=False):
+        """ (image path, label path) tuples sorted by the image name.
+
+        Args:
+            drop_broken (bool): Skip pairs which could not be read.
+            drop_duplicates (bool): Keep only the first pair of every group
+                of duplicates.
+        """
+        skip = set(self.broken()) if drop_broken else set()
+        if drop_duplicates:
+            skip.update(key for keys in self.duplicates() for key in keys[1:])
+        entries = sorted((entry for key, entry in self.entries.items()
+                          if key not in skip),
+                         key=lambda entry: entry['image'])
+        return [(self.root_dir / 'Images' / entry['image'],
+                 self.root_dir / 'Labels' / entry['label'])
+                for entry in entries]
+
+    def class_histogram(self):
+        """ Pixel count of every label value over all pairs."""
+        histogram = {}
+        for entry in self.entries.values():
+            for value, count in entry['classes'].items():
+                histogram[value] = histogram.get(value, 0) + count
+        return histogram
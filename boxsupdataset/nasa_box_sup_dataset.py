@@ -5,14 +5,23 @@
 
 from __future__ import absolute_import
 from pathlib import Path
-import glob
+from time import perf_counter
+import io
+import os
+import sys
+import warnings
 import torch
 from torch.utils.data import Dataset
-from pandas.core.frame import DataFrame
-import pandas as pd
-import scipy.io as sio
 from PIL import Image
-import numpy as np
+from .cache import PackedSamples, SampleCache, SharedSampleStore
+from .manifest import (Manifest, compare_snapshots, image_key, pair_files,
+                       snapshot)
+from .decode import decode_label
+from .labels import ClassEncoder, ClassTable, PackedLabel
+from .instrumentation import StageTimer
+from .prefetch import AsyncReader, read_bytes
+from .pyramid import level_dir
+from .statistics import StatisticsCache, compute_statistics
 
 
 class NasaBoxSupDataset(Dataset):
@@ -20,11 +29,36 @@ class NasaBoxSupDataset(Dataset):
 
     def __init__(
         self, classfile, root_dir, labeltype='mask' , transform=None,
-        target_transfrom=None):
+        target_transfrom=None, cache_dir=None, manifest=None,
+        encode_labels=False, label_storage=None, timer=None,
+        in_memory=False, reader=None, level=0, drop_duplicates=False):
         """
         Args:
             root_dir (string): Directory with img folder and label folder.
             transform (callable, optional): Optional transform to be applied.
+            cache_dir (string, optional): Directory of a SampleCache. If set,
+                all samples are decoded once into the cache and read as
+                memory-mapped uint8 ndarrays afterwards.
+            manifest (string, optional): File of a Manifest. If present, the
+                pairs are read from it instead of listing root_dir. It is
+                created or updated when files were added or removed. Pairs
+                which could not be decoded are skipped with a warning.
+            encode_labels (bool): Map the label values to the class index of
+                the classes table. Labels are returned as uint8 ndarray.
+            label_storage (string, optional): 'rle' or 'bitpack'. All labels
+                are loaded once and kept in memory in this compact form.
+            timer (StageTimer, optional): Records the time of every stage of
+                __getitem__ over all DataLoader workers.
+            in_memory (bool): Decode all samples once into a shared memory
+                block, which DataLoader workers attach to without copying.
+            reader (AsyncReader, optional): Reads the files of upcoming
+                samples ahead in threads, see PrefetchSampler. Batches are
+                read and decoded in parallel by __getitems__.
+            level (int): Pyramid level to load, 0 is the full resolution,
+                level n is downscaled by 2**n. The levels are built with
+                boxsup-build-pyramid. The classfile is read from root_dir.
+            drop_duplicates (bool): Skip pairs whose image and label content
+                equals an earlier pair, needs a manifest.
         """
         assert (Path(root_dir) / 'Images').exists() and \
             (Path(root_dir) / 'Labels').exists(), \
@@ -33,13 +67,48 @@ class NasaBoxSupDataset(Dataset):
             'transform needs to be a callable.'
         assert labeltype in ('mask', 'image'), \
             'labeltype needs to be \'mask\' or \'image\''
+        assert not (in_memory and cache_dir is not None), \
+            'in_memory and cache_dir can not be used together.'
+        assert label_storage in (None,) + PackedLabel.METHODS, \
+            'label_storage needs to be None, \'rle\' or \'bitpack\''
+        assert not drop_duplicates or manifest is not None, \
+            'drop_duplicates needs a manifest.'
+        assert (level_dir(root_dir, level) / 'Images').exists(), \
+            f'pyramid level {level} does not exist, run boxsup-build-pyramid.'
 
         self.root_dir = Path(root_dir)
+        self.level = level
+        self.drop_duplicates = drop_duplicates
         self.labeltype = labeltype
         self.transform = transform
         self.target_transform = target_transfrom
-        self.classes = pd.read_csv(Path(root_dir) / 'Labels' / Path(classfile))
+        self.timer = timer
+        self.reader = reader
+        self.classes = ClassTable(Path(root_dir) / 'Labels' / Path(classfile))
+        self.manifest = None
+        if manifest is not None:
+            self.manifest = Manifest(self.data_dir, labeltype, manifest)
         self.imgs = self.makeDataset()
+        self._statistics = None
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = SampleCache(cache_dir)
+            if not self.cache.matches(self.imgs, self.labeltype):
+                self.cache.build(self.imgs, self.labeltype)
+        elif in_memory:
+            self.cache = SharedSampleStore(self.imgs, self.labeltype)
+        self.encoder = ClassEncoder(self.classes) if encode_labels else None
+        self.label_storage = label_storage
+        self.packed_labels = None
+        if label_storage is not None:
+            self.packed_labels = [self._pack_label(mask_path)
+                                  for _, mask_path in self.imgs]
+
+    def _pack_label(self, mask_path):
+        mask = decode_label(mask_path, self.labeltype)
+        if self.encoder is not None:
+            mask = self.encoder(mask)
+        return PackedLabel(mask, self.label_storage)
 
     def __len__(self):
         return len(self.imgs)
@@ -47,21 +116,60 @@ class NasaBoxSupDataset(Dataset):
     def __getitem__(self, idx):
         if torch.is_tensor(idx):
             idx = idx.toList()
+        return self._load(idx)
 
-        img_path, mask_path = self.imgs[idx]
-        img = Image.open(img_path).convert('RGB')
-        if self.labeltype == 'mask':
-            mask = sio.loadmat(mask_path)['mask_data']
-            mask = Image.fromarray(mask.astype(np.uint8))
+    def __getitems__(self, indices):
+        """ Loads a batch of samples. With a reader the files of all samples
+            are read concurrently and decoded in parallel.
+        """
+        if self.reader is None or self.cache is not None:
+            return [self._load(idx) for idx in indices]
+        sources = self.reader.read_many(indices, self.imgs)
+        return self.reader.map(lambda args: self._load(*args),
+                               zip(indices, sources))
+
+    def _load(self, idx, sources=None):
+        """ Loads a sample, sources are the image and label file or their
+            contents, by default the files of the item.
+        """
+        tic = perf_counter() if self.timer is not None else None
+        if self.cache is not None:
+            img, mask = self.cache[idx]
+            if self.packed_labels is not None:
+                mask = self.packed_labels[idx].decode()
+            elif self.encoder is not None:
+                mask = self.encoder(mask)
+            tic = self._record('cache', tic, img.nbytes + mask.nbytes)
         else:
-            mask = Image.open(mask_path)
+            if sources is None and self.reader is not None:
+                sources = self.reader.get(idx, self.imgs[idx])
+            elif sources is None and self.timer is not None:
+                # read once, so the bytes are counted without another stat
+                img_path, mask_path = self.imgs[idx]
+                sources = (io.BytesIO(read_bytes(img_path)),
+                           mask_path if self.packed_labels is not None
+                           else io.BytesIO(read_bytes(mask_path)))
+            elif sources is None:
+                sources = self.imgs[idx]
+            img = Image.open(sources[0]).convert('RGB')
+            tic = self._record('image', tic, sources[0])
+            mask = self.loadLabel(idx, sources[1])
+            if self.packed_labels is not None:
+                tic = self._record('label_packed', tic)
+            else:
+                # the stage is named after the decoded format, e.g. label_npy
+                # for converted masks
+                suffix = Path(self.imgs[idx][1]).suffix.lstrip('.').lower()
+                tic = self._record(f'label_{suffix}', tic, sources[1])
 
         sample = {'image': img, 'label': mask}
 
         if self.transform is not None:
             sample['image'] = self.transform(sample['image'])
+            tic = self._record('transform', tic)
         if self.target_transform is not None:
             sample['label'] = self.target_transform(sample['label'])
+            tic = self._record('target_transform', tic)
 
         return sample
 
@@ -74,31 +182,162 @@ class NasaBoxSupDataset(Dataset):
                 f'imgs={self.imgs}'
                 )
 
+    def _record(self, stage, tic, read=0):
+        """ Records the time since tic for a stage, if a timer is set. read
+            is a number of bytes or the BytesIO of the file which was read.
+        """
+        if self.timer is None:
+            return None
+        toc = perf_counter()
+        if isinstance(read, io.BytesIO):
+            read = read.getbuffer().nbytes
+        self.timer.record(stage, toc - tic, read)
+        return toc
+
+    def loadLabel(self, idx, source=None):
+        """ Loads the label of an item.
+            The label is returned as PIL image, unless it is encoded to class
+            indices or kept in label_storage, which both return uint8
+            ndarrays. source is the label file or its content, by default
+            the label file of the item.
+        """
+        if self.packed_labels is not None:
+            return self.packed_labels[idx].decode()
+        mask_path = self.imgs[idx][1] if source is None else source
+        if self.encoder is not None:
+            return self.encoder(decode_label(mask_path, self.labeltype))
+        if self.labeltype == 'mask':
+            return Image.fromarray(decode_label(mask_path, self.labeltype))
+        return Image.open(mask_path)
+
     def makeDataset(self):
         """ Creates the items for the Dataset.
-            Checks if label and the img are matching and returns the items list
-            with img and label as tuple.
+            Images and labels are paired by their name and returned as items
+            list with img and label as tuple, sorted by the img name. With a
+            manifest only files which changed since the last run are read.
+        """
+        if self.manifest is not None:
+            self.manifest.load()
+            return self._scan_manifest()[0]
+        self._scan_mtimes = self._dir_mtimes()
+        pairs = pair_files(self.data_dir, self.labeltype)
+        self._snapshot = snapshot(pairs)
+        return self._items(pairs)
+
+    def _items(self, pairs):
+        pairs = sorted(pairs.values(), key=lambda pair: pair[0].name)
+        return [(self.data_dir / Path('Images') / Path(img.name),
+                 self.data_dir / Path('Labels') / Path(mask.name))
+                for img, mask in pairs]
+
+    def _dir_mtimes(self):
+        return {name: os.stat(self.data_dir / name).st_mtime_ns
+                for name in Manifest.DIRS}
+
+    def _scan_manifest(self, force=False, warn=True):
+        """ Updates and saves the manifest, returns its items and the
+            changes.
         """
-        items = []
-        img_path = self.root_dir / Path('Images')
-        mask_path = self.root_dir / Path('Labels')
-        if self.labeltype == 'image':
-            label_files = sorted(glob.glob1(mask_path, "*.png"))
-        elif self.labeltype == 'mask':
-            label_files = sorted(glob.glob1(mask_path, "*.mat"))
+        dir_mtimes = self.manifest.dir_mtimes
+        changes = self.manifest.update(force)
+        if any(changes.values()) or dir_mtimes != self.manifest.dir_mtimes:
+            self.manifest.save()
+        broken = self.manifest.broken()
+        if broken and (warn or any(changes.values())):
+            warnings.warn(f'{len(broken)} pairs could not be read and are '
+                          f'skipped: {sorted(broken.items())[:10]}')
+        return (self.manifest.items(drop_duplicates=self.drop_duplicates),
+                changes)
+
+    def refresh(self, force=False):
+        """ Picks up the pairs which were added, removed or changed since the
+            last scan and updates imgs in place.
+            Nothing is listed while the mtimes of the Images and Labels
+            folder are unchanged. Otherwise the folders are paired again and
+            compared with the snapshot of the last scan, which is the
+            manifest if one is set. Only the affected entries of the cache,
+            in_memory store and label_storage are decoded again and the
+            reader's buffer is dropped. A CachedTransform needs no update,
+            its keys follow the image content or size and mtime of the
+            source file.
+            DataLoader workers hold a copy of the dataset, they see the new
+            items once they are started again, e.g. with the next epoch
+            unless persistent_workers is set.
+
+        Args:
+            force (bool): Rescan even if the folders seem unchanged, e.g.
+                after files were rewritten in place.
+
+        Returns:
+            dict: keys of the 'added', 'removed' and 'changed' pairs.
+        """
+        old_items = list(self.imgs)
+        if self.manifest is not None:
+            items, changes = self._scan_manifest(force, warn=False)
         else:
-            raise RuntimeError('{self.labeltype} is not defined!')
-        image_files = sorted(glob.glob1(img_path, "*.png"))
-        for index, img in enumerate(image_files):
-            if label_files[index].split('_label')[0] == \
-               img.split('.png')[0]:
-                items.append((
-                    self.root_dir / Path('Images') / Path(img),
-                    self.root_dir / Path('Labels') / Path(label_files[index])
-                    ))
-            else:
-                raise RuntimeError('img and label are not the same!')
-        return items
+            dir_mtimes = self._dir_mtimes()
+            if not force and dir_mtimes == self._scan_mtimes:
+                return {'added': [], 'removed': [], 'changed': []}
+            pairs = pair_files(self.data_dir, self.labeltype)
+            current = snapshot(pairs)
+            changes = compare_snapshots(self._snapshot, current)
+            self._snapshot, self._scan_mtimes = current, dir_mtimes
+            items = self._items(pairs)
+        if items == old_items and not changes['changed']:
+            return changes
+
+        outdated = set(changes['changed']) | set(changes['removed'])
+        stale = [item for item in old_items
+                 if image_key(item[0].name) in outdated]
+        self.imgs[:] = items
+        self._invalidate(old_items, stale)
+        return changes
+
+    def statistics(self, workers=None, chunksize=16, progress=False):
+        """ Computes the statistics of all items: mean and std of every
+            channel in [0, 1], the pixel histogram of every channel, the
+            pixels of every class of the classes table and the image sizes.
+            The samples are read in a process pool, their counts are kept
+            and only new or changed samples are read again, so call refresh
+            first to include new files. With a manifest the counts are
+            stored next to it and checked against its content hashes.
+
+        Args:
+            workers, chunksize, progress: see compute_statistics.
+
+        Returns:
+            dict: images, pixels, mean, std, histogram, class_pixels and
+                sizes, see PartialStatistics.summary.
+        """
+        if self.manifest is not None:
+            tokens = {key: [entry['image_hash'], entry['label_hash']]
+                      for key, entry in self.manifest.entries.items()}
+        else:
+            tokens = self._snapshot
+        if self._statistics is None:
+            path = None
+            if self.manifest is not None and self.manifest.path is not None:
+                path = self.manifest.path.with_suffix('.stats.npz')
+            self._statistics = StatisticsCache(path)
+            self._statistics.load()
+        result = compute_statistics(self.imgs, tokens, self._statistics,
+                                    self.labeltype, workers, chunksize,
+                                    progress)
+        return result.summary(self.classes, self.labeltype)
+
+    def _invalidate(self, old_items, stale):
+        """ Drops the derived data of stale items and aligns it with imgs."""
+        if self.reader is not None:
+            self.reader.clear()
+        if self.cache is not None:
+            self.cache = self.cache.update(self.imgs, self.labeltype, stale)
+        if self.packed_labels is not None:
+            packed = dict(zip(old_items, self.packed_labels))
+            for item in stale:
+                packed.pop(item, None)
+            self.packed_labels = [packed[item] if item in packed else
+                                  self._pack_label(item[1])
+                                  for item in self.imgs]
 
     @property
     def root_dir(self):
@@ -111,6 +350,33 @@ class NasaBoxSupDataset(Dataset):
             raise TypeError("value needs to be of Type Path")
         self._root_dir = value
 
+    @property
+    def level(self):
+        """ level Getter"""
+        return self._level
+
+    @level.setter
+    def level(self, value):
+        if not isinstance(value, int):
+            raise TypeError("value needs to be of Type int")
+        self._level = value
+
+    @property
+    def drop_duplicates(self):
+        """ drop_duplicates Getter"""
+        return self._drop_duplicates
+
+    @drop_duplicates.setter
+    def drop_duplicates(self, value):
+        if not isinstance(value, bool):
+            raise TypeError("value needs to be of Type bool")
+        self._drop_duplicates = value
+
+    @property
+    def data_dir(self):
+        """ Directory of the loaded pyramid level."""
+        return level_dir(self.root_dir, self.level)
+
     @property
     def labeltype(self):
         """ labeltype Getter"""
@@ -155,6 +421,83 @@ class NasaBoxSupDataset(Dataset):
             raise TypeError("value needs to be of Type list")
         self._imgs = value
 
+    @property
+    def label_storage(self):
+        """ label_storage Getter"""
+        return self._label_storage
+
+    @label_storage.setter
+    def label_storage(self, value):
+        if not (isinstance(value, str) or value is None):
+            raise TypeError("value needs to be of Type str")
+        self._label_storage = value
+
+    @property
+    def cache(self):
+        """ cache Getter"""
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        if not (isinstance(value, PackedSamples) or value is None):
+            raise TypeError("value needs to be of Type PackedSamples")
+        self._cache = value
+
+    @property
+    def manifest(self):
+        """ manifest Getter"""
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, value):
+        if not (isinstance(value, Manifest) or value is None):
+            raise TypeError("value needs to be of Type Manifest")
+        self._manifest = value
+
+    @property
+    def encoder(self):
+        """ encoder Getter"""
+        return self._encoder
+
+    @encoder.setter
+    def encoder(self, value):
+        if not (isinstance(value, ClassEncoder) or value is None):
+            raise TypeError("value needs to be of Type ClassEncoder")
+        self._encoder = value
+
+    @property
+    def packed_labels(self):
+        """ packed_labels Getter"""
+        return self._packed_labels
+
+    @packed_labels.setter
+    def packed_labels(self, value):
+        if not (isinstance(value, list) or value is None):
+            raise TypeError("value needs to be of Type list")
+        self._packed_labels = value
+
+    @property
+    def timer(self):
+        """ timer Getter"""
+        return self._timer
+
+    @timer.setter
+    def timer(self, value):
+        if not (isinstance(value, StageTimer) or value is None):
+            raise TypeError("value needs to be of Type StageTimer")
+        self._timer = value
+
+    @property
+    def reader(self):
+        """ reader Getter"""
+        return self._reader
+
+    @reader.setter
+    def reader(self, value):
+        if not (isinstance(value, AsyncReader) or value is None):
+            raise TypeError("value needs to be of Type AsyncReader")
+        self._reader = value
+
     @property
     def classes(self):
         """ classes Getter"""
@@ -162,7 +505,11 @@ class NasaBoxSupDataset(Dataset):
 
     @classes.setter
     def classes(self, value):
-        if not isinstance(value, DataFrame):
-            raise TypeError("value needs to be of Type DataFrame")
+        # a DataFrame can only exist if pandas was imported already
+        pandas = sys.modules.get('pandas')
+        if not (isinstance(value, ClassTable) or
+                (pandas is not None and isinstance(value, pandas.DataFrame))):
+            raise TypeError(
+                "value needs to be of Type ClassTable or DataFrame")
         self._classes = value
     
\ No newline at end of file
@@ -0,0 +1,239 @@
+""" This module holds the asynchronous reading of the NasaBoxSupDataset:
+        AsyncReader: Reads the raw bytes of upcoming samples with a thread
+            pool into a bounded buffer. The number of reads in flight is
+            tuned from the observed read latency and consume rate.
+        PrefetchSampler: Wraps a sampler and passes its order to the reader
+            of the dataset, so the reads run ahead of __getitem__.
+    The files are only read ahead; decoding happens in __getitem__ (or in
+    parallel for a whole batch in __getitems__) from the buffered bytes.
+"""
+
+from __future__ import absolute_import
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import io
+import math
+import os
+import threading
+from torch.utils.data import Sampler
+
+
+def read_bytes(path):
+    """ Reads a whole file with one call."""
+    with open(path, 'rb') as source:
+        return source.read()
+
+
+class AsyncReader(object):
+    """ Thread pool which reads the files of upcoming samples ahead.
+
+    The depth, the number of samples read ahead, follows Little's law: the
+    average read latency divided by the average time between two requested
+    samples, plus one request of slack, clamped to min_depth and max_depth.
+    Both averages are exponentially weighted, so the depth follows a
+    changing load of the storage. For batches of read_many the interval is
+    measured per sample and min_depth counts whole batches, so the next
+    batch is always in flight.
+
+    The pool is neither pickled nor inherited by forked processes, every
+    DataLoader worker starts its own.
+
+    Args:
+        workers (int): Number of reading threads.
+        min_depth (int): Smallest number of requests read ahead, samples
+            for get and batches for read_many.
+        max_depth (int): Largest number of samples read ahead, this bounds
+            the memory of the buffer. It is raised to min_depth batches if
+            the batches are larger.
+        smoothing (float): Weight of a new measurement in the averages.
+    """
+    def __init__(self, workers: int = 8, min_depth: int = 2,
+                 max_depth: int = 64, smoothing: float = 0.1) -> None:
+        assert workers > 0, \
+            "workers needs to be a positive int"
+        assert 0 < min_depth <= max_depth, \
+            "min_depth needs to be positive and at most max_depth"
+        assert 0. < smoothing <= 1., \
+            "smoothing needs to be in (0, 1]"
+        self.workers = workers
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.smoothing = smoothing
+        self.depth = min_depth
+        self.hits = 0
+        self.misses = 0
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._order = deque()
+        self._latency = None
+        self._interval = None
+        self._last = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_pid', '_pool', '_lock', '_pending', '_order'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _executor(self):
+        if self._pid != os.getpid():
+            # threads and lock of the parent do not exist after a fork
+            self._reset()
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers,
+                                            thread_name_prefix='boxsup-read')
+        return self._pool
+
+    def _read(self, paths):
+        tic = perf_counter()
+        data = tuple(read_bytes(path) for path in paths)
+        self._update('_latency', perf_counter() - tic)
+        return data
+
+    def _update(self, name, value):
+        with self._lock:
+            average = getattr(self, name)
+            setattr(self, name, value if average is None else
+                    average + self.smoothing * (value - average))
+
+    def _request(self, count):
+        """ Measures the interval per sample since the last request of count
+            samples and tunes the depth.
+        """
+        now = perf_counter()
+        if self._last is not None:
+            self._update('_interval', (now - self._last) / count)
+        self._last = now
+        self._tune(count)
+
+    def _tune(self, batch=1):
+        low = self.min_depth * batch
+        if self._latency is None or not self._interval:
+            depth = low
+        else:
+            depth = math.ceil(self._latency / self._interval) + batch
+        self.depth = min(max(depth, low), max(self.max_depth, low))
+
+    def schedule(self, indices, items):
+        """ Appends indices to the order in which samples will be requested.
+
+        Args:
+            indices (iterable): Upcoming indices, e.g. the sampler order.
+            items (list): (image path, label path) tuples of the dataset.
+        """
+        self._executor()
+        with self._lock:
+            self._order.extend((idx, items[idx]) for idx in indices)
+        self._fill()
+
+    def _fill(self):
+        with self._lock:
+            while self._order and len(self._pending) < self.depth:
+                idx, paths = self._order.popleft()
+                if idx not in self._pending:
+                    self._pending[idx] = self._executor().submit(
+                        self._read, paths)
+
+    def get(self, idx, paths):
+        """ Returns the file contents of a sample as BytesIO, from the buffer
+            if it was read ahead, otherwise read right away.
+
+        Args:
+            idx (int): Index of the sample.
+            paths (tuple): Image and label path of the sample.
+        """
+        self._executor()
+        with self._lock:
+            future = self._pending.pop(idx, None)
+            # drop the scheduled entry if it was not submitted yet
+            if future is None and self._order and self._order[0][0] == idx:
+                self._order.popleft()
+        self._request(1)
+        self._fill()
+        if future is None:
+            self.misses += 1
+            data = self._read(paths)
+        else:
+            self.hits += 1
+            data = future.result()
+        return tuple(io.BytesIO(content) for content in data)
+
+    def read_many(self, indices, items):
+        """ Reads the samples of indices concurrently, e.g. a whole batch.
+
+        Returns:
+            list: BytesIO tuples like get in the order of indices.
+        """
+        self._executor()
+        with self._lock:
+            futures = [self._pending.pop(idx, None) for idx in indices]
+            batch = set(indices)
+            while self._order and self._order[0][0] in batch:
+                self._order.popleft()
+        hits = sum(future is not None for future in futures)
+        self.hits += hits
+        self.misses += len(futures) - hits
+        # the missing reads of this batch are queued before the read ahead
+        futures = [self._executor().submit(self._read, items[idx])
+                   if future is None else future
+                   for idx, future in zip(indices, futures)]
+        self._request(max(len(futures), 1))
+        self._fill()
+        return [tuple(io.BytesIO(content) for content in future.result())
+                for future in futures]
+
+    def map(self, func, iterable):
+        """ Runs func over iterable in the threads of the reader."""
+        return list(self._executor().map(func, iterable))
+
+    def clear(self):
+        """ Drops the schedule and the buffered reads."""
+        with self._lock:
+            self._order.clear()
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+
+    def close(self):
+        """ Stops the threads."""
+        self.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+class PrefetchSampler(Sampler):
+    """ Passes the order of a sampler to the reader of the dataset.
+
+    The reader runs in the process of the dataset, so this prefetches for
+    DataLoaders with num_workers=0. With worker processes every batch is
+    read concurrently by NasaBoxSupDataset.__getitems__ instead.
+
+    Args:
+        sampler (Sampler): Sampler which defines the order.
+        dataset (NasaBoxSupDataset): Dataset with an AsyncReader.
+    """
+    def __init__(self, sampler, dataset) -> None:
+        assert dataset.reader is not None, \
+            "dataset needs an AsyncReader"
+        self.sampler = sampler
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def __iter__(self):
+        order = list(self.sampler)
+        self.dataset.reader.clear()
+        self.dataset.reader.schedule(order, self.dataset.imgs)
+        return iter(order)
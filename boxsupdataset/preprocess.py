@@ -0,0 +1,163 @@
+""" This module holds the boxsup-preprocess command. It applies one of the
+    denoise transformations to every image of a root_dir with a process pool
+    and writes the results as a new root_dir, which NasaBoxSupDataset loads
+    directly:
+        out_dir/Images: denoised images as 8 bit png
+        out_dir/Labels: links to the original labels and class files
+    Already written images are skipped, so an interrupted run is resumed by
+    starting the same command again.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import importlib
+import json
+import os
+import shutil
+import numpy as np
+from PIL import Image
+from .manifest import pair_files
+from .utils import Progress, atomic_write
+
+SETTINGS_FILE = 'preprocess.json'
+
+_TRANSFORM = None
+
+
+def parse_params(params):
+    """ Parses 'name=value' strings. true/false become bool values, numbers
+        become float values, everything else stays a string.
+    """
+    kwargs = {}
+    for param in params:
+        name, _, value = param.partition('=')
+        if value.lower() in ('true', 'false'):
+            kwargs[name] = value.lower() == 'true'
+            continue
+        try:
+            kwargs[name] = float(value)
+        except ValueError:
+            kwargs[name] = value
+    return kwargs
+
+
+def build_transform(name, params):
+    """ Creates a transform by its class name. Plain names are looked up in
+        the denoise module, other modules are given as 'module:Class'.
+    """
+    module, _, cls = name.rpartition(':')
+    module = importlib.import_module(
+        module or 'boxsupdataset.transforms.denoise')
+    return getattr(module, cls)(**params)
+
+
+def _init_worker(name, params):
+    global _TRANSFORM
+    _TRANSFORM = build_transform(name, params)
+
+
+def _process_chunk(jobs):
+    for img_path, out_path in jobs:
+        image = np.asarray(Image.open(img_path).convert('RGB'))
+        image = _TRANSFORM({'image': image, 'label': None})['image']
+        image = np.asarray(image)
+        if np.issubdtype(image.dtype, np.floating):
+            image = (np.clip(image, 0, 1) * 255 + 0.5).astype(np.uint8)
+        with atomic_write(out_path) as out_file:
+            Image.fromarray(image).save(out_file, format='PNG')
+    return len(jobs)
+
+
+def link_labels(root_dir, out_dir):
+    """ Links every file of the Labels folder into out_dir/Labels. Copies
+        if the filesystem does not support symlinks.
+    """
+    label_dir = Path(out_dir) / 'Labels'
+    label_dir.mkdir(parents=True, exist_ok=True)
+    for entry in os.scandir(Path(root_dir) / 'Labels'):
+        target = label_dir / entry.name
+        if target.exists() or not entry.is_file():
+            continue
+        try:
+            os.symlink(os.path.abspath(entry.path), target)
+        except OSError:
+            shutil.copy2(entry.path, target)
+
+
+def preprocess(root_dir, out_dir, transform, params=None, labeltype='mask',
+               workers=None, chunksize=16, progress=True):
+    """ Applies a transform to all images of root_dir.
+
+    Args:
+        root_dir (string): Directory with img folder and label folder.
+        out_dir (string): Directory of the preprocessed dataset.
+        transform (string): Name of the transform class, e.g. TotalVariation2.
+        params (dict, optional): Arguments of the transform.
+        labeltype (string): 'mask' or 'image', see NasaBoxSupDataset.
+        workers (int, optional): Number of processes which run the
+            transform, defaults to all cpus.
+        chunksize (int): Number of images one process handles per task.
+        progress (bool): Print the written images, see Progress.
+
+    Returns:
+        int: Number of images which were processed in this run.
+    """
+    params = params or {}
+    out_dir = Path(out_dir)
+    (out_dir / 'Images').mkdir(parents=True, exist_ok=True)
+    settings = {'transform': transform, 'params': params}
+    settings_path = out_dir / SETTINGS_FILE
+    if settings_path.exists():
+        with open(settings_path) as settings_file:
+            if json.load(settings_file) != settings:
+                raise RuntimeError(
+                    f'{out_dir} was preprocessed with other settings!')
+    else:
+        build_transform(transform, params)
+        with open(settings_path, 'w') as settings_file:
+            json.dump(settings, settings_file)
+
+    link_labels(root_dir, out_dir)
+    jobs = []
+    for img, _ in sorted(pair_files(root_dir, labeltype).values(),
+                         key=lambda pair: pair[0].name):
+        out_path = out_dir / 'Images' / img.name
+        if not out_path.exists():
+            jobs.append((Path(img.path), out_path))
+    chunks = [jobs[start:start + chunksize]
+              for start in range(0, len(jobs), chunksize)]
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(transform, params)) as pool, \
+            Progress(len(jobs), 'images', progress) as counter:
+        for future in as_completed([pool.submit(_process_chunk, chunk)
+                                    for chunk in chunks]):
+            counter.update(future.result())
+    return counter.done
+
+
+def main(argv=None):
+    """ Command line entry point of preprocess."""
+    parser = argparse.ArgumentParser(
+        description='Applies a denoise transform to all images of a root_dir.')
+    parser.add_argument('root_dir')
+    parser.add_argument('out_dir')
+    parser.add_argument('--transform', required=True,
+                        help='class of the denoise module, '
+                             'e.g. TotalVariation2')
+    parser.add_argument('--param', action='append', default=[],
+                        help='argument of the transform as name=value')
+    parser.add_argument('--labeltype', default='mask',
+                        choices=('mask', 'image'))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=16)
+    args = parser.parse_args(argv)
+    preprocess(args.root_dir, args.out_dir, args.transform,
+               parse_params(args.param), args.labeltype, args.workers,
+               args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
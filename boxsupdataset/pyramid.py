@@ -0,0 +1,151 @@
+""" This module holds the boxsup-build-pyramid command. It stores downscaled
+    copies of a root_dir next to the originals:
+        root_dir/Pyramid/L1/Images, root_dir/Pyramid/L1/Labels: half size
+        root_dir/Pyramid/L2/...: quarter size, and so on
+    Images are reduced with a box filter, labels with nearest neighbour so no
+    new label values appear. Masks are stored as .npy, png labels as png.
+    NasaBoxSupDataset loads a level with its level argument, which reads only
+    the bytes of that resolution.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import numpy as np
+from PIL import Image
+from .decode import decode_label
+from .manifest import pair_files
+from .utils import Progress, atomic_write
+
+PYRAMID_DIR = 'Pyramid'
+SETTINGS_FILE = 'pyramid.json'
+
+
+def level_dir(root_dir, level):
+    """ Directory of a pyramid level, level 0 is root_dir itself."""
+    root_dir = Path(root_dir)
+    return root_dir if level == 0 else root_dir / PYRAMID_DIR / f'L{level}'
+
+
+def label_name(name, labeltype='mask'):
+    """ File name of a label in the pyramid."""
+    return name.rsplit('.', 1)[0] + ('.npy' if labeltype == 'mask' else '.png')
+
+
+def downscale(image, label, factor=2):
+    """ Reduces an image (PIL) with a box filter and a label (PIL image or
+        ndarray) with nearest neighbour to the same size.
+    """
+    image = image.reduce(factor)
+    if isinstance(label, np.ndarray):
+        label = label[::factor, ::factor]
+    else:
+        label = label.resize(image.size, Image.NEAREST)
+    return image, label
+
+
+def _build_pair(job):
+    img_path, mask_path, root_dir, levels, labeltype, factor = job
+    image = Image.open(img_path).convert('RGB')
+    if labeltype == 'mask':
+        label = decode_label(mask_path, labeltype)
+    else:
+        label = Image.open(mask_path)
+    for level in range(1, levels + 1):
+        image, label = downscale(image, label, factor)
+        out_dir = level_dir(root_dir, level)
+        with atomic_write(out_dir / 'Images' / Path(img_path).name) \
+                as out_file:
+            image.save(out_file, format='PNG')
+        out_path = out_dir / 'Labels' / label_name(Path(mask_path).name,
+                                                   labeltype)
+        with atomic_write(out_path) as out_file:
+            if labeltype == 'mask':
+                np.save(out_file, np.ascontiguousarray(label))
+            else:
+                label.save(out_file, format='PNG')
+    return 1
+
+
+def build_pyramid(root_dir, levels=3, labeltype='mask', factor=2,
+                  workers=None, chunksize=16, progress=True):
+    """ Writes the pyramid levels of all pairs of root_dir. Pairs which
+        exist in every level are skipped, so an interrupted run is resumed by
+        starting it again.
+
+    Args:
+        root_dir (string): Directory with img folder and label folder.
+        levels (int): Number of downscaled levels.
+        labeltype (string): 'mask' or 'image', see NasaBoxSupDataset.
+        factor (int): Size ratio of two neighbouring levels.
+        workers (int, optional): Number of processes which downscale the
+            pairs, defaults to all cpus.
+        chunksize (int): Number of pairs one process handles per task.
+        progress (bool): Print the written pairs, see Progress.
+
+    Returns:
+        int: Number of pairs which were processed in this run.
+    """
+    assert levels > 0, \
+        "levels needs to be a positive int"
+    assert factor > 1, \
+        "factor needs to be larger than 1"
+    root_dir = Path(root_dir)
+    pyramid_dir = root_dir / PYRAMID_DIR
+    pyramid_dir.mkdir(exist_ok=True)
+    settings = {'labeltype': labeltype, 'factor': factor}
+    settings_path = pyramid_dir / SETTINGS_FILE
+    if settings_path.exists():
+        with open(settings_path) as settings_file:
+            stored = json.load(settings_file)
+        if {key: stored[key] for key in settings} != settings:
+            raise RuntimeError(
+                f'{pyramid_dir} was built with other settings!')
+        levels = max(levels, stored['levels'])
+    settings['levels'] = levels
+
+    for level in range(1, levels + 1):
+        for name in ('Images', 'Labels'):
+            (level_dir(root_dir, level) / name).mkdir(parents=True,
+                                                      exist_ok=True)
+    jobs = []
+    for img, mask in sorted(pair_files(root_dir, labeltype).values(),
+                            key=lambda pair: pair[0].name):
+        done = all(
+            (level_dir(root_dir, level) / 'Images' / img.name).exists() and
+            (level_dir(root_dir, level) / 'Labels' /
+             label_name(mask.name, labeltype)).exists()
+            for level in range(1, levels + 1))
+        if not done:
+            jobs.append((img.path, mask.path, root_dir, levels, labeltype,
+                         factor))
+
+    with ProcessPoolExecutor(workers) as pool, \
+            Progress(len(jobs), 'pairs', progress) as counter:
+        for count in pool.map(_build_pair, jobs, chunksize=chunksize):
+            counter.update(count)
+    with open(settings_path, 'w') as settings_file:
+        json.dump(settings, settings_file)
+    return counter.done
+
+
+def main(argv=None):
+    """ Command line entry point of the pyramid builder."""
+    parser = argparse.ArgumentParser(
+        description='Stores downscaled levels of a root_dir.')
+    parser.add_argument('root_dir')
+    parser.add_argument('--levels', type=int, default=3)
+    parser.add_argument('--labeltype', default='mask',
+                        choices=('mask', 'image'))
+    parser.add_argument('--factor', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=16)
+    args = parser.parse_args(argv)
+    build_pyramid(args.root_dir, args.levels, args.labeltype, args.factor,
+                  args.workers, args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
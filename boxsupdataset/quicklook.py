@@ -0,0 +1,233 @@
+""" This module holds the boxsup-quicklook command. It writes mosaics of
+    downscaled images and label overlays for the QA review of a dataset:
+        out_dir/page0000.png, out_dir/page0001.png, ...: rows x columns
+            cells, every cell shows the image and the image with its colored
+            label side by side
+        out_dir/quicklook.json: settings and the dataset index, image and
+            label file and grid cell of every sample on every page
+    Masks and single band label images are colored through a lookup table
+    from the classes table, RGB label images are blended as they are. The
+    pages are built in a process pool with numpy and PIL only, matplotlib
+    is not imported.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import fnmatch
+import json
+import sys
+import numpy as np
+from PIL import Image
+from .decode import decode_label
+from .labels import COLOR_COLUMNS, ClassEncoder, _find_column
+from .utils import Progress, atomic_write
+
+INDEX_FILE = 'quicklook.json'
+# color of mask values which are not in the classes table
+UNKNOWN_COLOR = (255, 0, 255)
+
+
+def class_palette(classes, ignore_index=255):
+    """ Lookup table of the class index to an RGB color.
+
+    The r, g, b (or red, green, blue) columns of the classes table are used
+    if present. Otherwise the hues are spread by the golden ratio, so
+    neighbouring classes get distinct colors.
+
+    Returns:
+        ndarray: 256 x 3 uint8, ignore_index maps to UNKNOWN_COLOR.
+    """
+    count = len(classes)
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    columns = list(classes.columns)
+    for names in COLOR_COLUMNS:
+        color_columns = [_find_column(columns, (name,)) for name in names]
+        if None not in color_columns:
+            lut[:count] = np.stack([np.asarray(classes[column])
+                                    for column in color_columns], axis=-1)
+            break
+    else:
+        hue = (np.arange(count) * 0.618033988749895) % 1. * 6.
+        saturation, value = 0.65, 0.95
+        # HSV to RGB for every class at once
+        offsets = np.array([5., 3., 1.])
+        channel = (offsets + hue[:, np.newaxis]) % 6.
+        weight = np.clip(np.minimum(channel, 4. - channel), 0., 1.)
+        lut[:count] = np.round(255. * value *
+                               (1. - saturation * weight)).astype(np.uint8)
+    lut[ignore_index] = UNKNOWN_COLOR
+    return lut
+
+
+def fit(size, tile):
+    """ Size (width, height) scaled to fit into tile, keeping the aspect."""
+    scale = min(tile[0] / size[0], tile[1] / size[1])
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+
+def _shrink(image, size, resample):
+    """ Reduces an image by the integer part of the scale first, which is
+        much cheaper than resizing from the full resolution.
+    """
+    factor = min(image.width // size[0], image.height // size[1])
+    if factor > 1 and resample != Image.NEAREST:
+        image = image.reduce(factor)
+    return image.resize(size, resample)
+
+
+def render_cell(img_path, mask_path, labeltype, encoder, lut, tile,
+                alpha=0.5):
+    """ Image and label overlay of a sample, downscaled to tile. Masks and
+        single band label images hold mask values, which are encoded and
+        colored by lut. RGB label images are already colored.
+
+    Returns:
+        ndarray: tile height x 2 * tile width x 3 uint8, the sample is
+            aligned to the top left corner of both halves.
+    """
+    image = Image.open(img_path).convert('RGB')
+    size = fit(image.size, tile)
+    image = np.asarray(_shrink(image, size, Image.BILINEAR))
+    label = decode_label(mask_path, labeltype)
+    if label.ndim == 2:
+        classes = np.asarray(_shrink(Image.fromarray(encoder(label)), size,
+                                     Image.NEAREST))
+        colors = lut[classes]
+    else:
+        colors = np.asarray(_shrink(Image.fromarray(label[..., :3]), size,
+                                    Image.NEAREST))
+    overlay = image.astype(np.float32)
+    overlay += alpha * (colors - overlay)
+    cell = np.zeros((tile[1], 2 * tile[0], 3), dtype=np.uint8)
+    cell[:size[1], :size[0]] = image
+    cell[:size[1], tile[0]:tile[0] + size[0]] = overlay
+    return cell
+
+
+def mosaic(cells, columns):
+    """ Arranges equally sized cells row by row into one image, empty cells
+        stay black.
+    """
+    cells = np.asarray(cells)
+    rows = -(-len(cells) // columns)
+    grid = np.zeros((rows * columns,) + cells.shape[1:], dtype=np.uint8)
+    grid[:len(cells)] = cells
+    height, width, channels = cells.shape[1:]
+    return grid.reshape(rows, columns, height, width, channels) \
+        .transpose(0, 2, 1, 3, 4) \
+        .reshape(rows * height, columns * width, channels)
+
+
+def _render_page(job):
+    path, items, labeltype, encoder, lut, tile, columns, alpha = job
+    cells = [render_cell(img_path, mask_path, labeltype, encoder, lut, tile,
+                         alpha)
+             for _, img_path, mask_path in items]
+    with atomic_write(path) as page_file:
+        Image.fromarray(mosaic(cells, columns)).save(page_file, format='PNG')
+    return len(items)
+
+
+def quicklook(dataset, out_dir, indices=None, tile=(128, 128), columns=8,
+              rows=8, alpha=0.5, workers=None, progress=True):
+    """ Writes the mosaic pages and the index of a dataset.
+
+    Args:
+        dataset (NasaBoxSupDataset): Dataset whose imgs, classes and
+            labeltype are used, its transforms are not applied.
+        out_dir (string): Directory of the pages and the index.
+        indices (iterable, optional): Dataset indices of the samples,
+            defaults to all.
+        tile (tuple): (width, height) of the image and of the overlay.
+        columns (int): Cells per row of a page.
+        rows (int): Rows per page.
+        alpha (float): Weight of the label colors in the overlay.
+        workers (int, optional): Number of processes which render the
+            pages, defaults to all cpus.
+        progress (bool): Print the rendered samples, see Progress.
+
+    Returns:
+        dict: the index, which is also written to out_dir.
+    """
+    assert columns > 0 and rows > 0, \
+        "columns and rows need to be positive ints"
+    assert 0. <= alpha <= 1., \
+        "alpha needs to be in [0, 1]"
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if indices is None:
+        indices = range(len(dataset))
+    items = [(idx,) + tuple(dataset.imgs[idx]) for idx in indices]
+    encoder = ClassEncoder(dataset.classes)
+    lut = class_palette(dataset.classes)
+    per_page = columns * rows
+    pages = [items[start:start + per_page]
+             for start in range(0, len(items), per_page)]
+    jobs = [(out_dir / f'page{number:04d}.png', page, dataset.labeltype,
+             encoder, lut, tuple(tile), columns, alpha)
+            for number, page in enumerate(pages)]
+
+    with ProcessPoolExecutor(workers) as pool, \
+            Progress(len(items), 'samples', progress) as counter:
+        for count in pool.map(_render_page, jobs):
+            counter.update(count)
+
+    index = {'tile': list(tile), 'columns': columns, 'rows': rows,
+             'alpha': alpha, 'labeltype': dataset.labeltype,
+             'classes': {str(name): lut[row].tolist() for row, name
+                         in enumerate(dataset.classes[
+                             dataset.classes.columns[0]])},
+             'pages': [{'file': path.name,
+                        'samples': [{'index': idx, 'image': str(img_path),
+                                     'label': str(mask_path),
+                                     'row': cell // columns,
+                                     'column': cell % columns}
+                                    for cell, (idx, img_path, mask_path)
+                                    in enumerate(page)]}
+                       for path, page, *_ in jobs]}
+    with atomic_write(out_dir / INDEX_FILE, 'w') as index_file:
+        json.dump(index, index_file, indent=1)
+    return index
+
+
+def main(argv=None):
+    """ Command line entry point of the quicklook export."""
+    # pylint: disable=import-outside-toplevel
+    from .nasa_box_sup_dataset import NasaBoxSupDataset
+    parser = argparse.ArgumentParser(
+        description='Writes image and label overlay mosaics of a root_dir.')
+    parser.add_argument('root_dir')
+    parser.add_argument('out_dir')
+    parser.add_argument('--classfile', default='classes_bxsp.txt')
+    parser.add_argument('--labeltype', default='mask',
+                        choices=('mask', 'image'))
+    parser.add_argument('--level', type=int, default=0,
+                        help='pyramid level to read, see boxsup-build-pyramid')
+    parser.add_argument('--match', default=None,
+                        help='only images whose name matches this pattern')
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--count', type=int, default=None)
+    parser.add_argument('--tile', type=int, nargs=2, default=(128, 128),
+                        metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--columns', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=8)
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    dataset = NasaBoxSupDataset(args.classfile, args.root_dir, args.labeltype,
+                                transform=np.asarray, level=args.level)
+    indices = [idx for idx, (img_path, _) in enumerate(dataset.imgs)
+               if args.match is None or
+               fnmatch.fnmatch(img_path.name, args.match)]
+    stop = None if args.count is None else args.start + args.count
+    index = quicklook(dataset, args.out_dir, indices[args.start:stop],
+                      args.tile, args.columns, args.rows, args.alpha,
+                      args.workers)
+    print(f'{len(index["pages"])} pages written', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
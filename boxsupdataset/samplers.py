@@ -0,0 +1,199 @@
+""" This module holds the samplers of the NasaBoxSupDataset:
+        ChunkedDistributedSampler: Splits the dataset into chunks of
+            neighbouring indices, which are stored next to each other (sorted
+            files, SampleCache, shards, tiles of one image). The chunks are
+            shuffled per epoch and every rank and DataLoader worker reads
+            contiguous runs of chunks. The position within an epoch is saved
+            with state_dict, so a job resumes exactly where it stopped.
+"""
+
+from __future__ import absolute_import
+import random
+import torch
+from torch.utils.data import Sampler
+
+
+def distributed_rank(rank=None, world_size=None):
+    """ Rank and world size of this node, missing values default to
+        torch.distributed if it is initialized, otherwise to a single node.
+
+    Returns:
+        tuple: rank and world_size.
+    """
+    if rank is None or world_size is None:
+        distributed = torch.distributed.is_available() and \
+            torch.distributed.is_initialized()
+        rank = torch.distributed.get_rank() if distributed else 0
+        world_size = \
+            torch.distributed.get_world_size() if distributed else 1
+    assert 0 <= rank < world_size, \
+        'rank needs to be smaller than world_size'
+    return rank, world_size
+
+
+def chunk_boundaries(length, chunk_size):
+    """ Start indices of chunks of chunk_size, ending with length."""
+    return list(range(0, length, chunk_size)) + [length]
+
+
+class ChunkedDistributedSampler(Sampler):
+    """ Deterministic chunk-wise sampler for distributed training.
+
+    The epoch order is the shuffled list of chunks, every chunk optionally
+    shuffled inside. This order is cut into world_size contiguous parts of
+    equal length (padded by repeating the start of the order, or cut with
+    drop_last), so a rank reads whole chunks apart from the two ends of its
+    part. With num_workers and batch_size the part is further cut into one
+    contiguous segment per DataLoader worker and the batches are interleaved
+    in the round-robin order in which the DataLoader hands them out, so every
+    worker reads its own segment front to back. Only the last batch can be
+    partial.
+
+    The cursor counts the indices of the current epoch which are already
+    yielded. The DataLoader fetches ahead, so pass the number of consumed
+    samples to state_dict for an exact resume.
+
+    Args:
+        length (int): Length of the dataset.
+        chunk_size (int): Number of indices per chunk, e.g. samples_per_shard
+            of pack_shards.
+        boundaries (list, optional): Start indices of the chunks ending with
+            length, replaces chunk_size, e.g. the grid offsets of a
+            NasaBoxSupTileDataset.
+        shuffle (bool): Shuffle the chunks and the indices inside of them.
+        seed (int): Seed of the shuffling, combined with the epoch.
+        rank (int, optional): Rank of this node, defaults to the rank of
+            torch.distributed if it is initialized.
+        world_size (int, optional): Number of nodes, defaults to the
+            world size of torch.distributed if it is initialized.
+        drop_last (bool): Drop the tail instead of padding, so every rank
+            gets the same number of indices.
+        num_workers (int): num_workers of the DataLoader, 0 disables the
+            interleaving.
+        batch_size (int): batch_size of the DataLoader.
+    """
+    def __init__(self, length, chunk_size=64, boundaries=None, shuffle=True,
+                 seed=0, rank=None, world_size=None, drop_last=False,
+                 num_workers=0, batch_size=1) -> None:
+        assert chunk_size > 0, \
+            'chunk_size needs to be a positive int'
+        assert batch_size > 0, \
+            'batch_size needs to be a positive int'
+        rank, world_size = distributed_rank(rank, world_size)
+        if boundaries is None:
+            boundaries = chunk_boundaries(length, chunk_size)
+        assert boundaries[0] == 0 and boundaries[-1] == length, \
+            'boundaries need to start with 0 and end with length'
+        self.length = length
+        self.boundaries = [int(start) for start in boundaries]
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.drop_last = drop_last
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.epoch = 0
+        self.cursor = 0
+        if drop_last:
+            self.num_samples = length // world_size
+        else:
+            self.num_samples = -(-length // world_size)
+
+    def set_epoch(self, epoch):
+        """ Sets the epoch, which changes the shuffling. A restored cursor of
+            another epoch is dropped.
+        """
+        if epoch != self.epoch:
+            self.cursor = 0
+        self.epoch = epoch
+
+    def epoch_order(self):
+        """ All indices of the epoch in chunk order."""
+        rng = random.Random(self.seed * 1000003 + self.epoch)
+        chunks = [range(start, stop) for start, stop
+                  in zip(self.boundaries[:-1], self.boundaries[1:])]
+        if self.shuffle:
+            rng.shuffle(chunks)
+        order = []
+        for chunk in chunks:
+            chunk = list(chunk)
+            if self.shuffle:
+                rng.shuffle(chunk)
+            order.extend(chunk)
+        return order
+
+    def rank_order(self):
+        """ Indices of this rank in the order they are yielded."""
+        order = self.epoch_order()
+        total = self.num_samples * self.world_size
+        while len(order) < total:
+            order.extend(order[:total - len(order)])
+        start = self.rank * self.num_samples
+        order = order[start:start + self.num_samples]
+        if self.num_workers <= 1:
+            return order
+        return self._interleave(order)
+
+    def _interleave(self, order):
+        """ Puts the batches in the round-robin order of the DataLoader,
+            batch k goes to worker k % num_workers. Every worker reads a
+            contiguous segment of order. The segment of the worker which
+            gets the partial last batch comes last, so every other batch is
+            full and stays within one segment.
+        """
+        size = self.batch_size
+        count = -(-len(order) // size)
+        counts = [len(range(worker, count, self.num_workers))
+                  for worker in range(self.num_workers)]
+        last = (count - 1) % self.num_workers
+        segments, start = {}, 0
+        for worker in [worker for worker in range(self.num_workers)
+                       if worker != last] + [last]:
+            stop = min(start + counts[worker] * size, len(order))
+            segments[worker] = order[start:stop]
+            start = stop
+        result = []
+        for step in range(counts[0]):
+            for worker in range(self.num_workers):
+                result.extend(segments[worker][step * size:
+                                               (step + 1) * size])
+        return result
+
+    def __iter__(self):
+        order = self.rank_order()
+        for position in range(self.cursor, len(order)):
+            self.cursor = position + 1
+            yield order[position]
+        self.cursor = 0
+
+    def __len__(self):
+        return self.num_samples - self.cursor
+
+    def state_dict(self, consumed=None):
+        """ Position of the sampler.
+
+        Args:
+            consumed (int, optional): Number of samples of the current epoch
+                which were used, defaults to the yielded indices.
+        """
+        return {'epoch': self.epoch,
+                'cursor': self.cursor if consumed is None else consumed,
+                'seed': self.seed,
+                'world_size': self.world_size,
+                'length': self.length}
+
+    def load_state_dict(self, state):
+        """ Restores the position, the next iteration starts at the cursor.
+
+        Raises:
+            ValueError: if the state was saved with another world_size or
+                dataset length, which changes the order.
+        """
+        if state['world_size'] != self.world_size or \
+                state['length'] != self.length:
+            raise ValueError(
+                'the state was saved with another world_size or dataset!')
+        self.epoch = state['epoch']
+        self.seed = state['seed']
+        self.cursor = state['cursor']
@@ -0,0 +1,258 @@
+""" This module holds the NasaBoxSupShardDataset, a streaming companion of the
+    NasaBoxSupDataset. Instead of opening two small files per sample, the
+    image/label pairs are read sequentially from tar shards, which are
+    written by pack_shards. The shards are split between the nodes of a
+    distributed run and the workers of the DataLoader, and the samples are
+    mixed with a shuffle buffer. Every node reads the same number of
+    samples, so the ranks of a distributed run stay in step.
+"""
+
+from __future__ import absolute_import
+from pathlib import Path
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import tarfile
+from torch.utils.data import IterableDataset, get_worker_info
+from PIL import Image
+from .manifest import pair_files, image_key, label_key
+from .decode import decode_label
+from .samplers import distributed_rank
+from .utils import atomic_write
+
+INDEX_FILE = 'shards.json'
+
+
+def pack_shards(root_dir, out_dir, labeltype='mask', samples_per_shard=1000):
+    """ Packs the image/label pairs of a root_dir into tar shards.
+
+    Every pair is stored as two consecutive members with the original file
+    names. An index file with the number of samples per shard is written
+    next to the shards.
+
+    Args:
+        root_dir (string): Directory with img folder and label folder.
+        out_dir (string): Directory the shards are written to.
+        labeltype (string): 'mask' or 'image', see NasaBoxSupDataset.
+        samples_per_shard (int): Number of pairs in one shard.
+
+    Returns:
+        list: Paths of the written shards.
+    """
+    assert samples_per_shard > 0, \
+        'samples_per_shard needs to be positive'
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    pairs = sorted(pair_files(root_dir, labeltype).values(),
+                   key=lambda pair: pair[0].name)
+    shards = []
+    for start in range(0, len(pairs), samples_per_shard):
+        chunk = pairs[start:start + samples_per_shard]
+        path = out_dir / f'shard-{len(shards):06d}.tar'
+        with atomic_write(path) as out_file, \
+                tarfile.open(fileobj=out_file, mode='w') as shard:
+            for img, mask in chunk:
+                shard.add(img.path, arcname=img.name)
+                shard.add(mask.path, arcname=mask.name)
+        shards.append({'name': path.name, 'samples': len(chunk)})
+    with atomic_write(out_dir / INDEX_FILE, 'w') as index_file:
+        json.dump({'labeltype': labeltype, 'shards': shards}, index_file)
+    return [out_dir / shard['name'] for shard in shards]
+
+
+def read_shard(path, labeltype='mask', start=0, stop=None):
+    """ Streams the decoded samples of one shard, optionally only the
+        samples start to stop. Samples before start are not decoded.
+
+    Yields:
+        dict: sample with image and label like NasaBoxSupDataset returns it.
+    """
+    pending = {}
+    index = 0
+    with tarfile.open(path, 'r|') as shard:
+        for member in shard:
+            if not member.isfile():
+                continue
+            stem, suffix = os.path.splitext(member.name)
+            if stem.endswith('_label'):
+                key, slot = label_key(member.name), 'label'
+            elif suffix == '.png':
+                key, slot = image_key(member.name), 'image'
+            else:
+                continue
+            data = shard.extractfile(member).read()
+            pending.setdefault(key, {})[slot] = data
+            if len(pending[key]) == 2:
+                pair = pending.pop(key)
+                if index >= start:
+                    yield decode_pair(pair, labeltype)
+                index += 1
+                if stop is not None and index >= stop:
+                    return
+
+
+def decode_pair(pair, labeltype='mask'):
+    """ Decodes the raw bytes of an image/label pair."""
+    img = Image.open(io.BytesIO(pair['image'])).convert('RGB')
+    if labeltype == 'mask':
+        mask = Image.fromarray(decode_label(io.BytesIO(pair['label'])))
+    else:
+        mask = Image.open(io.BytesIO(pair['label']))
+    return {'image': img, 'label': mask}
+
+
+class NasaBoxSupShardDataset(IterableDataset):
+    """ Nasa Box Sup dataset streamed from tar shards. """
+
+    def __init__(
+        self, shard_dir, transform=None, target_transform=None,
+        shuffle_buffer=0, shuffle_shards=True, seed=0, rank=None,
+        world_size=None, drop_last=False):
+        """
+        Args:
+            shard_dir (string): Directory with the shards of pack_shards.
+            transform (callable, optional): Optional transform to be applied.
+            target_transform (callable, optional): Optional transform of the
+                label.
+            shuffle_buffer (int): Number of samples which are mixed, 0 keeps
+                the order of the shards.
+            shuffle_shards (bool): Shuffle the shard order every epoch.
+            seed (int): Seed of the shuffling, combined with the epoch.
+            rank (int, optional): Rank of this node, defaults to the rank of
+                torch.distributed if it is initialized.
+            world_size (int, optional): Number of nodes, defaults to the
+                world size of torch.distributed if it is initialized.
+            drop_last (bool): Drop the samples which do not fill up all
+                nodes instead of repeating samples, so every node gets the
+                same number of samples.
+        """
+        assert (Path(shard_dir) / INDEX_FILE).exists(), \
+            'shard_dir does not contain a shard index.'
+        assert transform is None or callable(transform), \
+            'transform needs to be a callable.'
+        assert target_transform is None or callable(target_transform), \
+            'target_transform needs to be a callable.'
+
+        super().__init__()
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir / INDEX_FILE) as index_file:
+            index = json.load(index_file)
+        self.labeltype = index['labeltype']
+        self.shards = index['shards']
+        self.transform = transform
+        self.target_transform = target_transform
+        self.shuffle_buffer = shuffle_buffer
+        self.shuffle_shards = shuffle_shards
+        self.seed = seed
+        self.epoch = 0
+        self.rank, self.world_size = distributed_rank(rank, world_size)
+        self.drop_last = drop_last
+        total = sum(shard['samples'] for shard in self.shards)
+        if drop_last:
+            self.num_samples = total // self.world_size
+        else:
+            self.num_samples = -(-total // self.world_size)
+
+    def __len__(self):
+        return self.num_samples
+
+    def set_epoch(self, epoch):
+        """ Sets the epoch, which changes the shuffling."""
+        self.epoch = epoch
+
+    def rank_shards(self):
+        """ Parts of the shards which are read by this node. Like the
+            ChunkedDistributedSampler, the shards of the epoch are cut into
+            world_size contiguous parts of num_samples, padded by repeating
+            the first shards, so a node reads whole shards apart from the
+            two ends of its part.
+
+        Returns:
+            list: (path, start, stop) tuples, the samples start to stop of
+                the shard at path.
+        """
+        shards = [shard for shard in self.shards if shard['samples'] > 0]
+        if self.shuffle_shards:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        begin = self.rank * self.num_samples
+        end = begin + self.num_samples
+        plan, position = [], 0
+        for shard in itertools.cycle(shards) if shards else ():
+            if position >= end:
+                break
+            stop = position + shard['samples']
+            if max(begin, position) < min(end, stop):
+                plan.append((self.shard_dir / shard['name'],
+                             max(begin, position) - position,
+                             min(end, stop) - position))
+            position = stop
+        return plan
+
+    def worker_shards(self):
+        """ Parts of the shards which are read by this node and DataLoader
+            worker, see rank_shards.
+        """
+        plan = self.rank_shards()
+        worker = get_worker_info()
+        if worker is not None:
+            plan = plan[worker.id::worker.num_workers]
+        return plan
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id = 0 if worker is None else worker.id
+        rng = random.Random(
+            (self.seed + self.epoch) * 65536 + self.rank * 256 + worker_id)
+        buffer = []
+        for path, start, stop in self.worker_shards():
+            for sample in read_shard(path, self.labeltype, start, stop):
+                if self.shuffle_buffer <= 0:
+                    yield self._transform(sample)
+                    continue
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+                index = rng.randrange(len(buffer))
+                buffer[index], sample = sample, buffer[index]
+                yield self._transform(sample)
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._transform(sample)
+
+    def _transform(self, sample):
+        if self.transform is not None:
+            sample['image'] = self.transform(sample['image'])
+        if self.target_transform is not None:
+            sample['label'] = self.target_transform(sample['label'])
+        return sample
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}'
+                f'Attirbutes:'
+                f'shard_dir={self.shard_dir},'
+                f'shards={len(self.shards)},'
+                f'rank={self.rank}/{self.world_size},'
+                f'transforms={self.transform}'
+                )
+
+
+def main(argv=None):
+    """ Command line entry point of pack_shards."""
+    parser = argparse.ArgumentParser(
+        description='Packs the Images and Labels of a root_dir into shards.')
+    parser.add_argument('root_dir')
+    parser.add_argument('out_dir')
+    parser.add_argument('--labeltype', default='mask',
+                        choices=('mask', 'image'))
+    parser.add_argument('--samples-per-shard', type=int, default=1000)
+    args = parser.parse_args(argv)
+    shards = pack_shards(args.root_dir, args.out_dir, args.labeltype,
+                         args.samples_per_shard)
+    print(f'{len(shards)} shards written to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+""" This module holds the statistics of a NasaBoxSupDataset:
+        PartialStatistics: Mergeable counts of a part of the dataset, the
+            pixel histogram of every channel, the pixels of every label
+            value and the image sizes. Mean and std follow exactly from the
+            histograms of the uint8 images.
+        StatisticsCache: The histogram and counts of every sample, stored
+            next to the manifest. Only samples which are new or changed are
+            read again.
+        compute_statistics: Reads the samples in chunks in a process pool
+            and merges the partial results.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import json
+import numpy as np
+from .decode import decode_sample
+from .labels import ClassEncoder
+from .manifest import class_histogram, image_key
+from .utils import Progress, atomic_write
+
+BINS = 256
+
+
+class PartialStatistics(object):
+    """ Counts of a part of the dataset, merged with merge or +.
+
+    Args:
+        channels (int): Number of image channels.
+    """
+    def __init__(self, channels: int = 3) -> None:
+        self.images = 0
+        self.histogram = np.zeros((channels, BINS), dtype=np.int64)
+        self.classes = {}
+        self.sizes = {}
+
+    def add(self, histogram, classes, shape):
+        """ Adds the counts of one sample.
+
+        Args:
+            histogram (ndarray): C x 256 pixel counts of the image.
+            classes (dict): label value -> pixel count.
+            shape (tuple): height and width of the image.
+        """
+        self.images += 1
+        self.histogram += histogram
+        for value, count in classes.items():
+            self.classes[value] = self.classes.get(value, 0) + count
+        size = f'{shape[0]}x{shape[1]}'
+        self.sizes[size] = self.sizes.get(size, 0) + 1
+        return self
+
+    def merge(self, other):
+        """ Adds the counts of another part."""
+        self.images += other.images
+        self.histogram += other.histogram
+        for value, count in other.classes.items():
+            self.classes[value] = self.classes.get(value, 0) + count
+        for size, count in other.sizes.items():
+            self.sizes[size] = self.sizes.get(size, 0) + count
+        return self
+
+    def __add__(self, other):
+        return PartialStatistics(len(self.histogram)).merge(self).merge(other)
+
+    @property
+    def pixels(self):
+        """ Number of pixels per channel."""
+        return int(self.histogram[0].sum()) if len(self.histogram) else 0
+
+    @property
+    def mean(self):
+        """ Mean of every channel, scaled to [0, 1] like ToTensor."""
+        values = np.arange(BINS) / (BINS - 1.)
+        return self.histogram @ values / max(self.pixels, 1)
+
+    @property
+    def std(self):
+        """ Standard deviation of every channel, scaled to [0, 1]."""
+        values = np.arange(BINS) / (BINS - 1.)
+        variance = self.histogram @ values ** 2 / max(self.pixels, 1) - \
+            self.mean ** 2
+        return np.sqrt(np.maximum(variance, 0.))
+
+    def summary(self, classes=None, labeltype='mask'):
+        """ The statistics as JSON compatible dict.
+
+        Args:
+            classes (ClassTable, optional): Names the label values with the
+                first text column of the classes table, unknown values keep
+                their value.
+            labeltype (string): 'mask' or 'image', see NasaBoxSupDataset.
+        """
+        return {'images': self.images,
+                'pixels': self.pixels,
+                'mean': self.mean.tolist(),
+                'std': self.std.tolist(),
+                'histogram': self.histogram.tolist(),
+                'class_pixels': name_classes(self.classes, classes,
+                                             labeltype),
+                'sizes': dict(sorted(self.sizes.items()))}
+
+
+def name_classes(counts, classes=None, labeltype='mask'):
+    """ Renames label values (masks) or packed colors (color labels) to the
+        names of the classes table.
+    """
+    if classes is None:
+        return dict(counts)
+    names = next((np.asarray(classes[column]) for column in classes.columns
+                  if np.asarray(classes[column]).dtype.kind in 'UO'),
+                 np.arange(len(classes)).astype(str))
+    encoder = ClassEncoder(classes)
+    values = np.array([int(value) for value in counts], dtype=np.int64)
+    if labeltype == 'mask':
+        indices = encoder(values)
+    elif encoder.colors is not None:
+        colors, order = encoder.colors
+        position = np.minimum(np.searchsorted(colors, values),
+                              len(colors) - 1)
+        indices = np.where(colors[position] == values, order[position],
+                           encoder.ignore_index)
+    else:
+        indices = np.full(len(values), encoder.ignore_index)
+    named = {}
+    for value, index in zip(counts, indices):
+        name = str(names[index]) if index < len(names) else str(value)
+        named[name] = named.get(name, 0) + counts[value]
+    return named
+
+
+def sample_statistics(img_path, mask_path, labeltype='mask'):
+    """ Histogram of every channel, label value counts and size of a
+        sample.
+    """
+    image, label = decode_sample(img_path, mask_path, labeltype)
+    channels = image.reshape(-1, image.shape[-1]).T
+    histogram = np.stack([np.bincount(channel, minlength=BINS)
+                          for channel in channels])
+    return histogram, class_histogram(label), list(image.shape[:2])
+
+
+def _read_chunk(job):
+    items, labeltype = job
+    return [(key,) + sample_statistics(img_path, mask_path, labeltype)
+            for key, img_path, mask_path in items]
+
+
+class StatisticsCache(object):
+    """ Counts of every sample with the token of the files they were read
+    from, e.g. the content hashes of the manifest. A sample whose token
+    changed is read again.
+
+    Args:
+        path (string, optional): File of the cache. Without path the cache
+            is kept in memory only.
+    """
+    def __init__(self, path=None) -> None:
+        self.path = None if path is None else Path(path)
+        self.entries = {}
+
+    def load(self):
+        """ Reads the cache file, if it exists."""
+        if self.path is None or not self.path.exists():
+            return
+        with np.load(self.path) as content:
+            meta = json.loads(str(content['meta']))
+            histograms = content['histograms']
+        self.entries = {key: (token, histograms[row], classes, shape)
+                        for row, (key, token, classes, shape)
+                        in enumerate(meta)}
+
+    def save(self):
+        """ Writes the cache file atomically."""
+        if self.path is None:
+            return
+        keys = sorted(self.entries)
+        meta = [[key] + [self.entries[key][field] for field in (0, 2, 3)]
+                for key in keys]
+        histograms = np.array([self.entries[key][1] for key in keys],
+                              dtype=np.int64).reshape(len(keys), -1, BINS)
+        with atomic_write(self.path) as cache_file:
+            np.savez(cache_file, meta=np.array(json.dumps(meta)),
+                     histograms=histograms)
+
+    def get(self, key, token):
+        """ Counts of a sample, None if missing or read from other files."""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != token:
+            return None
+        return entry[1:]
+
+    def put(self, key, token, histogram, classes, shape):
+        """ Stores the counts of a sample."""
+        self.entries[key] = (token, np.asarray(histogram), classes, shape)
+
+    def retain(self, keys):
+        """ Drops the samples which are not in keys."""
+        keys = set(keys)
+        self.entries = {key: entry for key, entry in self.entries.items()
+                        if key in keys}
+
+
+def compute_statistics(items, tokens=None, cache=None, labeltype='mask',
+                       workers=None, chunksize=16, progress=False):
+    """ Merges the counts of all items, reading only the items which are not
+        in the cache.
+
+    Args:
+        items (list): (image path, label path) tuples of the dataset.
+        tokens (dict, optional): key of the pair -> token of its files,
+            without tokens no cache is used.
+        cache (StatisticsCache, optional): Counts of earlier runs, updated
+            with the items which were read.
+        labeltype (string): 'mask' or 'image', see NasaBoxSupDataset.
+        workers (int, optional): Number of processes which count the
+            samples, defaults to all cpus.
+        chunksize (int): Number of samples one process reads per task.
+        progress (bool): Print the read samples, see Progress.
+
+    Returns:
+        PartialStatistics: the counts of all items.
+    """
+    assert chunksize > 0, \
+        "chunksize needs to be a positive int"
+    use_cache = cache is not None and tokens is not None
+    result = PartialStatistics()
+    todo = []
+    for img_path, mask_path in items:
+        key = image_key(Path(img_path).name)
+        cached = cache.get(key, tokens.get(key)) if use_cache else None
+        if cached is None:
+            todo.append((key, img_path, mask_path))
+        else:
+            result.add(*cached)
+
+    jobs = [(todo[start:start + chunksize], labeltype)
+            for start in range(0, len(todo), chunksize)]
+    done = 0
+    if jobs:
+        with ProcessPoolExecutor(workers) as pool, \
+                Progress(len(todo), 'samples', progress) as counter:
+            for samples in pool.map(_read_chunk, jobs):
+                part = PartialStatistics()
+                for key, histogram, classes, shape in samples:
+                    part.add(histogram, classes, shape)
+                    if use_cache:
+                        cache.put(key, tokens[key], histogram, classes,
+                                  shape)
+                result.merge(part)
+                done = counter.update(len(samples))
+    if use_cache:
+        count = len(cache.entries)
+        cache.retain(tokens)
+        if done or len(cache.entries) != count:
+            cache.save()
+    return result
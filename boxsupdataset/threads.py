@@ -0,0 +1,263 @@
+""" This module splits the cpus between the DataLoader workers and the thread
+    pools inside of them:
+        ThreadBudget: worker_init_fn of the DataLoader, which limits torch,
+            the OpenMP/BLAS pools of NumPy and the skimage denoisers to their
+            share of the cpus and optionally pins every worker to its cores.
+        autotune: Times several splits on real samples and returns the
+            ThreadBudget of the fastest.
+    Without a budget every worker starts one thread per cpu in every pool, so
+    num_workers x cpus threads compete for the cores. The boxsup-tune-threads
+    command runs autotune on a root_dir and prints the splits as JSON.
+"""
+
+from __future__ import absolute_import
+import argparse
+import json
+import os
+import time
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                    'VECLIB_MAXIMUM_THREADS')
+
+
+def available_cpus():
+    """ Cpus this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def limit_threads(threads):
+    """ Limits the thread pools of this process to threads.
+
+    torch is limited directly. The native pools of NumPy and scipy are
+    limited with threadpoolctl, if it is installed, and the environment
+    variables cover the libraries which are loaded later.
+
+    Returns:
+        object: the threadpoolctl limiter or None.
+    """
+    for name in THREAD_VARIABLES:
+        os.environ[name] = str(threads)
+    torch.set_num_threads(threads)
+    try:
+        # pylint: disable=import-outside-toplevel
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return None
+    return threadpool_limits(limits=threads)
+
+
+class ThreadBudget(object):
+    """ Split of a cpu budget between DataLoader workers and the threads of
+    every worker. Pass it as worker_init_fn and use num_workers of the split:
+
+        budget = ThreadBudget(num_workers=4)
+        loader = DataLoader(dataset, num_workers=budget.num_workers,
+                            worker_init_fn=budget)
+
+    With num_workers=0 call apply() in the main process instead.
+
+    Args:
+        num_workers (int): Number of DataLoader workers.
+        threads_per_worker (int, optional): Threads of every worker, defaults
+            to the share of total, but at least 1.
+        total (int, optional): Number of cpus to split, defaults to the cpus
+            this process may run on.
+        pin (bool): Pin every worker to its own cores, where the os allows
+            it. Workers share the cores round robin if the budget exceeds
+            total.
+        worker_init_fn (callable, optional): Called with the worker id after
+            the threads are set.
+    """
+    def __init__(self, num_workers, threads_per_worker=None, total=None,
+                 pin=False, worker_init_fn=None) -> None:
+        assert num_workers >= 0, \
+            "num_workers needs to be a non negative int"
+        cpus = available_cpus()
+        if total is None:
+            total = len(cpus)
+        assert total > 0, \
+            "total needs to be a positive int"
+        if threads_per_worker is None:
+            threads_per_worker = max(1, total // max(1, num_workers))
+        assert threads_per_worker > 0, \
+            "threads_per_worker needs to be a positive int"
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.total = total
+        self.pin = pin
+        self.worker_init_fn = worker_init_fn
+        self.cpus = cpus[:total]
+        self._previous = None
+
+    @property
+    def split(self):
+        """ The chosen split as dict."""
+        return {'num_workers': self.num_workers,
+                'threads_per_worker': self.threads_per_worker,
+                'total': self.total,
+                'pin': self.pin}
+
+    def cores(self, worker_id):
+        """ Cores of a worker when pinned."""
+        return [self.cpus[(worker_id * self.threads_per_worker + offset) %
+                          len(self.cpus)]
+                for offset in range(self.threads_per_worker)]
+
+    def apply(self, worker_id=None):
+        """ Limits the threads of this process and pins it, if requested."""
+        environ = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+        threads = torch.get_num_threads()
+        self._previous = (environ, threads,
+                          limit_threads(self.threads_per_worker))
+        if self.pin and worker_id is not None and \
+                hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cores(worker_id))
+
+    def restore(self):
+        """ Undoes apply in the main process."""
+        if self._previous is None:
+            return
+        environ, threads, limiter = self._previous
+        for name, value in environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        torch.set_num_threads(threads)
+        if limiter is not None:
+            limiter.restore_original_limits()
+        self._previous = None
+
+    def __call__(self, worker_id):
+        self.apply(worker_id)
+        if self.worker_init_fn is not None:
+            self.worker_init_fn(worker_id)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_previous'] = None
+        return state
+
+    def __repr__(self) -> str:
+        return (f'{self.__class__.__name__}(num_workers={self.num_workers}, '
+                f'threads_per_worker={self.threads_per_worker}, '
+                f'total={self.total}, pin={self.pin})')
+
+
+def candidate_splits(total):
+    """ Splits which use the whole budget: 0 workers with all threads and
+        every power of two of workers with the remaining threads.
+    """
+    splits = [(0, total)]
+    workers = 1
+    while workers <= total:
+        splits.append((workers, max(1, total // workers)))
+        workers *= 2
+    if splits[-1][0] != total:
+        splits.append((total, 1))
+    return splits
+
+
+def measure_split(dataset, budget, samples=32, batch_size=1, **kwargs):
+    """ Samples per second of a DataLoader with a budget. The first batch,
+        which includes the start of the workers, is not counted.
+    """
+    count = min(samples, len(dataset))
+    subset = Subset(dataset, list(range(count)))
+    if budget.num_workers == 0:
+        budget.apply()
+    try:
+        loader = DataLoader(
+            subset, batch_size=batch_size, num_workers=budget.num_workers,
+            worker_init_fn=budget if budget.num_workers else None, **kwargs)
+        iterator = iter(loader)
+        next(iterator)
+        start = time.perf_counter()
+        measured = sum(len(batch['image']) for batch in iterator)
+        seconds = time.perf_counter() - start
+        del iterator
+    finally:
+        budget.restore()
+    return measured / seconds if seconds > 0 else 0.
+
+
+def autotune(dataset, splits=None, total=None, samples=32, batch_size=1,
+             pin=False, **kwargs):
+    """ Times splits of the cpus on the first samples of a dataset.
+
+    Args:
+        dataset (Dataset): Dataset with the transforms of the training.
+        splits (list, optional): (num_workers, threads_per_worker) tuples,
+            defaults to candidate_splits(total).
+        total (int, optional): Number of cpus, defaults to the cpus this
+            process may run on.
+        samples (int): Number of samples per split.
+        batch_size (int): batch_size of the DataLoader.
+        pin (bool): Pin the workers, see ThreadBudget.
+        kwargs: Other arguments of the DataLoader, e.g. collate_fn.
+
+    Returns:
+        ThreadBudget: the fastest split, its timings attribute holds the
+            samples per second of every split.
+    """
+    if total is None:
+        total = len(available_cpus())
+    if splits is None:
+        splits = candidate_splits(total)
+    timings = []
+    for num_workers, threads_per_worker in splits:
+        budget = ThreadBudget(num_workers, threads_per_worker, total, pin)
+        timings.append((measure_split(dataset, budget, samples, batch_size,
+                                      **kwargs), budget))
+    best = max(timings, key=lambda timing: timing[0])[1]
+    best.timings = [dict(budget.split, samples_per_sec=rate)
+                    for rate, budget in timings]
+    return best
+
+
+def main(argv=None):
+    """ Command line entry point of the autotuning."""
+    # pylint: disable=import-outside-toplevel
+    from .nasa_box_sup_dataset import NasaBoxSupDataset
+    from .preprocess import build_transform, parse_params
+    from .transforms.pipeline import CompiledPipeline
+    from .transforms.utils import ToCompactTensor
+    parser = argparse.ArgumentParser(
+        description='Times splits of the cpus between DataLoader workers '
+                    'and their threads.')
+    parser.add_argument('root_dir')
+    parser.add_argument('--classfile', default='classes_bxsp.txt')
+    parser.add_argument('--labeltype', default='mask',
+                        choices=('mask', 'image'))
+    parser.add_argument('--transform', default=None,
+                        help='class of the denoise module, '
+                             'e.g. TotalVariation')
+    parser.add_argument('--param', action='append', default=[],
+                        help='transform parameter as name=value')
+    parser.add_argument('--samples', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--total', type=int, default=None)
+    parser.add_argument('--pin', action='store_true')
+    args = parser.parse_args(argv)
+
+    transforms = [ToCompactTensor()]
+    if args.transform is not None:
+        transforms.insert(0, build_transform(args.transform,
+                                             parse_params(args.param)))
+    dataset = NasaBoxSupDataset(args.classfile, args.root_dir, args.labeltype,
+                                transform=CompiledPipeline(transforms),
+                                target_transfrom=np.asarray)
+    best = autotune(dataset, total=args.total, samples=args.samples,
+                    batch_size=args.batch_size, pin=args.pin)
+    print(json.dumps({'best': best.split, 'timings': best.timings},
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+""" This module holds the tiled storage and the patch sampling of the
+    NasaBoxSupDataset:
+        TileStore: Stores every image and label as tile-major uint8 array, so
+            a region is read by memory-mapping only the tiles it covers.
+        NasaBoxSupTileDataset: Returns fixed-size patches, either on a
+            deterministic grid or randomly sampled, optionally balanced by the
+            classes of the tiles.
+"""
+
+from __future__ import absolute_import
+from pathlib import Path
+import numpy as np
+from torch.utils.data import Dataset
+from .cache import source_stats
+from .decode import decode_sample
+from .labels import pack_colors
+from .utils import atomic_write
+
+
+def to_tiles(array, tile_size, fill=0):
+    """ Pads an H x W (x C) array to full tiles and reorders it to
+        TY x TX x tile_size x tile_size (x C).
+    """
+    rows = -(-array.shape[0] // tile_size)
+    cols = -(-array.shape[1] // tile_size)
+    padded = np.full((rows * tile_size, cols * tile_size) + array.shape[2:],
+                     fill, dtype=array.dtype)
+    padded[:array.shape[0], :array.shape[1]] = array
+    tiles = padded.reshape((rows, tile_size, cols, tile_size)
+                           + array.shape[2:])
+    return np.ascontiguousarray(np.swapaxes(tiles, 1, 2))
+
+
+def tile_histograms(mask_tiles, palette, shape=None):
+    """ Pixel count of every label value per tile. Color labels are counted
+        per color, palette maps the packed 0xRRGGBB colors to their column
+        and is extended by new colors.
+
+    Args:
+        mask_tiles (ndarray): Label tiles as returned by to_tiles.
+        palette (dict): Column of every packed color seen so far.
+        shape (tuple, optional): Height and width of the label before it was
+            padded to full tiles, the padding is not counted.
+
+    Returns:
+        ndarray: tiles x columns int64.
+    """
+    count = mask_tiles.shape[0] * mask_tiles.shape[1]
+    tile_ids = np.repeat(np.arange(count, dtype=np.int64),
+                         mask_tiles.shape[2] * mask_tiles.shape[3])
+    if mask_tiles.ndim == 5:
+        pixels = pack_colors(mask_tiles).reshape(-1)
+    else:
+        pixels = mask_tiles.reshape(-1)
+    if shape is not None:
+        valid = to_tiles(np.ones(shape[:2], dtype=bool), mask_tiles.shape[2],
+                         False).reshape(-1)
+        tile_ids, pixels = tile_ids[valid], pixels[valid]
+    if mask_tiles.ndim == 5:
+        colors, values = np.unique(pixels, return_inverse=True)
+        columns = np.array([palette.setdefault(int(color), len(palette))
+                            for color in colors], dtype=np.int64)
+        values = columns[values.reshape(-1)]
+    else:
+        values = pixels.astype(np.int64)
+    width = int(values.max(initial=0)) + 1
+    return np.bincount(tile_ids * width + values,
+                       minlength=count * width).reshape(count, width)
+
+
+class TileStore(object):
+    """ Tile-major on-disk store of the decoded samples.
+
+    Every sample is written as two .npy files, image and label, with the
+    tiles of one row stored one after another. The index holds the image
+    shapes, the labeltype and the encoder the store was built with, size and
+    mtime of the source files and the label histogram of every tile, which
+    is used for class balanced sampling. Padding is not counted in the
+    histograms. Color labels are counted per color, tile_colors holds the
+    packed color of every histogram column.
+
+    Args:
+        tile_dir (string): Directory which holds the store files.
+    """
+    INDEX_FILE = 'tiles.npz'
+    MAX_OPEN = 64
+
+    def __init__(self, tile_dir) -> None:
+        self.tile_dir = Path(tile_dir)
+        self._index = None
+        self._open = {}
+
+    def __len__(self):
+        return len(self.index['shapes'])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_open'] = {}
+        return state
+
+    @property
+    def index(self):
+        """ index Getter, loads the index file on first access."""
+        if self._index is None:
+            with np.load(self.tile_dir / self.INDEX_FILE) as index:
+                self._index = {key: index[key] for key in index.files}
+        return self._index
+
+    @property
+    def tile_size(self):
+        """ Edge length of the tiles."""
+        return int(self.index['tile_size'])
+
+    def matches(self, items, tile_size, labeltype='mask', encoder=None):
+        """ Checks if the store was built from the given items with the same
+            settings and their files did not change since, by size and mtime.
+        """
+        if not (self.tile_dir / self.INDEX_FILE).exists():
+            return False
+        index = self.index
+        if any(key not in index for key in ('labeltype', 'encoder', 'stats')):
+            return False
+        sources = [[str(img), str(mask)] for img, mask in items]
+        fingerprint = '' if encoder is None else encoder.fingerprint()
+        return self.tile_size == tile_size and \
+            str(index['labeltype']) == labeltype and \
+            str(index['encoder']) == fingerprint and \
+            index['sources'].tolist() == sources and \
+            np.array_equal(index['stats'], source_stats(items))
+
+    def build(self, items, labeltype='mask', tile_size=256, encoder=None):
+        """ Decodes all items and writes them as tiles.
+
+        Args:
+            items (list): (image path, label path) tuples of the dataset.
+            labeltype (string): 'mask' or 'image'.
+            tile_size (int): Edge length of the tiles.
+            encoder (ClassEncoder, optional): Stores the labels as class
+                indices, padding gets the ignore_index.
+        """
+        self.tile_dir.mkdir(parents=True, exist_ok=True)
+        stats = source_stats(items)
+        fill = 0 if encoder is None else encoder.ignore_index
+        shapes = np.zeros((len(items), 3), dtype=np.int64)
+        histograms = []
+        palette = {}
+        for index, (img_path, mask_path) in enumerate(items):
+            img, mask = decode_sample(img_path, mask_path, labeltype)
+            if encoder is not None:
+                mask = encoder(mask)
+            shapes[index] = img.shape
+            img_tiles = to_tiles(img, tile_size)
+            mask_tiles = to_tiles(mask, tile_size, fill)
+            np.save(self.tile_dir / f'{index:08d}.img.npy', img_tiles)
+            np.save(self.tile_dir / f'{index:08d}.lbl.npy', mask_tiles)
+            histograms.append(tile_histograms(mask_tiles, palette,
+                                              mask.shape))
+        counts = np.array([len(hist) for hist in histograms], dtype=np.int64)
+        width = max([hist.shape[1] for hist in histograms], default=1)
+        tile_hist = np.zeros((int(counts.sum()), width), dtype=np.int64)
+        for offset, hist in zip(np.cumsum(counts) - counts, histograms):
+            tile_hist[offset:offset + len(hist), :hist.shape[1]] = hist
+        used = np.flatnonzero(tile_hist.any(axis=0))
+        top = used[-1] + 1 if len(used) else 1
+        tile_hist = tile_hist[:, :top]
+        if encoder is not None:
+            tile_hist[:, encoder.ignore_index:] = 0
+        tile_colors = np.array(sorted(palette, key=palette.get),
+                               dtype=np.int64)
+        sources = np.array([[str(img), str(mask)] for img, mask in items],
+                           dtype=str).reshape(-1, 2)
+        with atomic_write(self.tile_dir / self.INDEX_FILE) as index:
+            np.savez(index, shapes=shapes, sources=sources, stats=stats,
+                     tile_offsets=np.concatenate(([0], np.cumsum(counts))),
+                     tile_hist=tile_hist, tile_colors=tile_colors,
+                     tile_size=np.array(tile_size),
+                     labeltype=np.array(labeltype),
+                     encoder=np.array('' if encoder is None
+                                      else encoder.fingerprint()))
+        self._index = None
+        self._open = {}
+
+    def _array(self, index, kind):
+        key = (index, kind)
+        if key not in self._open:
+            if len(self._open) >= self.MAX_OPEN:
+                self._open.pop(next(iter(self._open)))
+            self._open[key] = np.load(
+                self.tile_dir / f'{index:08d}.{kind}.npy', mmap_mode='r')
+        return self._open[key]
+
+    def read(self, index, top, left, height, width):
+        """ Reads a region of a sample, only the covered tiles are touched.
+            Parts outside of the image are padded.
+
+        Returns:
+            tuple: image and label region as uint8 ndarrays.
+        """
+        return tuple(self._read(self._array(index, kind),
+                                top, left, height, width)
+                     for kind in ('img', 'lbl'))
+
+    def _read(self, tiles, top, left, height, width):
+        size = tiles.shape[2]
+        ty0, tx0 = max(top, 0) // size, max(left, 0) // size
+        ty1 = min((top + height - 1) // size, tiles.shape[0] - 1)
+        tx1 = min((left + width - 1) // size, tiles.shape[1] - 1)
+        block = tiles[ty0:ty1 + 1, tx0:tx1 + 1]
+        block = np.swapaxes(block, 1, 2).reshape(
+            (block.shape[0] * size, block.shape[1] * size) + tiles.shape[4:])
+        out = np.zeros((height, width) + tiles.shape[4:], dtype=tiles.dtype)
+        row0, col0 = top - ty0 * size, left - tx0 * size
+        src = block[max(row0, 0):max(row0 + height, 0),
+                    max(col0, 0):max(col0 + width, 0)]
+        out[max(-row0, 0):max(-row0, 0) + src.shape[0],
+            max(-col0, 0):max(-col0, 0) + src.shape[1]] = src
+        return out
+
+
+class NasaBoxSupTileDataset(Dataset):
+    """ Nasa Box Sup dataset of fixed-size patches. """
+
+    def __init__(
+        self, dataset, tile_dir, patch_size=256, tile_size=None, mode='grid',
+        samples_per_epoch=None, class_balanced=False, seed=0,
+        transform=None, target_transform=None):
+        """
+        Args:
+            dataset (NasaBoxSupDataset): Dataset the tiles are built from.
+                Its encoder is used for the labels, if set.
+            tile_dir (string): Directory of the TileStore. It is built if it
+                does not match the dataset.
+            patch_size (int): Edge length of the returned patches.
+            tile_size (int, optional): Edge length of the stored tiles,
+                defaults to patch_size.
+            mode (string): 'grid' returns the patches of a regular grid over
+                every image, 'random' samples samples_per_epoch patches.
+            samples_per_epoch (int, optional): Length in 'random' mode,
+                defaults to the number of grid patches.
+            class_balanced (bool): In 'random' mode, draw tiles with a
+                probability inverse to the frequency of their classes.
+            seed (int): Seed of the random patches, combined with the epoch.
+            transform (callable, optional): Optional transform to be applied.
+            target_transform (callable, optional): Optional transform of the
+                label.
+        """
+        assert mode in ('grid', 'random'), \
+            'mode needs to be \'grid\' or \'random\''
+        assert transform is None or callable(transform), \
+            'transform needs to be a callable.'
+        assert target_transform is None or callable(target_transform), \
+            'target_transform needs to be a callable.'
+
+        tile_size = patch_size if tile_size is None else tile_size
+        self.store = TileStore(tile_dir)
+        if not self.store.matches(dataset.imgs, tile_size, dataset.labeltype,
+                                  dataset.encoder):
+            self.store.build(dataset.imgs, dataset.labeltype, tile_size,
+                             dataset.encoder)
+        self.patch_size = patch_size
+        self.mode = mode
+        self.class_balanced = class_balanced
+        self.seed = seed
+        self.epoch = 0
+        self.transform = transform
+        self.target_transform = target_transform
+
+        shapes = self.store.index['shapes']
+        grid = [(-(-height // patch_size)) * (-(-width // patch_size))
+                for height, width, _ in shapes]
+        self._grid_offsets = np.concatenate(([0], np.cumsum(grid)))
+        self.samples_per_epoch = int(self._grid_offsets[-1]) \
+            if samples_per_epoch is None else samples_per_epoch
+        self._tile_weights = self._weights()
+
+    def _weights(self):
+        hist = self.store.index['tile_hist'].astype(np.float64)
+        if not self.class_balanced:
+            weights = hist.sum(axis=1)
+        else:
+            frequency = hist.sum(axis=0)
+            inverse = np.divide(1., frequency, out=np.zeros_like(frequency),
+                                where=frequency > 0)
+            weights = (hist / np.maximum(hist.sum(axis=1, keepdims=True), 1)) \
+                @ inverse
+        if weights.sum() <= 0:
+            weights = np.ones(len(hist))
+        return np.cumsum(weights / weights.sum())
+
+    def set_epoch(self, epoch):
+        """ Sets the epoch, which changes the random patches."""
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.mode == 'grid':
+            return int(self._grid_offsets[-1])
+        return self.samples_per_epoch
+
+    def locate(self, idx):
+        """ Sample index and top left corner of a patch."""
+        if self.mode == 'grid':
+            index = int(np.searchsorted(self._grid_offsets, idx, 'right')) - 1
+            width = self.store.index['shapes'][index][1]
+            cols = -(-width // self.patch_size)
+            row, col = divmod(idx - int(self._grid_offsets[index]), int(cols))
+            return index, row * self.patch_size, col * self.patch_size
+
+        rng = np.random.default_rng((self.seed, self.epoch, idx))
+        offsets = self.store.index['tile_offsets']
+        tile = int(np.searchsorted(self._tile_weights, rng.random(), 'right'))
+        tile = min(tile, int(offsets[-1]) - 1)
+        index = int(np.searchsorted(offsets, tile, 'right')) - 1
+        height, width, _ = self.store.index['shapes'][index]
+        size = self.store.tile_size
+        cols = -(-width // size)
+        row, col = divmod(tile - int(offsets[index]), cols)
+        center_row = row * size + int(rng.integers(size))
+        center_col = col * size + int(rng.integers(size))
+        top = min(max(center_row - self.patch_size // 2, 0),
+                  max(height - self.patch_size, 0))
+        left = min(max(center_col - self.patch_size // 2, 0),
+                   max(width - self.patch_size, 0))
+        return index, int(top), int(left)
+
+    def __getitem__(self, idx):
+        index, top, left = self.locate(idx)
+        img, mask = self.store.read(index, top, left,
+                                    self.patch_size, self.patch_size)
+        sample = {'image': img, 'label': mask}
+
+        if self.transform is not None:
+            sample['image'] = self.transform(sample['image'])
+        if self.target_transform is not None:
+            sample['label'] = self.target_transform(sample['label'])
+
+        return sample
@@ -0,0 +1,512 @@
+""" This Module includes batch versions of the total variation filters of the
+    denoise module. They work on whole N x C x H x W batches as they come out
+    of the DataLoader, either as ndarray or as torch tensor:
+        BatchTotalVariation: Uses a Total Variation Filter after Chambolle
+        BatchTotalVariation2: Uses a Total Variation Filter after Bregman
+    ndarray batches are denoised image by image with skimage in a thread
+    pool, since skimage releases the GIL in its solvers. The results are
+    those of the per image filters. An image of a few hundred pixels per side
+    stays in the cpu cache, so solving the whole batch at once in NumPy was
+    slower than skimage, not faster.
+    The solvers _chambolle and _bregman work on whole ndarrays or tensors,
+    they back the torch_denoise module and the warm starts of the sweep
+    module. _bregman updates the pixels in red-black order, see there.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+import os
+import numpy as np
+import torch
+
+
+class _NumpyOps(object):
+    """Array functions of the solvers for ndarrays."""
+    @staticmethod
+    def zeros(shape, like):
+        return np.zeros(shape, like.dtype)
+
+    @staticmethod
+    def asarray(array, like):
+        return np.array(array, dtype=like.dtype)
+
+    @staticmethod
+    def arange(count, like):
+        # pylint: disable=unused-argument
+        return np.arange(count)
+
+    @staticmethod
+    def size(array):
+        return array.size
+
+    @staticmethod
+    def diff(array, axis):
+        return np.diff(array, axis=axis)
+
+    @staticmethod
+    def shrink(array, threshold):
+        """Soft thresholding towards 0."""
+        return np.sign(array) * np.maximum(np.abs(array) - threshold, 0)
+
+    sqrt = staticmethod(np.sqrt)
+
+
+class _TorchOps(object):
+    """Array functions of the solvers for tensors on any device."""
+    @staticmethod
+    def zeros(shape, like):
+        return like.new_zeros(shape)
+
+    @staticmethod
+    def asarray(array, like):
+        return torch.as_tensor(array, dtype=like.dtype,
+                               device=like.device).clone()
+
+    @staticmethod
+    def arange(count, like):
+        return torch.arange(count, device=like.device)
+
+    @staticmethod
+    def size(array):
+        return array.numel()
+
+    @staticmethod
+    def diff(array, axis):
+        return torch.diff(array, dim=axis)
+
+    @staticmethod
+    def shrink(array, threshold):
+        """Soft thresholding towards 0."""
+        return torch.sign(array) * torch.clamp(array.abs() - threshold, min=0)
+
+    sqrt = staticmethod(torch.sqrt)
+
+
+def _ops(images):
+    return _TorchOps if torch.is_tensor(images) else _NumpyOps
+
+
+def _as_float(images):
+    """Converts like img_as_float, but for a whole batch. Tensors keep
+    float32 instead of float64."""
+    if torch.is_tensor(images):
+        if images.is_floating_point():
+            return images
+        if images.dtype == torch.bool:
+            return images.float()
+        return images.float() / float(torch.iinfo(images.dtype).max)
+    images = np.asarray(images)
+    if np.issubdtype(images.dtype, np.floating):
+        return images
+    if images.dtype == bool:
+        return images.astype(np.float64)
+    info = np.iinfo(images.dtype)
+    return images / float(info.max)
+
+
+def _map_images(func, images, workers):
+    """Runs func on every entry of the first axis in a thread pool."""
+    if not len(images):
+        return np.zeros(images.shape)
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(images)))
+    if workers == 1:
+        return np.stack([func(image) for image in images])
+    with ThreadPoolExecutor(workers) as pool:
+        return np.stack(list(pool.map(func, images)))
+
+
+def _chambolle(images, weight=0.1, eps=2.e-4, max_num_iter=200, p=None,
+               return_state=False):
+    """Chambolle projection for B x S_1 x ... x S_n, every entry of the first
+    axis is an independent image with n spatial dimensions. images is an
+    ndarray or a tensor.
+
+    p is the dual variable to start from, e.g. the final one of a close
+    weight. The stop criterion stays relative to the energy of a cold start.
+    With return_state the final dual variable is returned as well.
+    """
+    ops = _ops(images)
+    count, ndim = len(images), images.ndim - 1
+    size = ops.size(images[0])
+    result = ops.zeros(images.shape, images)
+    active = ops.arange(count, images)
+    warm = p is not None
+    if warm:
+        p = ops.asarray(p, images)
+    else:
+        p = ops.zeros((ndim,) + images.shape, images)
+    state = ops.zeros(p.shape, p) if return_state else None
+    g = ops.zeros(p.shape, p)
+    d = ops.zeros(images.shape, images)
+    tau = 1. / (2. * ndim)
+    out = images
+    for i in range(max_num_iter):
+        if i > 0 or warm:
+            d = -p.sum(0)
+            for ax in range(ndim):
+                slices_d = [slice(None)] * (ndim + 1)
+                slices_p = [slice(None)] * (ndim + 1)
+                slices_d[ax + 1] = slice(1, None)
+                slices_p[ax + 1] = slice(0, -1)
+                d[tuple(slices_d)] += p[ax][tuple(slices_p)]
+            out = images + d
+        else:
+            out = images
+        energy = (d ** 2).reshape(len(out), -1).sum(1)
+
+        for ax in range(ndim):
+            slices_g = [slice(None)] * (ndim + 1)
+            slices_g[ax + 1] = slice(0, -1)
+            g[ax][tuple(slices_g)] = ops.diff(out, ax + 1)
+
+        norm = ops.sqrt((g ** 2).sum(0))
+        energy += weight * norm.reshape(len(out), -1).sum(1)
+        norm *= tau / weight
+        norm += 1.
+        p -= tau * g
+        p /= norm[None, ...]
+        energy /= float(size)
+
+        if i == 0 and warm:
+            grad = ops.zeros(p.shape, p)
+            for ax in range(ndim):
+                slices_g = [slice(None)] * (ndim + 1)
+                slices_g[ax + 1] = slice(0, -1)
+                grad[ax][tuple(slices_g)] = abs(ops.diff(images, ax + 1))
+            energy_init = weight * ops.sqrt((grad ** 2).sum(0)) \
+                .reshape(count, -1).sum(1)
+            energy_init /= float(size)
+        elif i == 0:
+            energy_init = energy
+        else:
+            done = abs(energy_previous - energy) < eps * energy_init
+            if done.any():
+                result[active[done]] = out[done]
+                if return_state:
+                    state[:, active[done]] = p[:, done]
+                keep = ~done
+                if not keep.any():
+                    return (result, state) if return_state else result
+                active, images, out = active[keep], images[keep], out[keep]
+                p, g, d = p[:, keep], g[:, keep], d[keep]
+                energy, energy_init = energy[keep], energy_init[keep]
+        energy_previous = energy
+    result[active] = out
+    if return_state:
+        state[:, active] = p
+        return result, state
+    return result
+
+
+def tv_chambolle_batch(images,
+                       weight: float = 0.1,
+                       eps: float = 2.e-4,
+                       max_num_iter: int = 200,
+                       multichannel: bool = True,
+                       workers: int = None):
+    """Total variation denoising after Chambolle for a N x C x H x W batch.
+    The result is the one of denoise_tv_chambolle of skimage.
+
+    Args:
+        images (ndarray): Batch of images, integer batches are scaled to
+            [0, 1] like img_as_float does.
+        weight (float): Denoising weight, see TotalVariation.
+        eps (float): Relative difference of the cost function which stops the
+            iteration.
+        max_num_iter (int): Maximal number of iterations.
+        multichannel (bool): Denoise every channel separately. Otherwise the
+            channel axis is treated as third spatial dimension.
+        workers (int): Number of threads, defaults to the number of cpus.
+
+    Returns:
+        ndarray: Denoised float batch with the shape of images.
+    """
+    # pylint: disable=import-outside-toplevel
+    from skimage.restoration import denoise_tv_chambolle
+    images = _as_float(images)
+    shape = images.shape
+    if multichannel:
+        images = images.reshape((-1,) + shape[-2:])
+
+    def func(image):
+        if not multichannel:
+            image = image.transpose(1, 2, 0)
+        result = denoise_tv_chambolle(image, weight=weight, eps=eps,
+                                      max_num_iter=max_num_iter)
+        return result if multichannel else result.transpose(2, 0, 1)
+    return _map_images(func, images, workers).reshape(shape)
+
+
+# first row and column of the four strided pixel grids of the padded
+# arrays, the red grids (row + column even) come before the black ones
+_RED_BLACK = ((1, 1), (2, 2), (1, 2), (2, 1))
+
+
+def _bregman(images, weight=5.0, eps=1.e-3, max_num_iter=100,
+             isotropic=True, state=None, return_state=False):
+    """Split Bregman iteration for B x C x H x W, the channels of an image
+    share one stop criterion like skimage without channel_axis. images is
+    an ndarray or a tensor.
+
+    skimage updates the pixels in one lexicographic Gauss-Seidel sweep,
+    which only runs pixel by pixel. Here a sweep updates the red pixels
+    (row + column even) and then the black ones. A pixel depends only on
+    itself and its neighbours of the other colour, so each colour is one
+    update of whole strided arrays. Both orders converge to the same
+    solution, but stop at different iterates: with the default eps the
+    results differ from skimage by up to about 0.05 in [0, 1], which is the
+    distance of skimage's own result from the solution. With eps=1.e-8 they
+    agree to 1.e-4.
+
+    state holds the padded iterate and the split and Bregman variables
+    (out, dx, dy, bx, by) to start from, e.g. the final ones of a close
+    weight. With return_state the final state is returned as well.
+    """
+    ops = _ops(images)
+    count, _, rows, cols = images.shape
+    total = ops.size(images[0])
+    lam = 2. * weight
+    norm = weight + 4. * lam
+    padded = images.shape[:2] + (rows + 2, cols + 2)
+    if state is not None:
+        out, dx, dy, bx, by = (ops.asarray(array, images) for array in state)
+    else:
+        out = ops.zeros(padded, images)
+        out[..., 1:-1, 1:-1] = images
+        out[..., 0, 1:-1] = images[..., 1, :]
+        out[..., 1:-1, 0] = images[..., :, 1]
+        out[..., -1, 1:-1] = images[..., rows - 1, :]
+        out[..., 1:-1, -1] = images[..., :, cols - 1]
+        dx, dy, bx, by = (ops.zeros(padded, images) for _ in range(4))
+    image = ops.zeros(padded, images)
+    image[..., 1:-1, 1:-1] = images
+    grids = [(row, col) for row, col in _RED_BLACK
+             if row <= rows and col <= cols]
+    final = [ops.zeros(padded, images) for _ in range(5)] \
+        if return_state else None
+
+    def grid(row, col, shift=(0, 0)):
+        return (Ellipsis,
+                slice(row + shift[0], rows + 1 + shift[0], 2),
+                slice(col + shift[1], cols + 1 + shift[1], 2))
+
+    def finish(indices, keep):
+        result[indices] = out[keep][..., 1:-1, 1:-1]
+        if return_state:
+            for array, current in zip(final, (out, dx, dy, bx, by)):
+                array[indices] = current[keep]
+
+    result = ops.zeros(images.shape, images)
+    active = ops.arange(count, images)
+    for _ in range(max_num_iter):
+        change = 0.
+        for row, col in grids:
+            this = grid(row, col)
+            left, right = grid(row, col, (0, -1)), grid(row, col, (0, 1))
+            up, down = grid(row, col, (-1, 0)), grid(row, col, (1, 0))
+            uprev = out[this]
+            ux = out[right] - uprev
+            uy = out[down] - uprev
+            bxx, byy = bx[this], by[this]
+            unew = (lam * (out[down] + out[up] + out[right] + out[left]
+                           + dx[left] - dx[this] + dy[up] - dy[this]
+                           - bx[left] + bxx - by[up] + byy)
+                    + weight * image[this]) / norm
+            tx, ty = ux + bxx, uy + byy
+            if isotropic:
+                s = ops.sqrt(tx * tx + ty * ty) * lam
+                dxx, dyy = s * tx / (s + 1), s * ty / (s + 1)
+            else:
+                dxx, dyy = ops.shrink(tx, 1. / lam), ops.shrink(ty, 1. / lam)
+            change = change + ((unew - uprev) ** 2) \
+                .reshape(len(unew), -1).sum(1)
+            out[this] = unew
+            dx[this], dy[this] = dxx, dyy
+            bx[this] = bxx + ux - dxx
+            by[this] = byy + uy - dyy
+
+        done = ops.sqrt(change / total) <= eps
+        if done.any():
+            finish(active[done], done)
+            keep = ~done
+            if not keep.any():
+                return (result, tuple(final)) if return_state else result
+            active, image = active[keep], image[keep]
+            out, dx, dy = out[keep], dx[keep], dy[keep]
+            bx, by = bx[keep], by[keep]
+    finish(active, slice(None))
+    if return_state:
+        return result, tuple(final)
+    return result
+
+
+def tv_bregman_batch(images,
+                     weight: float = 4.0,
+                     eps: float = 1.e-3,
+                     max_num_iter: int = 100,
+                     isotropic: bool = True,
+                     multichannel: bool = True,
+                     workers: int = None):
+    """Total variation denoising after Bregman for a N x C x H x W batch.
+    The result is the one of denoise_tv_bregman of skimage.
+
+    Args:
+        images (ndarray): Batch of images, integer batches are scaled to
+            [0, 1] like img_as_float does.
+        weight (float): Denoising weight, see TotalVariation2.
+        eps (float): Root mean square difference of two iterations which
+            stops the iteration.
+        max_num_iter (int): Maximal number of iterations.
+        isotropic (bool): Switch between isotropic and anisotropic TV
+            denoising.
+        multichannel (bool): Denoise every channel as a separate 2d image.
+            Otherwise the channels of an image share the stop criterion.
+        workers (int): Number of threads, defaults to the number of cpus.
+
+    Returns:
+        ndarray: Denoised float batch with the shape of images.
+    """
+    # pylint: disable=import-outside-toplevel
+    from skimage.restoration import denoise_tv_bregman
+    images = _as_float(images)
+    shape = images.shape
+    if multichannel:
+        images = images.reshape((-1,) + shape[-2:])
+
+    def func(image):
+        if not multichannel:
+            image = image.transpose(1, 2, 0)
+        result = denoise_tv_bregman(image, weight=weight,
+                                    max_num_iter=max_num_iter, eps=eps,
+                                    isotropic=isotropic)
+        return result if multichannel else result.transpose(2, 0, 1)
+    return _map_images(func, images, workers).reshape(shape)
+
+
+def _apply(func, images, **kwargs):
+    """Calls func with an ndarray and returns the type of images."""
+    if torch.is_tensor(images):
+        result = func(images.detach().cpu().numpy(), **kwargs)
+        return torch.from_numpy(np.ascontiguousarray(result))
+    return func(images, **kwargs)
+
+
+class BatchTotalVariation(object):
+    """Denoises a batch with Total Variation Filter (Chambolle)
+
+    Args:
+        weight (float): Denoising weight. The greater weight, the more
+            denoising (at the expense of fidelity to input).
+        multichannel (bool): Apply total-variation denoising separately for
+            each channel. This option should be true for color images,
+            otherwise the denoising is also applied in the channels dimension.
+        workers (int): Number of threads, None uses all cpus.
+    """
+    def __init__(self,
+                 weight: float = 0.1,
+                 multichannel: bool = True,
+                 workers: int = None) -> None:
+        assert isinstance(weight, float), \
+            "weight needs to be a float value"
+        assert isinstance(multichannel, bool), \
+            "multichannel needs to be a bool value"
+        assert workers is None or isinstance(workers, int), \
+            "workers needs to be a int value"
+        self.__weight = weight
+        self.__multichannel = multichannel
+        self.workers = workers
+
+    def __call__(self, batch: dict) -> dict:
+        images, labels = batch['image'], batch['label']
+        images = _apply(tv_chambolle_batch, images,
+                        weight=self.weight,
+                        multichannel=self.multichannel,
+                        workers=self.workers)
+
+        return {'image': images, 'label': labels}
+
+    def __getWeight__(self):
+        return self.__weight
+
+    def __getMultichannel__(self):
+        return self.__multichannel
+
+    def __setWeight__(self, var_to_set):
+        if isinstance(var_to_set, float):
+            self.__weight = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "weight needs to be a float value")
+
+    def __setMultichannel__(self, var_to_set):
+        if isinstance(var_to_set, bool):
+            self.__multichannel = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "multichannel needs to be a bool value")
+
+    weight = property(__getWeight__, __setWeight__)
+    multichannel = property(__getMultichannel__, __setMultichannel__)
+
+
+class BatchTotalVariation2(object):
+    """Denoises a batch with Total Variation Filter (Bregman)
+
+    Args:
+        weight (float): Denoising weight. The smaller the weight, the more
+            denoising (at the expense of less similarity to the input). The
+            regularization parameter lambda is chosen as 2 * weight.
+        isotropic (bool): Switch between isotropic and anisotropic TV
+            denoising.
+        workers (int): Number of threads, None uses all cpus.
+    """
+    def __init__(self,
+                 weight: float = 4.0,
+                 isotropic: bool = True,
+                 workers: int = None) -> None:
+        assert isinstance(weight, float), \
+            "weight needs to be a float value"
+        assert isinstance(isotropic, bool), \
+            "isotropic needs to be a bool value"
+        assert workers is None or isinstance(workers, int), \
+            "workers needs to be a int value"
+        self.__weight = weight
+        self.__isotropic = isotropic
+        self.workers = workers
+
+    def __call__(self, batch: dict) -> dict:
+        images, labels = batch['image'], batch['label']
+        images = _apply(tv_bregman_batch, images,
+                        weight=self.weight,
+                        isotropic=self.isotropic,
+                        workers=self.workers)
+
+        return {'image': images, 'label': labels}
+
+    def __getWeight__(self):
+        return self.__weight
+
+    def __getIsotropic__(self):
+        return self.__isotropic
+
+    def __setWeight__(self, var_to_set):
+        if isinstance(var_to_set, float):
+            self.__weight = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "weight needs to be a float value")
+
+    def __setIsotropic__(self, var_to_set):
+        if isinstance(var_to_set, bool):
+            self.__isotropic = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "isotrpoic needs to be a bool value")
+
+    weight = property(__getWeight__, __setWeight__)
+    isotropic = property(__getIsotropic__, __setIsotropic__)
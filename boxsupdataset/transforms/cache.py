@@ -0,0 +1,145 @@
+""" This Module includes a caching wrapper for the transformations of the
+    denoise module:
+        CachedTransform: Stores the results of a deterministic transform on
+            disk and reuses them in later epochs.
+"""
+
+from __future__ import absolute_import
+from pathlib import Path
+import hashlib
+import os
+import numpy as np
+from ..utils import atomic_write
+
+
+def transform_params(transform) -> dict:
+    """Collects the values of all properties of a transform, e.g. weight,
+    isotropic or multichannel of the denoise classes.
+    """
+    params = {}
+    for cls in type(transform).__mro__:
+        for name, attr in vars(cls).items():
+            if isinstance(attr, property) and name not in params:
+                params[name] = getattr(transform, name)
+    return params
+
+
+class CachedTransform(object):
+    """Caches the image computed by a deterministic transform on disk.
+
+    The key of an entry is built from the transform class, its parameters and
+    the source of the image. Samples which name their image file as 'source'
+    are keyed by its path, size and mtime, without reading the pixels. The
+    transforms of this package get the image data only, so other samples are
+    keyed by a digest of the image content instead of the file. Either way a
+    changed source results in a new key, while stale entries age out of the
+    store. Entries are evicted in least recently used order as soon as the
+    files in cache_dir grow over max_bytes, which holds for all processes
+    that share the store, e.g. DataLoader workers.
+
+    Args:
+        transform (callable): Transform like TotalVariation which takes and
+            returns a sample dict.
+        cache_dir (string): Directory which holds the cached images.
+        max_bytes (int): Size limit of the store in bytes.
+    """
+    def __init__(self,
+                 transform,
+                 cache_dir,
+                 max_bytes: int = 10 * 1024 ** 3) -> None:
+        assert callable(transform), \
+            "transform needs to be a callable"
+        assert isinstance(max_bytes, int), \
+            "max_bytes needs to be a int value"
+        self.transform = transform
+        self.cache_dir = Path(cache_dir)
+        self.__max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, sample: dict) -> dict:
+        image, label = sample['image'], sample['label']
+        path = self._path(self.key(image, sample.get('source')))
+        try:
+            result = np.load(path)
+            os.utime(path)
+            self.hits += 1
+            return {'image': result, 'label': label}
+        except (OSError, ValueError):
+            pass
+
+        result = self.transform(sample)
+        self.misses += 1
+        self._store(path, np.asarray(result['image']))
+        return {'image': result['image'], 'label': label}
+
+    def key(self, image, source=None) -> str:
+        """Computes the cache key of an image for the wrapped transform.
+
+        Args:
+            image (ndarray): Input image of the transform.
+            source (string, optional): Path of the image file. The key uses
+                its path, size and mtime instead of the image content.
+        """
+        cls = type(self.transform)
+        params = sorted(transform_params(self.transform).items())
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f'{cls.__module__}.{cls.__qualname__}|{params}|'
+                      .encode())
+        if source is not None:
+            stat = os.stat(source)
+            digest.update(f'{Path(source).resolve()}|{stat.st_size}|'
+                          f'{stat.st_mtime_ns}'.encode())
+        else:
+            image = np.ascontiguousarray(image)
+            digest.update(f'{image.dtype.str}|{image.shape}'.encode())
+            digest.update(memoryview(image).cast('B'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f'{key}.npy'
+
+    def _store(self, path, image):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(path) as out_file:
+            np.save(out_file, image)
+        # other processes write to the same store, so its size is taken
+        # from the files on disk
+        self.evict()
+
+    def _entries(self):
+        for entry in self.cache_dir.glob('*/*.npy'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield entry, stat.st_size, stat.st_mtime
+
+    def evict(self, max_bytes=None):
+        """Removes the least recently used entries until the files in
+        cache_dir are smaller than max_bytes.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        for entry, entry_size, _ in entries:
+            if size <= max_bytes:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def __getMaxBytes__(self):
+        return self.__max_bytes
+
+    def __setMaxBytes__(self, var_to_set):
+        if isinstance(var_to_set, int):
+            self.__max_bytes = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "max_bytes needs to be a int value")
+
+    max_bytes = property(__getMaxBytes__, __setMaxBytes__)
@@ -5,12 +5,10 @@
         TotalVariation2: Uses a Total Variation Filter after Bregman
         Bilateral: Uses a bilateral Filter
         Wavelet: Uses a Wavelet Filter
+    skimage is only imported when a filter is called the first time.
 """
 
 from __future__ import absolute_import
-from skimage.restoration import (denoise_tv_chambolle, denoise_bilateral,
-                                 denoise_wavelet, denoise_tv_bregman)
-from skimage import img_as_float
 
 
 class TotalVariation(object):
@@ -37,6 +35,9 @@ class TotalVariation(object):
 
     def __call__(self, sample: dict) -> dict:
         image, label = sample['image'], sample['label']
+        # pylint: disable=import-outside-toplevel
+        from skimage import img_as_float
+        from skimage.restoration import denoise_tv_chambolle
         image = img_as_float(image)
         image = denoise_tv_chambolle(image,
                                      weight=self.weight,
@@ -101,6 +102,9 @@ class TotalVariation2(object):
 
     def __call__(self, sample: dict) -> dict:
         image, label = sample['image'], sample['label']
+        # pylint: disable=import-outside-toplevel
+        from skimage import img_as_float
+        from skimage.restoration import denoise_tv_bregman
         image = img_as_float(image)
         image = denoise_tv_bregman(image,
                                    weight=self.weight,
@@ -182,6 +186,9 @@ class Bilateral(object):
 
     def __call__(self, sample: dict) -> dict:
         image, label = sample['image'], sample['label']
+        # pylint: disable=import-outside-toplevel
+        from skimage import img_as_float
+        from skimage.restoration import denoise_bilateral
         image = img_as_float(image)
         image = denoise_bilateral(image,
                                   sigma_color=self.sigma_color,
@@ -262,6 +269,9 @@ class Wavelet(object):
 
     def __call__(self, sample: dict) -> dict:
         image, label = sample['image'], sample['label']
+        # pylint: disable=import-outside-toplevel
+        from skimage import img_as_float
+        from skimage.restoration import denoise_wavelet
         image = img_as_float(image)
         image = denoise_wavelet(image,
                                 multichannel=self.multichannel,
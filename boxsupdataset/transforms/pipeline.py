@@ -0,0 +1,272 @@
+""" This Module includes the CompiledPipeline, which runs a Compose of the
+    transformations of this package in one pass over float32 data:
+        The image is converted once from uint8 H x W x C into a reusable
+        float32 C x H x W buffer, when the first torch stage needs it.
+        TotalVariation and Wavelet run as their torch versions of the
+        torch_denoise module, in float32 and without the float64 round trip
+        of img_as_float. TotalVariation2 keeps skimage unless the torch
+        version is requested.
+        ToTensor and ToCompactTensor become the output stage, which writes
+        the final tensor with a single copy.
+        Every other transformation gets the input it gets in a Compose: the
+        original image before the first torch stage, a float64 H x W x C
+        array like the skimage filters return after it.
+    plan reports the stages and the memory they allocate per sample.
+"""
+
+from __future__ import absolute_import
+from collections import OrderedDict
+from functools import partial
+import threading
+import numpy as np
+import torch
+from . import denoise, torch_denoise
+from .utils import ToTensor, ToCompactTensor, _writable
+
+
+def _tv_chambolle(transform):
+    return partial(torch_denoise.tv_chambolle, weight=transform.weight,
+                   multichannel=transform.multichannel)
+
+
+def _tv_bregman(transform):
+    return partial(torch_denoise.tv_bregman, weight=transform.weight,
+                   isotropic=transform.isotropic,
+                   multichannel=getattr(transform, 'multichannel', True))
+
+
+def _wavelet(transform):
+    return partial(torch_denoise.wavelet, multichannel=transform.multichannel,
+                   convert2ycbcr=transform.convert2ycbcr)
+
+
+# transform class -> factory of the float32 C x H x W tensor function
+TENSOR_STAGES = {
+    denoise.TotalVariation: _tv_chambolle,
+    denoise.Wavelet: _wavelet,
+    torch_denoise.TorchTotalVariation: _tv_chambolle,
+    torch_denoise.TorchTotalVariation2: _tv_bregman,
+    torch_denoise.TorchWavelet: _wavelet,
+}
+# stages which only run as torch version on request
+OPTIONAL_STAGES = {
+    denoise.TotalVariation2: _tv_bregman,
+}
+
+
+class CompiledPipeline(object):
+    """ Runs a Compose of this package's transformations in float32 with a
+    reusable buffer.
+
+    The pipeline takes a sample dict, like the transforms do, or a single
+    image, like the transform argument of NasaBoxSupDataset, and returns the
+    same kind. The buffers belong to the calling thread, so every DataLoader
+    worker and every thread of an AsyncReader, which runs the transforms of
+    __getitems__ in parallel, keeps its own. An image from the buffer is
+    always returned as a new array, since the DataLoader holds all samples
+    of a batch before it collates them.
+
+    Args:
+        transforms (Compose or list): Transformations to run in this order.
+            ToTensor or ToCompactTensor can only be the last one.
+        dtype (torch.dtype): Image dtype of a ToTensor output stage. ToTensor
+            itself returns float64, the default float32 saves the
+            conversion and half of the memory.
+        max_buffers (int): Number of image shapes a buffer is kept for, per
+            thread.
+        torch_bregman (bool): Run TotalVariation2 with the float32 red-black
+            solver of torch_denoise instead of skimage. It stops at a
+            slightly different iterate than skimage, see batch._bregman.
+    """
+    def __init__(self, transforms, dtype=torch.float32,
+                 max_buffers: int = 4, torch_bregman: bool = False) -> None:
+        transforms = list(getattr(transforms, 'transforms', transforms))
+        assert all(not isinstance(transform, (ToTensor, ToCompactTensor))
+                   for transform in transforms[:-1]), \
+            "ToTensor and ToCompactTensor need to be the last transform"
+        self.dtype = dtype
+        self.max_buffers = max_buffers
+        self.output = None
+        if transforms and isinstance(transforms[-1],
+                                     (ToTensor, ToCompactTensor)):
+            self.output = transforms.pop()
+        stages = dict(TENSOR_STAGES)
+        if torch_bregman:
+            stages.update(OPTIONAL_STAGES)
+        self.stages = []
+        for transform in transforms:
+            factory = stages.get(type(transform))
+            func = None if factory is None else factory(transform)
+            self.stages.append((transform, func))
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _buffer(self, shape):
+        """ float32 working buffer of a C x H x W shape in this thread."""
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = OrderedDict()
+        shape = tuple(shape)
+        if shape in buffers:
+            buffers.move_to_end(shape)
+        else:
+            if len(buffers) >= self.max_buffers:
+                buffers.popitem(last=False)
+            buffers[shape] = torch.empty(shape, dtype=torch.float32)
+        return buffers[shape]
+
+    def __call__(self, sample):
+        if isinstance(sample, dict):
+            return self._run(sample['image'], sample['label'])
+        return self._run(sample, None)['image']
+
+    def _load(self, image):
+        """ Converts an image to float in [0, 1] into the buffer."""
+        image = np.asarray(image)
+        if image.ndim == 2:
+            image = image[..., np.newaxis]
+        buffer = self._buffer((image.shape[2],) + image.shape[:2])
+        source = image.transpose(2, 0, 1)
+        target = buffer.numpy()
+        if np.issubdtype(image.dtype, np.integer):
+            np.multiply(source, np.float32(1. / np.iinfo(image.dtype).max),
+                        out=target, casting='unsafe')
+        else:
+            np.copyto(target, source, casting='unsafe')
+        return buffer
+
+    def _run(self, image, label):
+        # the image stays as it is until a torch stage needs the buffer
+        current = None
+        for transform, func in self.stages:
+            if func is not None:
+                if current is None:
+                    current = self._load(image)
+                current = func(current)
+                continue
+            if current is not None:
+                # the skimage filters return float64 H x W x C
+                image = current.permute(1, 2, 0).numpy().astype(np.float64)
+                current = None
+            result = transform({'image': image, 'label': label})
+            image, label = result['image'], result['label']
+
+        if current is None:
+            if self.output is None:
+                return {'image': image, 'label': label}
+            if isinstance(self.output, ToCompactTensor) and \
+                    label is not None:
+                # ToCompactTensor already converts in a single step
+                return self.output({'image': image, 'label': label})
+            current = self._load(image)
+        if self.output is None:
+            return {'image': current.permute(1, 2, 0).numpy().copy(),
+                    'label': label}
+        if isinstance(self.output, ToTensor):
+            return self._to_tensor(current, label)
+        return self._to_compact(current, label)
+
+    def _to_tensor(self, image, label):
+        if image.shape[0] == 1:
+            image = image.expand(3, -1, -1)
+        image = image.to(self.dtype, copy=True)
+        if label is not None:
+            label = np.asarray(label)
+            if label.ndim == 2:
+                label = label[..., np.newaxis]
+            label = torch.from_numpy(_writable(label)).permute(2, 0, 1)
+            if label.is_floating_point() or label.dtype == torch.bool:
+                label = label.to(self.dtype, copy=True)
+            else:
+                scale = 1. / float(torch.iinfo(label.dtype).max)
+                label = label.to(self.dtype).mul_(scale)
+        return {'image': image, 'label': label}
+
+    def _to_compact(self, image, label):
+        output = self.output
+        if image.shape[0] == 1:
+            image = image.expand(3, -1, -1)
+        if output.channels_last:
+            result = torch.empty(image.shape[1:] + image.shape[:1],
+                                 dtype=output.dtype).permute(2, 0, 1)
+        else:
+            result = torch.empty(image.shape, dtype=output.dtype)
+        if output.dtype == torch.uint8:
+            result.copy_(image.mul(255).round_().clamp_(0, 255))
+        else:
+            result.copy_(image)
+        if label is not None:
+            label = torch.from_numpy(_writable(label))
+            if label.ndim == 3:
+                label = label.permute(2, 0, 1).contiguous()
+            label = label.to(output.label_dtype)
+        return {'image': result, 'label': label}
+
+    def plan(self, shape):
+        """ Describes the stages for an image of shape H x W x C.
+
+        Returns:
+            list: per stage the name, the implementation, the dtype it works
+                in and the bytes it allocates per sample. Buffers are
+                allocated once per shape and thread.
+        """
+        height, width, channels = shape
+        size = height * width * channels
+        float_bytes = size * np.dtype(np.float32).itemsize
+        steps = []
+        loaded = False
+        for transform, func in self.stages:
+            if func is not None and not loaded:
+                steps.append({'stage': 'input',
+                              'implementation': 'uint8 -> float32',
+                              'dtype': 'float32', 'allocates': 0,
+                              'buffer': float_bytes})
+            loaded = func is not None
+            if func is not None:
+                steps.append({'stage': type(transform).__name__,
+                              'implementation': 'torch_denoise',
+                              'dtype': 'float32', 'allocates': float_bytes,
+                              'buffer': 0})
+            else:
+                steps.append({'stage': type(transform).__name__,
+                              'implementation': 'transform',
+                              'dtype': 'as the transform returns',
+                              'allocates': None, 'buffer': 0})
+        if isinstance(self.output, ToTensor) and not loaded:
+            steps.append({'stage': 'input',
+                          'implementation': 'uint8 -> float32',
+                          'dtype': 'float32', 'allocates': 0,
+                          'buffer': float_bytes})
+        if isinstance(self.output, ToTensor):
+            dtype = self.dtype
+        elif self.output is not None:
+            dtype = self.output.dtype
+        else:
+            dtype = torch.float32
+        out_channels = 3 if isinstance(
+            self.output, (ToTensor, ToCompactTensor)) else channels
+        steps.append({'stage': type(self.output).__name__
+                      if self.output is not None else 'output',
+                      'implementation': 'single copy',
+                      'dtype': str(dtype).replace('torch.', ''),
+                      'allocates': height * width *
+                      max(out_channels, channels) *
+                      torch.empty((), dtype=dtype).element_size(),
+                      'buffer': 0})
+        return steps
+
+    def __repr__(self) -> str:
+        names = [type(transform).__name__ +
+                 ('' if func is None else '[torch]')
+                 for transform, func in self.stages]
+        if self.output is not None:
+            names.append(type(self.output).__name__)
+        return f'{self.__class__.__name__}({", ".join(names)})'
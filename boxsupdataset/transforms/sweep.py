@@ -0,0 +1,191 @@
+""" This Module includes the parameter sweep of the denoise transformations.
+    Every image of a root_dir is decoded once and denoised with all
+    configurations of a parameter grid in one task of a process pool:
+        TotalVariation: the weights are solved in ascending order, every
+            weight starts from the dual variable of the previous one.
+        other transforms: every configuration is called on the decoded image.
+    The warm start runs the Chambolle solver of the batch module, which
+    follows skimage, instead of the transform itself. It stops with the stop
+    criterion of a cold start, but is not bit-identical to a cold start.
+    TotalVariation2 has no warm start, the whole array Bregman solver is
+    slower on the cpu than skimage even with a warm start.
+    Every result names its solver, without warm_start every configuration
+    calls the transform. For every configuration the time and the PSNR
+    against the input image are reported.
+"""
+
+from __future__ import absolute_import
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import itertools
+import json
+import math
+import time
+import numpy as np
+from ..decode import decode_image
+from ..manifest import pair_files
+from ..preprocess import build_transform, parse_params
+from ..utils import Progress
+from .batch import _as_float, _chambolle
+
+
+def expand_grid(grid):
+    """ All combinations of a grid like {'weight': [0.1, 0.2],
+        'multichannel': [True]} as list of parameter dicts.
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+def psnr(reference, image):
+    """ Peak signal to noise ratio of float images in [0, 1]."""
+    mse = float(np.mean((np.asarray(reference, np.float64) -
+                         np.asarray(image, np.float64)) ** 2))
+    return math.inf if mse == 0 else 10. * math.log10(1. / mse)
+
+
+def _sweep_chambolle(image, transforms):
+    """ Chambolle for transforms which only differ in their weight."""
+    if transforms[0].multichannel:
+        images = np.ascontiguousarray(image.transpose(2, 0, 1))
+    else:
+        images = image[np.newaxis]
+    dual, previous = None, None
+    for transform in transforms:
+        if dual is not None:
+            dual = dual * (transform.weight / previous)
+        result, dual = _chambolle(images, transform.weight, p=dual,
+                                  return_state=True)
+        previous = transform.weight
+        yield result.transpose(1, 2, 0) if transforms[0].multichannel \
+            else result[0]
+
+
+WARM_STARTS = {'TotalVariation': _sweep_chambolle}
+
+
+def solver(transform, warm_start=True):
+    """ Name of what a sweep runs for a transform."""
+    if warm_start and transform in WARM_STARTS:
+        return 'batch solver, warm start'
+    return 'transform'
+
+
+def _groups(transform, configs, warm_start=True):
+    """ Groups the configurations which only differ in their weight, sorted
+        by weight, if the transform has a warm start. Every other
+        configuration gets its own group.
+
+    Returns:
+        list: (warm start, [(index, transform instance), ...]) tuples
+    """
+    groups = {}
+    for index, params in enumerate(configs):
+        instance = build_transform(transform, params)
+        warm = warm_start and transform in WARM_STARTS
+        key = tuple(sorted((name, value) for name, value in params.items()
+                           if name != 'weight')) if warm else index
+        groups.setdefault((warm, key), []).append((index, instance))
+    return [(warm, sorted(group, key=lambda item: item[1].weight)
+             if warm else group)
+            for (warm, _), group in groups.items()]
+
+
+def _run_image(job):
+    img_path, transform, configs, warm_start = job
+    image = _as_float(decode_image(img_path))
+    results = [None] * len(configs)
+    for warm, group in _groups(transform, configs, warm_start):
+        instances = [instance for _, instance in group]
+        if warm:
+            outputs = WARM_STARTS[transform](image, instances)
+        else:
+            outputs = (instance({'image': image, 'label': None})['image']
+                       for instance in instances)
+        for index, _ in group:
+            tic = time.perf_counter()
+            output = next(outputs)
+            results[index] = (time.perf_counter() - tic, psnr(image, output))
+    return results
+
+
+def sweep(root_dir, transform, grid, labeltype='mask', count=None,
+          workers=None, progress=True, warm_start=True):
+    """ Runs a denoise transform with all configurations of a grid on the
+        images of a root_dir.
+
+    Args:
+        root_dir (string): Directory with img folder and label folder.
+        transform (string): Name of the transform class, e.g. TotalVariation.
+        grid (dict): parameter name -> list of values.
+        labeltype (string): 'mask' or 'image', see NasaBoxSupDataset.
+        count (int, optional): Number of images, defaults to all.
+        workers (int, optional): Number of processes which time the
+            images, defaults to all cpus.
+        progress (bool): Print the timed images, see Progress.
+        warm_start (bool): Solve TotalVariation with the warm started batch
+            solver, otherwise call the transform.
+
+    Returns:
+        list: per configuration the params, solver, images, total_s,
+            mean_ms, psnr_mean and psnr_min.
+    """
+    configs = expand_grid(grid)
+    pairs = sorted(pair_files(root_dir, labeltype).values(),
+                   key=lambda pair: pair[0].name)[:count]
+    jobs = [(img.path, transform, configs, warm_start) for img, _ in pairs]
+    seconds = np.zeros((len(jobs), len(configs)))
+    quality = np.zeros((len(jobs), len(configs)))
+    with ProcessPoolExecutor(workers) as pool, \
+            Progress(len(jobs), 'images', progress) as counter:
+        for row, results in enumerate(pool.map(_run_image, jobs)):
+            seconds[row], quality[row] = zip(*results)
+            counter.update()
+    return [{'params': params,
+             'solver': solver(transform, warm_start),
+             'images': len(jobs),
+             'total_s': float(seconds[:, index].sum()),
+             'mean_ms': float(seconds[:, index].mean() * 1e3),
+             'psnr_mean': float(quality[:, index].mean()),
+             'psnr_min': float(quality[:, index].min())}
+            for index, params in enumerate(configs)]
+
+
+def main(argv=None):
+    """ Command line entry point of the sweep."""
+    parser = argparse.ArgumentParser(
+        description='Runs a denoise transform with a grid of parameters.')
+    parser.add_argument('root_dir')
+    parser.add_argument('--transform', required=True,
+                        help='class of the denoise module, '
+                             'e.g. TotalVariation')
+    parser.add_argument('--grid', action='append', default=[],
+                        help='values of a parameter as name=value,value,...')
+    parser.add_argument('--labeltype', default='mask',
+                        choices=('mask', 'image'))
+    parser.add_argument('--count', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help='JSON result file')
+    parser.add_argument('--no-warm-start', dest='warm_start',
+                        action='store_false',
+                        help='call the transform for every configuration')
+    args = parser.parse_args(argv)
+
+    grid = {}
+    for param in args.grid:
+        name, _, values = param.partition('=')
+        grid[name] = [parse_params([f'{name}={value}'])[name]
+                      for value in values.split(',')]
+    results = sweep(args.root_dir, args.transform, grid, args.labeltype,
+                    args.count, args.workers, warm_start=args.warm_start)
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as output:
+            output.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+""" This Module includes torch versions of the transformations of the denoise
+    module. They take float32 C x H x W tensors or N x C x H x W batches, so
+    they can run after ToCompactTensor and on whole batches in the main
+    process, using the intra-op threads of torch instead of NumPy round
+    trips in float64:
+        TorchTotalVariation: Uses a Total Variation Filter after Chambolle
+        TorchTotalVariation2: Uses a Total Variation Filter after Bregman
+        TorchWavelet: Uses a Haar Wavelet Filter with BayesShrink
+    The total variation filters share their solvers with the batch module.
+    The results follow the skimage functions of the denoise module, apart
+    from the float32 precision. The Bregman filter updates the pixels in
+    red-black order instead of skimage's pixel by pixel sweep, so it stops
+    at a slightly different iterate, see batch._bregman.
+"""
+
+from __future__ import absolute_import
+import math
+import torch
+from .batch import _as_float, _bregman, _chambolle
+
+# scipy.stats.norm.ppf(0.75), used for the noise estimate of skimage
+_MAD_SCALE = 0.6744897501960817
+
+_YCBCR_FROM_RGB = torch.tensor([[65.481, 128.553, 24.966],
+                                [-37.797, -74.203, 112.0],
+                                [112.0, -93.786, -18.214]],
+                               dtype=torch.float64)
+_YCBCR_OFFSET = torch.tensor([16., 128., 128.], dtype=torch.float64)
+
+
+def _batched(func, images, **kwargs):
+    """Applies func on N x C x H x W views of C x H x W or batched tensors."""
+    images = _as_float(images)
+    if images.ndim == 3:
+        return func(images.unsqueeze(0), **kwargs).squeeze(0)
+    if images.ndim != 4:
+        raise ValueError(images.shape, 'images need to be C x H x W or '
+                                       'N x C x H x W')
+    return func(images, **kwargs)
+
+
+def tv_chambolle(images,
+                 weight: float = 0.1,
+                 eps: float = 2.e-4,
+                 max_num_iter: int = 200,
+                 multichannel: bool = True):
+    """Total variation denoising after Chambolle.
+
+    Args:
+        images (Tensor): C x H x W image or N x C x H x W batch.
+        weight (float): Denoising weight, see TotalVariation.
+        eps (float): Relative difference of the cost function which stops the
+            iteration.
+        max_num_iter (int): Maximal number of iterations.
+        multichannel (bool): Denoise every channel separately. Otherwise the
+            channel axis is treated as third spatial dimension.
+    """
+    def func(batch):
+        shape = batch.shape
+        if multichannel:
+            batch = batch.reshape((-1,) + shape[-2:])
+        return _chambolle(batch, weight, eps, max_num_iter).reshape(shape)
+    return _batched(func, images)
+
+
+def tv_bregman(images,
+               weight: float = 4.0,
+               eps: float = 1.e-3,
+               max_num_iter: int = 100,
+               isotropic: bool = True,
+               multichannel: bool = True):
+    """Total variation denoising after Bregman. Every sweep updates the
+    red and then the black pixels as whole tensors, the result differs from
+    skimage by the stopping error of eps, see batch._bregman.
+
+    Args:
+        images (Tensor): C x H x W image or N x C x H x W batch.
+        weight (float): Denoising weight, see TotalVariation2.
+        eps (float): Root mean square difference of two iterations which
+            stops the iteration.
+        max_num_iter (int): Maximal number of iterations.
+        isotropic (bool): Switch between isotropic and anisotropic TV
+            denoising.
+        multichannel (bool): Denoise every channel as a separate 2d image.
+            Otherwise the channels of an image share the stop criterion.
+    """
+    def func(batch):
+        shape = batch.shape
+        if multichannel:
+            batch = batch.reshape((-1, 1) + shape[-2:])
+        return _bregman(batch, weight, eps, max_num_iter,
+                        isotropic).reshape(shape)
+    return _batched(func, images)
+
+
+def _haar_split(x, axis):
+    """One Haar step along an axis with the symmetric padding of pywt."""
+    x = x.movedim(axis, -1)
+    if x.shape[-1] % 2:
+        x = torch.cat([x, x[..., -1:]], dim=-1)
+    even, odd = x[..., 0::2], x[..., 1::2]
+    approx = (even + odd) * math.sqrt(.5)
+    detail = (even - odd) * math.sqrt(.5)
+    return approx.movedim(-1, axis), detail.movedim(-1, axis)
+
+
+def _haar_merge(approx, detail, axis, length):
+    """Inverse of _haar_split, cropped to the original length."""
+    approx, detail = approx.movedim(axis, -1), detail.movedim(axis, -1)
+    even = (approx + detail) * math.sqrt(.5)
+    odd = (approx - detail) * math.sqrt(.5)
+    x = torch.stack([even, odd], dim=-1).flatten(-2)[..., :length]
+    return x.movedim(-1, axis)
+
+
+def _haar_decompose(x, axes):
+    """Splits x along all axes into the subbands 'aa', 'ad', ... like
+    pywt.dwtn."""
+    bands = {'': x}
+    for axis in axes:
+        bands = {key + name: band
+                 for key, value in bands.items()
+                 for name, band in zip('ad', _haar_split(value, axis))}
+    return bands
+
+
+def _haar_compose(bands, axes, shape):
+    for position, axis in reversed(list(enumerate(axes))):
+        bands = {key: _haar_merge(bands[key + 'a'], bands[key + 'd'], axis,
+                                  shape[axis])
+                 for key in {key[:position] for key in bands}}
+    return bands['']
+
+
+def _median_nonzero(values):
+    """Median of the non zero absolute values of every entry of the first
+    axis, like np.median on the non zero coefficients."""
+    values = values.abs().flatten(1).sort(dim=1).values
+    zeros = (values == 0).sum(1)
+    count = (values.shape[1] - zeros).clamp(min=1)
+    low = (zeros + (count - 1) // 2).unsqueeze(1)
+    high = (zeros + count // 2).unsqueeze(1)
+    return (values.gather(1, low) + values.gather(1, high)).squeeze(1) / 2
+
+
+def _wavelet_threshold(images, levels=None):
+    """BayesShrink soft thresholding with the Haar wavelet over all but the
+    first axis of images."""
+    axes = tuple(range(1, images.ndim))
+    if levels is None:
+        levels = max(int(math.log2(min(images.shape[1:]))) - 3, 1)
+    approx, details, shapes = images, [], []
+    for _ in range(levels):
+        shapes.append(approx.shape)
+        bands = _haar_decompose(approx, axes)
+        approx = bands.pop('a' * len(axes))
+        details.append(bands)
+
+    expand = (-1,) + (1,) * len(axes)
+    sigma = _median_nonzero(details[0]['d' * len(axes)]) / _MAD_SCALE
+    var = (sigma ** 2).reshape(expand)
+    eps = torch.finfo(images.dtype).eps
+    for bands in details:
+        for key, band in bands.items():
+            dvar = (band * band).flatten(1).mean(1).reshape(expand)
+            threshold = var / torch.sqrt(torch.clamp(dvar - var, min=eps))
+            bands[key] = torch.sign(band) * \
+                torch.clamp(band.abs() - threshold, min=0)
+
+    for bands, shape in zip(reversed(details), reversed(shapes)):
+        bands['a' * len(axes)] = approx
+        approx = _haar_compose(bands, axes, shape)
+    return approx
+
+
+def _rgb_to_ycbcr(images):
+    matrix = _YCBCR_FROM_RGB.to(images.dtype)
+    offset = _YCBCR_OFFSET.to(images.dtype).reshape(1, 3, 1, 1)
+    return torch.einsum('ij,njhw->nihw', matrix, images) + offset
+
+
+def _ycbcr_to_rgb(images):
+    matrix = torch.linalg.inv(_YCBCR_FROM_RGB).to(images.dtype)
+    offset = _YCBCR_OFFSET.to(images.dtype).reshape(1, 3, 1, 1)
+    return torch.einsum('ij,njhw->nihw', matrix, images - offset)
+
+
+def _wavelet(images, multichannel, convert2ycbcr, levels):
+    count, channels = images.shape[:2]
+    low = -1. if bool((images < 0).any()) else 0.
+    if not multichannel:
+        out = _wavelet_threshold(images, levels)
+    elif convert2ycbcr and channels == 3:
+        out = _rgb_to_ycbcr(images)
+        flat = out.flatten(2)
+        minimum = flat.min(2).values[..., None, None]
+        scale = (flat.max(2).values[..., None, None] - minimum)
+        safe = torch.where(scale == 0, torch.ones_like(scale), scale)
+        channel = ((out - minimum) / safe).reshape((-1,) + out.shape[2:])
+        denoised = _wavelet_threshold(channel, levels).clamp(0, 1)
+        denoised = denoised.reshape(out.shape) * safe + minimum
+        out = _ycbcr_to_rgb(torch.where(scale == 0, out, denoised))
+    else:
+        flat = images.reshape((-1,) + images.shape[2:])
+        out = _wavelet_threshold(flat, levels).reshape(images.shape)
+    return out.clamp(low, 1.)
+
+
+def wavelet(images,
+            multichannel: bool = True,
+            convert2ycbcr: bool = False,
+            levels: int = None):
+    """Wavelet denoising with the Haar wavelet, BayesShrink thresholds and
+    soft thresholding, which are the defaults of skimage.
+
+    Args:
+        images (Tensor): C x H x W image or N x C x H x W batch.
+        multichannel (bool): Denoise every channel separately.
+        convert2ycbcr (bool): Denoise RGB images in the YCbCr colorspace.
+        levels (int, optional): Number of decomposition levels, defaults to
+            the maximal number of levels minus 3 like skimage.
+    """
+    return _batched(_wavelet, images, multichannel=multichannel,
+                    convert2ycbcr=convert2ycbcr, levels=levels)
+
+
+class TorchTotalVariation(object):
+    """Denoises the Image tensor with Total Variation Filter (Chambolle)
+
+    Args:
+        weight (float): Denoising weight. The greater weight, the more
+            denoising (at the expense of fidelity to input).
+        multichannel (bool): Apply total-variation denoising separately for
+            each channel. This option should be true for color images,
+            otherwise the denoising is also applied in the channels dimension.
+    """
+    def __init__(self,
+                 weight: float = 0.1,
+                 multichannel: bool = True) -> None:
+        assert isinstance(weight, float), \
+            "weight needs to be a float value"
+        assert isinstance(multichannel, bool), \
+            "multichannel needs to be a bool value"
+        self.__weight = weight
+        self.__multichannel = multichannel
+
+    def __call__(self, sample: dict) -> dict:
+        image, label = sample['image'], sample['label']
+        image = tv_chambolle(image,
+                             weight=self.weight,
+                             multichannel=self.multichannel)
+
+        return {'image': image, 'label': label}
+
+    def __getWeight__(self):
+        return self.__weight
+
+    def __getMultichannel__(self):
+        return self.__multichannel
+
+    def __setWeight__(self, var_to_set):
+        if isinstance(var_to_set, float):
+            self.__weight = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "weight needs to be a float value")
+
+    def __setMultichannel__(self, var_to_set):
+        if isinstance(var_to_set, bool):
+            self.__multichannel = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "multichannel needs to be a bool value")
+
+    weight = property(__getWeight__, __setWeight__)
+    multichannel = property(__getMultichannel__, __setMultichannel__)
+
+
+class TorchTotalVariation2(object):
+    """Denoises the Image tensor with Total Variation Filter (Bregman)
+
+    Args:
+        weight (float): Denoising weight. The smaller the weight, the more
+            denoising (at the expense of less similarity to the input). The
+            regularization parameter lambda is chosen as 2 * weight.
+        isotropic (bool): Switch between isotropic and anisotropic TV
+            denoising.
+    """
+    def __init__(self,
+                 weight: float = 4.0,
+                 isotropic: bool = True) -> None:
+        assert isinstance(weight, float), \
+            "weight needs to be a float value"
+        assert isinstance(isotropic, bool), \
+            "isotropic needs to be a bool value"
+        self.__weight = weight
+        self.__isotropic = isotropic
+
+    def __call__(self, sample: dict) -> dict:
+        image, label = sample['image'], sample['label']
+        image = tv_bregman(image,
+                           weight=self.weight,
+                           isotropic=self.isotropic)
+
+        return {'image': image, 'label': label}
+
+    def __getWeight__(self):
+        return self.__weight
+
+    def __getIsotropic__(self):
+        return self.__isotropic
+
+    def __setWeight__(self, var_to_set):
+        if isinstance(var_to_set, float):
+            self.__weight = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "weight needs to be a float value")
+
+    def __setIsotropic__(self, var_to_set):
+        if isinstance(var_to_set, bool):
+            self.__isotropic = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "isotrpoic needs to be a bool value")
+
+    weight = property(__getWeight__, __setWeight__)
+    isotropic = property(__getIsotropic__, __setIsotropic__)
+
+
+class TorchWavelet(object):
+    """Denoises the Image tensor with a Haar wavelet.
+
+    Args:
+        multichannel (bool): Apply the denoising separately for each channel.
+            This option should be true for color images, otherwise the
+            denoising is also applied in the channels dimension.
+        convert2ycbcr (bool): If True and multichannel True, do the wavelet
+            denoising in the YCbCr colorspace instead of the RGB color space.
+            This typically results in better performance for RGB images.
+    """
+    def __init__(self,
+                 multichannel: bool = True,
+                 convert2ycbcr: bool = False) -> None:
+        assert isinstance(multichannel, bool), \
+            "multichannel needs to be a bool value"
+        assert isinstance(convert2ycbcr, bool), \
+            "convert2ycbr needs to be a bool value"
+        self.__multichannel = multichannel
+        self.__convert2ycbcr = convert2ycbcr
+
+    def __call__(self, sample: dict) -> dict:
+        image, label = sample['image'], sample['label']
+        image = wavelet(image,
+                        multichannel=self.multichannel,
+                        convert2ycbcr=self.convert2ycbcr)
+
+        return {'image': image, 'label': label}
+
+    def __getMultichannel__(self):
+        return self.__multichannel
+
+    def __getConvert2ycbcr__(self):
+        return self.__convert2ycbcr
+
+    def __setMultichannel__(self, var_to_set):
+        if isinstance(var_to_set, bool):
+            self.__multichannel = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "multichannel needs to be a bool value")
+
+    def __setConvert2ycbcr__(self, var_to_set):
+        if isinstance(var_to_set, bool):
+            self.__convert2ycbcr = var_to_set
+        else:
+            raise ValueError(
+                var_to_set,
+                "convert2ycbcr needs to be a bool value")
+
+    multichannel = property(__getMultichannel__, __setMultichannel__)
+    convert2ycbcr = property(__getConvert2ycbcr__, __setConvert2ycbcr__)
@@ -4,13 +4,14 @@
 from __future__ import absolute_import
 import torch
 import numpy as np
-from skimage.util import img_as_float64
 
 
 class ToTensor(object):
     """Convert ndarrays in sample to Tensors."""
 
     def __call__(self, sample: dict) -> dict:
+        # pylint: disable=import-outside-toplevel
+        from skimage.util import img_as_float64
         image, label = sample['image'], sample['label']
 
         if len(image.shape) == 2:
@@ -23,3 +24,95 @@ class ToTensor(object):
         label = label.transpose((2, 0, 1))
         return {'image': torch.from_numpy(img_as_float64(image)),
                 'label': torch.from_numpy(img_as_float64(label))}
+
+
+class ToCompactTensor(object):
+    """Convert PIL images or ndarrays in sample to compact Tensors.
+
+    The image is wrapped with torch.from_numpy and only permuted to
+    C x H x W, so no copy is made as long as no dtype conversion or
+    contiguous layout is requested. Labels stay integer class indices.
+    Pin the batches with DataLoader(pin_memory=True): tensors pinned in a
+    worker lose the pinning on their way to the main process, and a forked
+    worker cannot initialise CUDA.
+
+    Args:
+        dtype (torch.dtype): torch.uint8 keeps the raw values, torch.float16
+            and torch.float32 scale the image to [0, 1].
+        label_dtype (torch.dtype): torch.uint8 or torch.int64.
+        channels_last (bool): Keep the H x W x C memory layout of the
+            decoded image. Use collate_channels_last to get a channels last
+            batch from the DataLoader.
+    """
+    def __init__(self,
+                 dtype: torch.dtype = torch.float32,
+                 label_dtype: torch.dtype = torch.int64,
+                 channels_last: bool = False) -> None:
+        assert dtype in (torch.uint8, torch.float16, torch.float32), \
+            "dtype needs to be torch.uint8, torch.float16 or torch.float32"
+        assert label_dtype in (torch.uint8, torch.int64), \
+            "label_dtype needs to be torch.uint8 or torch.int64"
+        assert isinstance(channels_last, bool), \
+            "channels_last needs to be a bool value"
+        self.dtype = dtype
+        self.label_dtype = label_dtype
+        self.channels_last = channels_last
+
+    def __call__(self, sample: dict) -> dict:
+        image, label = _writable(sample['image']), _writable(sample['label'])
+
+        if image.ndim == 2:
+            image = image[..., np.newaxis]
+        image = torch.from_numpy(image).permute(2, 0, 1)
+        if image.shape[0] == 1:
+            image = image.expand(3, -1, -1)
+        image = self._convert(image)
+        if not self.channels_last:
+            image = image.contiguous()
+
+        label = torch.from_numpy(label)
+        if label.ndim == 3:
+            label = label.permute(2, 0, 1).contiguous()
+        label = label.to(self.label_dtype)
+        return {'image': image, 'label': label}
+
+    def _convert(self, image):
+        if image.dtype == self.dtype:
+            return image
+        if self.dtype == torch.uint8:
+            if image.is_floating_point():
+                return image.mul(255).round_().clamp_(0, 255).to(torch.uint8)
+            return image.to(torch.uint8)
+        if image.is_floating_point():
+            return image.to(self.dtype)
+        scale = 1. / float(torch.iinfo(image.dtype).max)
+        return image.to(self.dtype).mul_(scale)
+
+
+def _writable(array):
+    """Returns the array as ndarray torch can wrap, which needs a copy only
+    for read-only data like PIL images or memory maps.
+    """
+    array = np.asarray(array)
+    if not array.flags.writeable:
+        array = np.array(array)
+    return array
+
+
+def collate_channels_last(batch: list) -> dict:
+    """Collates samples of ToCompactTensor into a N x C x H x W batch in
+    torch.channels_last memory format. Use it as collate_fn of the DataLoader.
+    """
+    result = {}
+    for key in batch[0]:
+        elems = [sample[key] for sample in batch]
+        if elems[0].ndim != 3:
+            result[key] = torch.stack(elems)
+            continue
+        channels, height, width = elems[0].shape
+        out = torch.empty((len(elems), height, width, channels),
+                          dtype=elems[0].dtype)
+        for index, elem in enumerate(elems):
+            out[index].copy_(elem.permute(1, 2, 0))
+        result[key] = out.permute(0, 3, 1, 2)
+    return result
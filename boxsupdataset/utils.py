@@ -1,10 +1,91 @@
+""" This utils module holds helpers which are shared by the modules of this
+    package:
+        atomic_write: Writes a file through a temporary file next to it, so
+            readers see either the old or the complete new file.
+        Progress: Prints the count of done items to stderr.
+        show_x_images: Plots an image above its label.
+"""
+
+from __future__ import absolute_import
+from contextlib import contextmanager
+from pathlib import Path
+import os
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-from skimage.util import img_as_float
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """ Opens a temporary file next to path, which replaces path when the
+    block ends without an error. Otherwise the temporary file is removed and
+    path stays as it was. The name of the temporary file holds the process
+    id, so processes which write the same path do not collide.
+
+        with atomic_write(path) as out_file:
+            np.save(out_file, array)
+
+    Args:
+        path (string): File to write.
+        mode (string): Mode of open, 'wb' or 'w'.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, mode) as tmp_file:
+            yield tmp_file
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class Progress(object):
+    """ Prints done/total items to stderr and rewrites the line with every
+    update. Used as context manager, the line is ended on exit.
+
+    Args:
+        total (int): Number of items.
+        unit (string): Name of the items, e.g. 'images'.
+        enabled (bool): Print nothing if False, e.g. the progress argument
+            of the caller.
+    """
+    def __init__(self, total: int, unit: str = 'samples',
+                 enabled: bool = True) -> None:
+        self.total = total
+        self.unit = unit
+        self.enabled = enabled
+        self.done = 0
+
+    def update(self, count: int = 1) -> int:
+        """ Adds count done items and returns the number of done items."""
+        self.done += count
+        if self.enabled:
+            print(f'\r{self.done}/{self.total} {self.unit}', end='',
+                  file=sys.stderr)
+        return self.done
+
+    def close(self):
+        """ Ends the progress line."""
+        if self.enabled:
+            print(file=sys.stderr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 def show_x_images(image, label):
     """Show images with labelimages"""
+    # matplotlib and skimage are only needed for plotting
+    # pylint: disable=import-outside-toplevel
+    import matplotlib.pyplot as plt
+    from skimage.util import img_as_float
+
     if len(image.shape) == 2:
         image = np.dstack([image]*3)
 
@@ -10,5 +10,17 @@ setuptools.setup(
     version="1.0",
     author="MaKaNu",
     url="https://github.com/MaKaNu/PyTorch_Nasa_Dataset",
-    packages=setuptools.find_packages()
+    packages=setuptools.find_packages(),
+    entry_points={
+        'console_scripts': [
+            'boxsup-pack-shards=boxsupdataset.shards:main',
+            'boxsup-preprocess=boxsupdataset.preprocess:main',
+            'boxsup-benchmark=boxsupdataset.benchmark:main',
+            'boxsup-convert-labels=boxsupdataset.convert:main',
+            'boxsup-build-pyramid=boxsupdataset.pyramid:main',
+            'boxsup-sweep=boxsupdataset.transforms.sweep:main',
+            'boxsup-tune-threads=boxsupdataset.threads:main',
+            'boxsup-quicklook=boxsupdataset.quicklook:main',
+        ],
+    }
 )
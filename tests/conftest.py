@@ -0,0 +1,17 @@
+""" Fixtures of the tests: a small synthetic root_dir per test."""
+
+import pytest
+from boxsupdataset.benchmark import CLASSFILE, make_synthetic_tree
+
+
+@pytest.fixture
+def root_dir(tmp_path):
+    """ root_dir with 12 noisy 32 x 40 images and box masks."""
+    return make_synthetic_tree(tmp_path / 'root', count=12, height=32,
+                               width=40)
+
+
+@pytest.fixture
+def classfile():
+    """ Name of the classes file of the synthetic root_dir."""
+    return CLASSFILE
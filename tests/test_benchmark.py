@@ -0,0 +1,15 @@
+""" Tests of the benchmark on a root_dir of its own."""
+
+from boxsupdataset.benchmark import run
+
+
+def test_run_uses_classfile_and_skips_missing_png_labels(root_dir):
+    (root_dir / 'Labels' / 'classes_bxsp.txt').rename(
+        root_dir / 'Labels' / 'classes.txt')
+    for path in root_dir.glob('Labels/*_label.png'):
+        path.unlink()
+    results = run(root_dir, count=2, workers=(0,), transform_samples=1,
+                  classfile='classes.txt')['results']
+    assert results['label_png'] == {'skipped': 'no png labels'}
+    assert results['getitem']['samples'] == 2
+    assert results['dataloader_0']['samples'] == 2
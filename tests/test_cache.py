@@ -0,0 +1,80 @@
+""" Tests of the SampleCache and SharedSampleStore invalidation."""
+
+import os
+import numpy as np
+from PIL import Image
+from boxsupdataset.cache import SampleCache
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+
+
+def _dataset(root_dir, classfile, **kwargs):
+    return NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                             target_transfrom=np.asarray, **kwargs)
+
+
+def _rewrite(path, value):
+    image = np.array(Image.open(path))
+    image[...] = value
+    Image.fromarray(image).save(path)
+    # a new mtime even on file systems with a coarse resolution
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_cache_matches_decoded_files(root_dir, classfile, tmp_path):
+    dataset = _dataset(root_dir, classfile, cache_dir=tmp_path / 'cache')
+    plain = _dataset(root_dir, classfile)
+    for idx in range(len(dataset)):
+        assert np.array_equal(dataset[idx]['image'], plain[idx]['image'])
+        assert np.array_equal(dataset[idx]['label'], plain[idx]['label'])
+
+
+def test_cache_rebuilds_changed_files(root_dir, classfile, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    dataset = _dataset(root_dir, classfile, cache_dir=cache_dir)
+    _rewrite(dataset.imgs[3][0], 9)
+    assert not SampleCache(cache_dir).matches(dataset.imgs)
+    reopened = _dataset(root_dir, classfile, cache_dir=cache_dir)
+    assert (reopened[3]['image'] == 9).all()
+
+
+def test_refresh_updates_only_changed_samples(root_dir, classfile,
+                                              tmp_path):
+    for kwargs in ({'cache_dir': tmp_path / 'cache'}, {'in_memory': True}):
+        dataset = _dataset(root_dir, classfile, **kwargs)
+        _rewrite(dataset.imgs[5][0], 7)
+        changes = dataset.refresh(force=True)
+        assert changes['changed'] == [dataset.imgs[5][0].stem]
+        assert (dataset[5]['image'] == 7).all()
+        plain = _dataset(root_dir, classfile)
+        for idx in range(len(dataset)):
+            assert np.array_equal(dataset[idx]['image'],
+                                  plain[idx]['image'])
+
+
+def test_rebuild_switches_data_file_with_index(root_dir, classfile,
+                                               tmp_path):
+    cache_dir = tmp_path / 'cache'
+    dataset = _dataset(root_dir, classfile, cache_dir=cache_dir)
+    reader = SampleCache(cache_dir)
+    old_path = reader.data_path
+    expected = np.array(reader[2][0])
+    SampleCache(cache_dir).build(dataset.imgs)
+    # the reader still holds the old index, whose data file is gone
+    assert not old_path.exists()
+    assert np.array_equal(reader[2][0], expected)
+    fresh = SampleCache(cache_dir)
+    assert fresh.data_path != old_path
+    assert [path.name for path in cache_dir.glob('samples*.u8')] == \
+        [fresh.data_path.name]
+    assert os.path.getsize(fresh.data_path) == int(fresh.index['data_size'])
+
+
+def test_cache_without_data_file_is_rebuilt(root_dir, classfile, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    dataset = _dataset(root_dir, classfile, cache_dir=cache_dir)
+    SampleCache(cache_dir).data_path.unlink()
+    assert not SampleCache(cache_dir).matches(dataset.imgs)
+    reopened = _dataset(root_dir, classfile, cache_dir=cache_dir)
+    assert np.array_equal(reopened[0]['image'],
+                          _dataset(root_dir, classfile)[0]['image'])
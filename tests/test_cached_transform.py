@@ -0,0 +1,66 @@
+""" Tests of the keys and the size limit of the CachedTransform."""
+
+import io
+import os
+import numpy as np
+from boxsupdataset.transforms.cache import CachedTransform
+
+
+class Scale(object):
+    """ Deterministic transform with a parameter, which counts its calls."""
+    def __init__(self, weight):
+        self.__weight = weight
+        self.calls = 0
+
+    @property
+    def weight(self):
+        """ Factor of the image."""
+        return self.__weight
+
+    def __call__(self, sample):
+        self.calls += 1
+        return {'image': sample['image'] * self.weight,
+                'label': sample['label']}
+
+
+def _sample(value, source=None):
+    sample = {'image': np.full((16, 16), value, np.float64), 'label': None}
+    if source is not None:
+        sample['source'] = source
+    return sample
+
+
+def test_entries_follow_content_and_params(tmp_path):
+    transform = Scale(2.)
+    cached = CachedTransform(transform, tmp_path)
+    assert (cached(_sample(1.))['image'] == 2.).all()
+    assert (cached(_sample(1.))['image'] == 2.).all()
+    assert (cached(_sample(3.))['image'] == 6.).all()
+    assert transform.calls == 2 and cached.hits == 1
+    assert cached.key(_sample(1.)['image']) != \
+        CachedTransform(Scale(3.), tmp_path).key(_sample(1.)['image'])
+
+
+def test_source_keys_follow_size_and_mtime(tmp_path):
+    source = tmp_path / 'image.png'
+    source.write_bytes(b'png')
+    cached = CachedTransform(Scale(2.), tmp_path / 'cache')
+    key = cached.key(None, source)
+    assert cached.key(None, source) == key
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cached.key(None, source) != key
+    cached(_sample(1., source))
+    assert (cached(_sample(5., source))['image'] == 2.).all()
+
+
+def test_size_limit_holds_for_all_processes(tmp_path):
+    entry = io.BytesIO()
+    np.save(entry, _sample(0.)['image'])
+    entry_size = len(entry.getvalue())
+    workers = [CachedTransform(Scale(2.), tmp_path, 3 * entry_size)
+               for _ in range(2)]
+    for value in range(8):
+        workers[value % 2](_sample(float(value)))
+        size = sum(path.stat().st_size for path in tmp_path.glob('*/*.npy'))
+        assert 0 < size <= 3 * entry_size
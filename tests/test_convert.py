@@ -0,0 +1,36 @@
+""" Tests of the .mat to .npy label conversion."""
+
+import os
+import numpy as np
+import scipy.io as sio
+from boxsupdataset.convert import convert_label, convert_labels
+from boxsupdataset.decode import decode_label
+from boxsupdataset.manifest import pair_files
+
+
+def test_conversion_keeps_dtype_and_values(tmp_path):
+    mask = np.arange(12, dtype=np.uint16).reshape(3, 4) * 100
+    mat_path = tmp_path / 'a_label.mat'
+    sio.savemat(mat_path, {'mask_data': mask})
+    convert_label(mat_path)
+    converted = np.load(tmp_path / 'a_label.npy')
+    assert converted.dtype == np.uint16
+    assert np.array_equal(converted, mask)
+    assert np.array_equal(decode_label(tmp_path / 'a_label.npy'),
+                          decode_label(mat_path))
+
+
+def test_pair_files_prefers_current_conversions(root_dir):
+    assert convert_labels(root_dir, workers=1) == 12
+    pairs = pair_files(root_dir)
+    assert len(pairs) == 12
+    assert all(label.name.endswith('.npy') for _, label in pairs.values())
+    # a changed .mat label is used until it is converted again
+    mat_path = root_dir / 'Labels' / 'sample000000_label.mat'
+    sio.savemat(mat_path, {'mask_data': np.ones((32, 40), np.uint8)})
+    stat = os.stat(mat_path)
+    os.utime(mat_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    label = pair_files(root_dir)['sample000000'][1]
+    assert label.name.endswith('.mat')
+    assert convert_labels(root_dir, workers=1) == 1
+    assert pair_files(root_dir)['sample000000'][1].name.endswith('.npy')
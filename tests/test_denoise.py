@@ -0,0 +1,109 @@
+""" Tests of the batch and torch denoise solvers against skimage."""
+
+import time
+import numpy as np
+import pytest
+import torch
+from skimage.restoration import denoise_tv_bregman, denoise_tv_chambolle
+from boxsupdataset.transforms.batch import tv_bregman_batch, \
+    tv_chambolle_batch
+from boxsupdataset.transforms.torch_denoise import tv_bregman, tv_chambolle
+
+
+@pytest.fixture
+def images():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (2, 3, 24, 30), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('isotropic', [True, False])
+@pytest.mark.parametrize('weight', [5.0, 0.5])
+def test_bregman_matches_skimage(images, weight, isotropic):
+    result = tv_bregman_batch(images, weight=weight, isotropic=isotropic,
+                              workers=1)
+    for image, denoised in zip(images, result):
+        for channel, expected in zip(image, denoised):
+            # skimage's channel_axis path carries state from one channel
+            # into the next, so every channel is compared as 2d image
+            reference = denoise_tv_bregman(channel / 255., weight=weight,
+                                           isotropic=isotropic)
+            np.testing.assert_allclose(expected, reference, atol=1e-12)
+
+
+@pytest.mark.parametrize('isotropic', [True, False])
+def test_bregman_joint_channels_match_skimage(images, isotropic):
+    result = tv_bregman_batch(images, weight=5.0, isotropic=isotropic,
+                              multichannel=False, workers=1)
+    for image, denoised in zip(images, result):
+        reference = denoise_tv_bregman(image.transpose(1, 2, 0) / 255.,
+                                       weight=5.0, isotropic=isotropic)
+        np.testing.assert_allclose(denoised.transpose(1, 2, 0), reference,
+                                   atol=1e-12)
+
+
+def test_chambolle_matches_skimage(images):
+    result = tv_chambolle_batch(images, workers=1)
+    for image, denoised in zip(images, result):
+        reference = denoise_tv_chambolle(image.transpose(1, 2, 0) / 255.,
+                                         channel_axis=-1)
+        np.testing.assert_allclose(denoised.transpose(1, 2, 0), reference,
+                                   atol=1e-12)
+
+
+@pytest.mark.parametrize('isotropic', [True, False])
+def test_torch_bregman_follows_skimage(images, isotropic):
+    # the red-black order stops at another iterate than skimage's sweep
+    expected = tv_bregman_batch(images, isotropic=isotropic, workers=1)
+    result = tv_bregman(torch.from_numpy(images / 255.),
+                        isotropic=isotropic)
+    np.testing.assert_allclose(result.numpy(), expected, atol=5e-2)
+    result = tv_bregman(torch.from_numpy(images), isotropic=isotropic)
+    assert result.dtype == torch.float32
+    np.testing.assert_allclose(result.numpy(), expected, atol=5e-2)
+
+
+@pytest.mark.parametrize('isotropic', [True, False])
+def test_torch_bregman_converges_to_skimage(images, isotropic):
+    # both orders converge to the same solution
+    kwargs = {'eps': 1e-8, 'max_num_iter': 20000, 'isotropic': isotropic}
+    expected = tv_bregman_batch(images[:1], workers=1, **kwargs)
+    result = tv_bregman(torch.from_numpy(images[:1] / 255.), **kwargs)
+    np.testing.assert_allclose(result.numpy(), expected, atol=1e-4)
+
+
+def test_torch_chambolle_matches_batch(images):
+    expected = tv_chambolle_batch(images, workers=1)
+    result = tv_chambolle(torch.from_numpy(images / 255.))
+    np.testing.assert_allclose(result.numpy(), expected, atol=1e-12)
+    result = tv_chambolle(torch.from_numpy(images))
+    assert result.dtype == torch.float32
+    np.testing.assert_allclose(result.numpy(), expected, atol=1e-4)
+
+
+def _seconds(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def test_solver_throughput():
+    images = np.random.default_rng(0).integers(0, 256, (4, 3, 128, 128),
+                                               dtype=np.uint8)
+    floats = images / 255.
+    bregman = _seconds(lambda: [denoise_tv_bregman(channel, weight=4.0)
+                                for image in floats for channel in image])
+    chambolle = _seconds(lambda: [denoise_tv_chambolle(
+        image.transpose(1, 2, 0), channel_axis=-1) for image in floats])
+    # the batch functions must not be slower than calling skimage directly
+    assert _seconds(lambda: tv_bregman_batch(images, workers=1)) < \
+        1.5 * bregman + 0.05
+    assert _seconds(lambda: tv_chambolle_batch(images, workers=1)) < \
+        1.5 * chambolle + 0.05
+    # the tensor solvers run whole array updates, about 2x skimage on one
+    # core for Bregman, the former pixel order sweep took 20x
+    tensor = torch.from_numpy(images)
+    assert _seconds(lambda: tv_bregman(tensor)) < 5 * bregman + 0.05
+    assert _seconds(lambda: tv_chambolle(tensor)) < 1.5 * chambolle + 0.05
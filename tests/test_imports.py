@@ -0,0 +1,35 @@
+""" Tests of the deferred imports of the package."""
+
+import subprocess
+import sys
+
+HEAVY = ('scipy', 'skimage', 'pandas', 'matplotlib')
+
+
+def _loaded(code):
+    """ Heavy modules which are loaded after code ran in a new
+        interpreter.
+    """
+    script = f'import sys\n{code}\n' \
+        f'print(",".join(name for name in {HEAVY!r} if name in sys.modules))'
+    output = subprocess.run([sys.executable, '-c', script], check=True,
+                            capture_output=True, text=True).stdout
+    return set(filter(None, output.strip().split(',')))
+
+
+def test_import_loads_no_heavy_modules():
+    assert not _loaded('import boxsupdataset.nasa_box_sup_dataset\n'
+                       'import boxsupdataset.transforms.denoise\n'
+                       'import boxsupdataset.transforms.utils\n'
+                       'import boxsupdataset.utils')
+
+
+def test_dataset_loads_only_what_it_needs(root_dir, classfile):
+    code = ('import numpy as np\n'
+            'from boxsupdataset.nasa_box_sup_dataset import '
+            'NasaBoxSupDataset\n'
+            f'dataset = NasaBoxSupDataset({classfile!r}, {str(root_dir)!r}, '
+            '{!r}, np.asarray)\n'
+            'dataset[0]')
+    assert _loaded(code.format('image')) == set()
+    assert _loaded(code.format('mask')) == {'scipy'}
@@ -0,0 +1,54 @@
+""" Tests of the StageTimer records."""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import numpy as np
+from boxsupdataset.convert import convert_labels
+from boxsupdataset.instrumentation import StageTimer
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+
+
+def test_concurrent_records_are_not_lost():
+    timer = StageTimer()
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda _: [timer.record('image', 1e-4, 3)
+                                     for _ in range(500)], range(8)))
+        stats = timer.stats()['image']
+        assert stats['count'] == 4000
+        assert stats['bytes'] == 12000
+    finally:
+        timer.close()
+
+
+def test_bytes_are_the_file_sizes(root_dir, classfile):
+    timer = StageTimer()
+    try:
+        dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                                    timer=timer)
+        for idx in range(len(dataset)):
+            dataset[idx]
+        stats = timer.stats()
+        assert stats['image']['bytes'] == sum(
+            os.path.getsize(img_path) for img_path, _ in dataset.imgs)
+        assert stats['label_mat']['bytes'] == sum(
+            os.path.getsize(mask_path) for _, mask_path in dataset.imgs)
+    finally:
+        timer.close()
+
+
+def test_label_stage_follows_the_decoded_format(root_dir, classfile):
+    convert_labels(root_dir, workers=1)
+    timer = StageTimer()
+    try:
+        dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                                    timer=timer)
+        for idx in range(len(dataset)):
+            dataset[idx]
+        stats = timer.stats()
+        assert stats['label_npy']['count'] == len(dataset)
+        assert stats['label_npy']['bytes'] == sum(
+            os.path.getsize(mask_path) for _, mask_path in dataset.imgs)
+        assert 'label_mat' not in stats
+    finally:
+        timer.close()
@@ -0,0 +1,70 @@
+""" Tests of the class encoding and the packed label storage."""
+
+import numpy as np
+import pytest
+from boxsupdataset.labels import ClassEncoder, ClassTable, PackedLabel
+
+
+def _table(tmp_path, text):
+    path = tmp_path / 'classes.txt'
+    path.write_text(text)
+    return ClassTable(path)
+
+
+def test_encoder_maps_values_to_rows(tmp_path):
+    classes = _table(tmp_path, 'name,value\nsky,10\nrock,3\nsand,7\n')
+    encoder = ClassEncoder(classes)
+    mask = np.array([[10, 3, 7], [0, 300, 10]])
+    assert encoder(mask).tolist() == [[0, 1, 2], [255, 255, 0]]
+    assert encoder.num_classes == 3
+    assert ClassEncoder(classes, ignore_index=9)(mask)[1].tolist() == \
+        [9, 9, 0]
+
+
+def test_encoder_maps_colors(tmp_path):
+    classes = _table(tmp_path, 'name,r,g,b\nsky,0,0,255\nrock,200,10,10\n')
+    encoder = ClassEncoder(classes)
+    label = np.array([[[200, 10, 10], [0, 0, 255], [200, 10, 11]]],
+                     dtype=np.uint8)
+    assert encoder(label).tolist() == [[1, 0, 255]]
+    with pytest.raises(RuntimeError):
+        ClassEncoder(_table(tmp_path, 'name,value\nsky,1\n'))(label)
+
+
+def test_fingerprint_follows_the_mapping(tmp_path):
+    classes = _table(tmp_path, 'name,value\nsky,1\nrock,2\n')
+    encoder = ClassEncoder(classes)
+    fingerprint = encoder.fingerprint()
+    # unknown values grow the lookup table, not the mapping
+    encoder(np.array([1000]))
+    assert encoder.fingerprint() == fingerprint
+    assert ClassEncoder(classes, ignore_index=254).fingerprint() != \
+        fingerprint
+    other = _table(tmp_path, 'name,value\nsky,2\nrock,1\n')
+    assert ClassEncoder(other).fingerprint() != fingerprint
+
+
+@pytest.mark.parametrize('method', PackedLabel.METHODS)
+@pytest.mark.parametrize('top', [0, 1, 3, 15, 255])
+def test_packed_label_round_trip(method, top):
+    rng = np.random.default_rng(top)
+    label = rng.integers(0, top + 1, (13, 7)).astype(np.uint8)
+    label[:5] = top
+    packed = PackedLabel(label, method)
+    decoded = packed.decode()
+    assert decoded.dtype == np.uint8 and np.array_equal(decoded, label)
+    assert np.array_equal(packed.decode(np.int64), label)
+    if method == 'bitpack':
+        assert packed.nbytes == -(-label.size * packed.bits // 8)
+
+
+def test_packed_label_keeps_shape_and_dtype():
+    label = np.zeros((4, 5, 3), dtype=np.int16)
+    label[1:3, 2:] = (1, 2, 300)
+    assert np.array_equal(PackedLabel(label).decode(), label)
+    assert PackedLabel(label).decode().dtype == np.int16
+    empty = np.zeros((0, 6), dtype=np.uint8)
+    for method in PackedLabel.METHODS:
+        assert PackedLabel(empty, method).decode().shape == (0, 6)
+    with pytest.raises(AssertionError):
+        PackedLabel(label, 'bitpack')
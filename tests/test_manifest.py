@@ -0,0 +1,113 @@
+""" Tests of the pairing of the files, the incremental Manifest and its
+    integrity checks."""
+
+import os
+import shutil
+import numpy as np
+import pytest
+from boxsupdataset import manifest as manifest_module
+from boxsupdataset.manifest import (Manifest, compare_snapshots, pair_files,
+                                    snapshot)
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+
+
+def _touch(path):
+    # a new mtime even on file systems with a coarse resolution
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_pair_files_skips_orphans(root_dir):
+    os.remove(root_dir / 'Labels' / 'sample000003_label.mat')
+    with pytest.warns(UserWarning, match='without partner'):
+        pairs = pair_files(root_dir)
+    assert len(pairs) == 11 and 'sample000003' not in pairs
+    img, mask = pairs['sample000004']
+    assert (img.name, mask.name) == ('sample000004.png',
+                                     'sample000004_label.mat')
+    assert len(pair_files(root_dir, 'image')) == 12
+    with pytest.raises(RuntimeError):
+        pair_files(root_dir, 'box')
+
+
+def test_snapshot_differences(root_dir):
+    old = snapshot(pair_files(root_dir))
+    os.remove(root_dir / 'Images' / 'sample000001.png')
+    os.remove(root_dir / 'Labels' / 'sample000001_label.mat')
+    _touch(root_dir / 'Labels' / 'sample000002_label.mat')
+    assert compare_snapshots(old, snapshot(pair_files(root_dir))) == {
+        'added': [], 'removed': ['sample000001'],
+        'changed': ['sample000002']}
+
+
+def test_manifest_reads_only_changed_pairs(root_dir, tmp_path,
+                                           monkeypatch):
+    path = tmp_path / 'manifest.json'
+    manifest = Manifest(root_dir, path=path)
+    assert not manifest.load()
+    changes = manifest.update()
+    assert len(changes['added']) == 12 and len(manifest) == 12
+    manifest.save()
+    entry = manifest.entries['sample000000']
+    assert entry['shape'] == [32, 40, 3] and entry['error'] is None
+    assert sum(entry['classes'].values()) == 32 * 40
+
+    reopened = Manifest(root_dir, path=path)
+    assert reopened.load() and reopened.entries == manifest.entries
+    assert not Manifest(root_dir, 'image', path).load()
+    # unchanged folders are not listed at all
+    monkeypatch.setattr(manifest_module, 'pair_files', None)
+    assert not any(reopened.update().values())
+    monkeypatch.undo()
+
+    _touch(root_dir / 'Images' / 'sample000005.png')
+    read = []
+    original = Manifest._read
+
+    def _read(self, job):
+        read.append(job[0])
+        return original(self, job)
+
+    monkeypatch.setattr(Manifest, '_read', _read)
+    assert reopened.update(force=True)['changed'] == ['sample000005']
+    assert read == ['sample000005']
+    assert reopened.entries['sample000005']['image_mtime'] == \
+        os.stat(root_dir / 'Images' / 'sample000005.png').st_mtime_ns
+
+
+def _copy_pair(root_dir, source, target):
+    for folder, suffix in (('Images', '.png'), ('Labels', '_label.mat')):
+        shutil.copyfile(root_dir / folder / f'{source}{suffix}',
+                        root_dir / folder / f'{target}{suffix}')
+
+
+def test_duplicates_and_broken_pairs(root_dir):
+    _copy_pair(root_dir, 'sample000002', 'sample000100')
+    _copy_pair(root_dir, 'sample000002', 'sample000101')
+    (root_dir / 'Labels' / 'sample000007_label.mat').write_bytes(b'broken')
+    manifest = Manifest(root_dir)
+    manifest.update()
+    assert manifest.duplicates() == [['sample000002', 'sample000100',
+                                      'sample000101']]
+    broken = manifest.broken()
+    assert list(broken) == ['sample000007']
+    assert broken['sample000007']
+    names = [img.name for img, _ in manifest.items()]
+    assert len(names) == 13 and 'sample000007.png' not in names
+    assert len(manifest.items(drop_broken=False)) == 14
+    names = [img.name for img, _ in manifest.items(drop_duplicates=True)]
+    assert len(names) == 11 and 'sample000002.png' in names
+    assert 'sample000100.png' not in names
+
+
+def test_dataset_drops_duplicates(root_dir, classfile, tmp_path):
+    _copy_pair(root_dir, 'sample000002', 'sample000100')
+    (root_dir / 'Labels' / 'sample000007_label.mat').write_bytes(b'broken')
+    with pytest.warns(UserWarning, match='could not be read'):
+        dataset = NasaBoxSupDataset(
+            classfile, root_dir, transform=np.asarray,
+            manifest=tmp_path / 'manifest.json', drop_duplicates=True)
+    assert len(dataset) == 11
+    with pytest.raises(AssertionError):
+        NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                          drop_duplicates=True)
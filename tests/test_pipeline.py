@@ -0,0 +1,87 @@
+""" Tests of the CompiledPipeline against the transforms it compiles."""
+
+import numpy as np
+import torch
+from PIL import Image
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+from boxsupdataset.prefetch import AsyncReader
+from boxsupdataset.transforms.denoise import TotalVariation2
+from boxsupdataset.transforms.pipeline import CompiledPipeline
+from boxsupdataset.transforms.torch_denoise import TorchTotalVariation
+from boxsupdataset.transforms.utils import ToCompactTensor, ToTensor
+
+
+class Record(object):
+    """Stores the type of the image it is called with and flips it."""
+    def __init__(self):
+        self.types = []
+
+    def __call__(self, sample):
+        self.types.append(type(sample['image']))
+        return {'image': np.asarray(sample['image'])[:, ::-1],
+                'label': sample['label']}
+
+
+def _sample():
+    rng = np.random.default_rng(0)
+    return {'image': rng.integers(0, 256, (12, 16, 3), dtype=np.uint8),
+            'label': rng.integers(0, 4, (12, 16), dtype=np.uint8)}
+
+
+def _compose(transforms, sample):
+    for transform in transforms:
+        sample = transform(sample)
+    return sample
+
+
+def test_unknown_transform_gets_the_original_image():
+    record = Record()
+    sample = _sample()
+    image = Image.fromarray(sample['image'])
+    CompiledPipeline([record, ToCompactTensor()])(
+        {'image': image, 'label': sample['label']})
+    assert record.types == [Image.Image]
+    CompiledPipeline([record])(sample)
+    assert record.types[-1] is np.ndarray
+
+
+def test_compiled_matches_compose():
+    sample = _sample()
+    sample['label'] = sample['label'][..., np.newaxis]
+    transforms = [Record(), Record(), ToTensor()]
+    expected = _compose(transforms, sample)
+    result = CompiledPipeline(transforms)(sample)
+    assert result['image'].dtype == torch.float32
+    for key in ('image', 'label'):
+        np.testing.assert_allclose(result[key].numpy(),
+                                   expected[key].numpy(), atol=1e-7)
+
+
+def test_torch_stage_matches_its_transform():
+    sample = _sample()
+    flipped = Record()(sample)
+    image = torch.from_numpy(flipped['image'].transpose(2, 0, 1) / 255.)
+    expected = TorchTotalVariation()({'image': image.float(),
+                                      'label': None})['image']
+    result = CompiledPipeline([Record(), TorchTotalVariation(),
+                               ToCompactTensor(dtype=torch.float32)])(sample)
+    np.testing.assert_allclose(result['image'].numpy(), expected.numpy(),
+                               atol=1e-6)
+
+
+def test_bregman_keeps_skimage_unless_requested():
+    transform = TotalVariation2()
+    assert CompiledPipeline([transform]).stages[0][1] is None
+    assert CompiledPipeline([transform],
+                            torch_bregman=True).stages[0][1] is not None
+
+
+def test_threaded_reader_matches_serial_path(root_dir, classfile):
+    pipeline = CompiledPipeline([TorchTotalVariation()])
+    threaded = NasaBoxSupDataset(classfile, root_dir, transform=pipeline,
+                                 reader=AsyncReader(workers=8))
+    serial = NasaBoxSupDataset(classfile, root_dir, transform=pipeline)
+    indices = list(range(len(serial))) * 4
+    for idx, sample in zip(indices, threaded.__getitems__(indices)):
+        np.testing.assert_array_equal(sample['image'],
+                                      serial[idx]['image'])
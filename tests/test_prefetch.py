@@ -0,0 +1,42 @@
+""" Tests of the AsyncReader read ahead."""
+
+import numpy as np
+from torch.utils.data import DataLoader, SequentialSampler
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+from boxsupdataset.prefetch import AsyncReader, PrefetchSampler
+
+
+def _loader(root_dir, classfile, batch_size):
+    reader = AsyncReader(workers=4)
+    dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                                target_transfrom=np.asarray, reader=reader)
+    sampler = PrefetchSampler(SequentialSampler(dataset), dataset)
+    return dataset, DataLoader(dataset, batch_size=batch_size,
+                               sampler=sampler)
+
+
+def test_unbatched_reads_ahead(root_dir, classfile):
+    dataset, loader = _loader(root_dir, classfile, batch_size=1)
+    list(loader)
+    assert dataset.reader.hits + dataset.reader.misses == len(dataset)
+    assert dataset.reader.misses <= 1
+
+
+def test_batched_reads_ahead(root_dir, classfile):
+    dataset, loader = _loader(root_dir, classfile, batch_size=4)
+    batches = list(loader)
+    reader = dataset.reader
+    assert sum(len(batch['image']) for batch in batches) == len(dataset)
+    assert reader.hits + reader.misses == len(dataset)
+    # only the first batch is read on request
+    assert reader.misses <= 4
+    assert reader.depth >= 2 * 4
+
+
+def test_batched_matches_unbatched(root_dir, classfile):
+    _, batched = _loader(root_dir, classfile, batch_size=4)
+    plain = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                              target_transfrom=np.asarray)
+    images = np.concatenate([batch['image'].numpy() for batch in batched])
+    assert np.array_equal(images, np.stack([plain[idx]['image']
+                                            for idx in range(len(plain))]))
@@ -0,0 +1,60 @@
+""" Tests of the resumable preprocess command."""
+
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from boxsupdataset.preprocess import parse_params, preprocess
+
+# found by the worker processes, which are forked from the test process
+TRANSFORM = f'{__name__}:Invert'
+
+
+class Invert(object):
+    """ Transform of the tests, inverts the image."""
+    def __init__(self, offset=0.):
+        self.offset = int(offset)
+
+    def __call__(self, sample):
+        return {'image': 255 - self.offset - sample['image'],
+                'label': sample['label']}
+
+
+def _run(root_dir, out_dir, **params):
+    return preprocess(root_dir, out_dir, TRANSFORM, params, workers=1,
+                      chunksize=4, progress=False)
+
+
+def test_parse_params():
+    assert parse_params(['weight=0.5', 'isotropic=False', 'mode=soft']) == \
+        {'weight': 0.5, 'isotropic': False, 'mode': 'soft'}
+
+
+def test_preprocess_writes_a_root_dir(root_dir, tmp_path):
+    out_dir = tmp_path / 'out'
+    assert _run(root_dir, out_dir) == 12
+    source = np.asarray(Image.open(root_dir / 'Images' / 'sample000000.png'))
+    result = np.asarray(Image.open(out_dir / 'Images' / 'sample000000.png'))
+    assert np.array_equal(result, 255 - source)
+    assert sorted(os.listdir(out_dir / 'Labels')) == \
+        sorted(os.listdir(root_dir / 'Labels'))
+
+
+def test_preprocess_resumes(root_dir, tmp_path):
+    out_dir = tmp_path / 'out'
+    _run(root_dir, out_dir)
+    kept = out_dir / 'Images' / 'sample000000.png'
+    mtime = kept.stat().st_mtime_ns
+    for index in (3, 7):
+        os.remove(out_dir / 'Images' / f'sample{index:06d}.png')
+    assert _run(root_dir, out_dir) == 2
+    assert kept.stat().st_mtime_ns == mtime
+    assert len(os.listdir(out_dir / 'Images')) == 12
+    assert _run(root_dir, out_dir) == 0
+
+
+def test_preprocess_refuses_other_settings(root_dir, tmp_path):
+    out_dir = tmp_path / 'out'
+    _run(root_dir, out_dir)
+    with pytest.raises(RuntimeError, match='other settings'):
+        _run(root_dir, out_dir, offset=1.)
@@ -0,0 +1,45 @@
+""" Tests of the pyramid levels and their loading."""
+
+import numpy as np
+import pytest
+from PIL import Image
+from boxsupdataset.decode import decode_label
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+from boxsupdataset.pyramid import build_pyramid, level_dir
+
+
+def _build(root_dir, **kwargs):
+    return build_pyramid(root_dir, workers=1, progress=False, **kwargs)
+
+
+def test_levels_are_downscaled(root_dir, classfile):
+    assert _build(root_dir, levels=2) == 12
+    full = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray)
+    image = Image.open(full.imgs[5][0]).convert('RGB')
+    mask = decode_label(full.imgs[5][1])
+    for level in (1, 2):
+        dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                                    level=level)
+        assert len(dataset) == 12
+        assert all(img.parent == level_dir(root_dir, level) / 'Images'
+                   for img, _ in dataset.imgs)
+        image = image.reduce(2)
+        mask = mask[::2, ::2]
+        sample = dataset[5]
+        assert sample['image'].shape == (32 >> level, 40 >> level, 3)
+        assert np.array_equal(sample['image'], np.asarray(image))
+        assert np.array_equal(sample['label'], mask)
+
+
+def test_pyramid_resumes_and_checks_settings(root_dir, classfile):
+    _build(root_dir, levels=1)
+    assert _build(root_dir, levels=1) == 0
+    # a deeper pyramid only rebuilds the pairs with missing levels
+    assert _build(root_dir, levels=2) == 12
+    (level_dir(root_dir, 2) / 'Images' / 'sample000004.png').unlink()
+    assert _build(root_dir, levels=1) == 1
+    with pytest.raises(RuntimeError, match='other settings'):
+        _build(root_dir, factor=3)
+    with pytest.raises(AssertionError):
+        NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                          level=3)
@@ -0,0 +1,32 @@
+""" Tests of the label coloring of the quicklook cells."""
+
+import numpy as np
+from PIL import Image
+from boxsupdataset.labels import ClassEncoder
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+from boxsupdataset.quicklook import class_palette, render_cell
+
+
+def test_index_png_is_colored_like_the_mask(root_dir, classfile):
+    dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray)
+    encoder = ClassEncoder(dataset.classes)
+    lut = class_palette(dataset.classes)
+    img_path, mat_path = dataset.imgs[0]
+    png_path = mat_path.with_suffix('.png')
+    cell = render_cell(img_path, mat_path, 'mask', encoder, lut, (40, 32))
+    assert np.array_equal(
+        render_cell(img_path, png_path, 'image', encoder, lut, (40, 32)),
+        cell)
+
+
+def test_rgb_label_is_blended_as_is(root_dir, classfile, tmp_path):
+    dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray)
+    encoder = ClassEncoder(dataset.classes)
+    lut = class_palette(dataset.classes)
+    img_path = dataset.imgs[0][0]
+    label_path = tmp_path / 'label.png'
+    Image.fromarray(np.full((32, 40, 3), (10, 200, 30), np.uint8)).save(
+        label_path)
+    cell = render_cell(img_path, label_path, 'image', encoder, lut,
+                       (40, 32), alpha=1.)
+    assert (cell[:, 40:] == (10, 200, 30)).all()
@@ -0,0 +1,42 @@
+""" Tests of the interleaving of the ChunkedDistributedSampler."""
+
+import pytest
+from torch.utils.data import BatchSampler, DataLoader, Dataset, \
+    get_worker_info
+from boxsupdataset.samplers import ChunkedDistributedSampler
+
+
+class WorkerIds(Dataset):
+    """Returns the index and the id of the worker which loaded it."""
+    def __init__(self, length):
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        return idx, get_worker_info().id
+
+
+@pytest.mark.parametrize('length, chunk_size, num_workers, batch_size',
+                         [(10, 5, 2, 4), (28, 4, 3, 4), (30, 7, 4, 3)])
+def test_every_worker_reads_its_segment(length, chunk_size, num_workers,
+                                        batch_size):
+    kwargs = {'chunk_size': chunk_size, 'seed': 3, 'rank': 0,
+              'world_size': 1}
+    plain = ChunkedDistributedSampler(length, **kwargs).rank_order()
+    sampler = ChunkedDistributedSampler(length, num_workers=num_workers,
+                                        batch_size=batch_size, **kwargs)
+    batches = list(BatchSampler(sampler, batch_size, drop_last=False))
+    assert all(len(batch) == batch_size for batch in batches[:-1])
+    loader = DataLoader(WorkerIds(length), sampler=sampler,
+                        batch_size=batch_size, num_workers=num_workers)
+    segments = {worker: [] for worker in range(num_workers)}
+    for step, (indices, workers) in enumerate(loader):
+        assert indices.tolist() == batches[step]
+        assert set(workers.tolist()) == {step % num_workers}
+        segments[step % num_workers].extend(indices.tolist())
+    for segment in segments.values():
+        start = plain.index(segment[0]) if segment else 0
+        assert plain[start:start + len(segment)] == segment
+    assert sorted(sum(segments.values(), [])) == list(range(length))
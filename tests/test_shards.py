@@ -0,0 +1,59 @@
+""" Tests of the per rank sample counts of the shard dataset."""
+
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader
+from boxsupdataset.shards import NasaBoxSupShardDataset, pack_shards, \
+    read_shard
+from boxsupdataset.samplers import ChunkedDistributedSampler
+
+
+@pytest.fixture
+def shard_dir(root_dir, tmp_path):
+    # 12 samples in shards of 5, 5 and 2
+    pack_shards(root_dir, tmp_path / 'shards', samples_per_shard=5)
+    return tmp_path / 'shards'
+
+
+def _names(dataset):
+    return [np.asarray(sample['image']).sum() for sample in dataset]
+
+
+@pytest.mark.parametrize('world_size', [1, 2, 3, 4, 5, 16])
+@pytest.mark.parametrize('drop_last', [False, True])
+def test_every_rank_reads_the_same_count(shard_dir, world_size, drop_last):
+    counts = []
+    for rank in range(world_size):
+        dataset = NasaBoxSupShardDataset(shard_dir, rank=rank,
+                                         world_size=world_size,
+                                         drop_last=drop_last)
+        counts.append(len(_names(dataset)))
+        assert counts[-1] == len(dataset)
+    expected = 12 // world_size if drop_last else -(-12 // world_size)
+    assert counts == [expected] * world_size
+
+
+def test_ranks_cover_the_dataset(shard_dir):
+    seen = set()
+    for rank in range(2):
+        dataset = NasaBoxSupShardDataset(shard_dir, rank=rank, world_size=2)
+        seen.update(_names(dataset))
+    assert len(seen) == 12
+
+
+def test_workers_split_the_count_of_a_rank(shard_dir):
+    dataset = NasaBoxSupShardDataset(shard_dir, rank=1, world_size=2,
+                                     shuffle_buffer=4,
+                                     transform=np.asarray)
+    loader = DataLoader(dataset, batch_size=None, num_workers=2)
+    assert sum(1 for _ in loader) == len(dataset) == 6
+
+
+def test_read_shard_pairs_by_suffix(shard_dir):
+    samples = list(read_shard(shard_dir / 'shard-000000.tar'))
+    assert len(samples) == 5
+
+
+def test_sampler_and_shards_share_the_rank_defaults():
+    sampler = ChunkedDistributedSampler(10)
+    assert (sampler.rank, sampler.world_size) == (0, 1)
@@ -0,0 +1,76 @@
+""" Tests of the dataset statistics and their cache."""
+
+import os
+import numpy as np
+from PIL import Image
+from boxsupdataset.decode import decode_sample
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+from boxsupdataset.statistics import (PartialStatistics, StatisticsCache,
+                                      compute_statistics, sample_statistics)
+
+
+def _dataset(root_dir, classfile, **kwargs):
+    return NasaBoxSupDataset(classfile, root_dir, transform=np.asarray,
+                             **kwargs)
+
+
+def test_statistics_match_numpy(root_dir, classfile):
+    dataset = _dataset(root_dir, classfile)
+    images, labels = zip(*[decode_sample(img, mask)
+                           for img, mask in dataset.imgs])
+    pixels = np.concatenate([image.reshape(-1, 3) for image in images]) / 255.
+    values, counts = np.unique(np.concatenate(
+        [label.reshape(-1) for label in labels]), return_counts=True)
+
+    summary = dataset.statistics(workers=1)
+    assert summary['images'] == 12 and summary['pixels'] == len(pixels)
+    assert np.allclose(summary['mean'], pixels.mean(axis=0))
+    assert np.allclose(summary['std'], pixels.std(axis=0))
+    assert summary['class_pixels'] == {f'class{value}': int(count)
+                                       for value, count in zip(values,
+                                                               counts)}
+    assert summary['sizes'] == {'32x40': 12}
+
+
+def test_parts_merge_like_the_whole(root_dir, classfile):
+    items = _dataset(root_dir, classfile).imgs
+    whole = PartialStatistics()
+    first, second = PartialStatistics(), PartialStatistics()
+    for index, item in enumerate(items):
+        counts = sample_statistics(*item)
+        whole.add(*counts)
+        (first if index % 3 else second).add(*counts)
+    merged = first + second
+    assert merged.images == whole.images
+    assert np.array_equal(merged.histogram, whole.histogram)
+    assert merged.classes == whole.classes and merged.sizes == whole.sizes
+    assert first.images + second.images == 12
+
+
+def test_cache_reads_only_changed_samples(root_dir, classfile, tmp_path):
+    items = _dataset(root_dir, classfile).imgs
+    tokens = {f'sample{index:06d}': index for index in range(12)}
+    cache = StatisticsCache(tmp_path / 'stats.npz')
+    expected = compute_statistics(items, tokens, cache, workers=1)
+
+    reopened = StatisticsCache(tmp_path / 'stats.npz')
+    reopened.load()
+    assert len(reopened.entries) == 12
+    old = sample_statistics(*items[1])[0]
+    image = np.asarray(Image.open(items[1][0]))
+    Image.fromarray(255 - image).save(items[1][0])
+    new = sample_statistics(*items[1])[0]
+    # cached samples are not read again, so their files may be gone
+    os.remove(items[0][0])
+    tokens['sample000001'] = 'new'
+    result = compute_statistics(items, tokens, reopened, workers=1)
+    assert result.images == 12
+    assert np.array_equal(result.histogram, expected.histogram - old + new)
+    assert np.array_equal(reopened.get('sample000001', 'new')[0], new)
+    assert reopened.get('sample000001', 1) is None
+
+    del tokens['sample000005']
+    compute_statistics(items[:5] + items[6:], tokens, reopened, workers=1)
+    reloaded = StatisticsCache(tmp_path / 'stats.npz')
+    reloaded.load()
+    assert sorted(reloaded.entries) == sorted(tokens)
@@ -0,0 +1,21 @@
+""" Tests of the warm started solvers of the parameter sweep."""
+
+import numpy as np
+from skimage.restoration import denoise_tv_chambolle
+from boxsupdataset.transforms.denoise import TotalVariation
+from boxsupdataset.transforms.sweep import _sweep_chambolle, solver
+
+
+def test_chambolle_sweep_starts_like_skimage():
+    image = np.random.default_rng(0).random((20, 24, 3))
+    transforms = [TotalVariation(weight) for weight in (0.05, 0.1)]
+    first = next(_sweep_chambolle(image, transforms))
+    reference = denoise_tv_chambolle(image, weight=0.05, channel_axis=-1)
+    np.testing.assert_allclose(first, reference, atol=1e-12)
+
+
+def test_solver_names_the_substitution():
+    assert solver('TotalVariation') == 'batch solver, warm start'
+    assert solver('TotalVariation', warm_start=False) == 'transform'
+    assert solver('TotalVariation2') == 'transform'
+    assert solver('Wavelet') == 'transform'
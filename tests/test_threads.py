@@ -0,0 +1,83 @@
+""" Tests of the split of the cpus between workers and threads."""
+
+import os
+import pickle
+import numpy as np
+import torch
+from boxsupdataset.threads import (THREAD_VARIABLES, ThreadBudget, autotune,
+                                   available_cpus, candidate_splits)
+
+
+class Samples(object):
+    """ Dataset of small images, which records the workers it ran in."""
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, idx):
+        info = torch.utils.data.get_worker_info()
+        return {'image': np.full((4, 4, 3), idx, np.uint8),
+                'worker': -1 if info is None else info.id,
+                'threads': torch.get_num_threads()}
+
+
+def test_budget_splits_the_cpus():
+    budget = ThreadBudget(4, total=8)
+    assert budget.split == {'num_workers': 4, 'threads_per_worker': 2,
+                            'total': 8, 'pin': False}
+    assert ThreadBudget(0, total=8).threads_per_worker == 8
+    assert ThreadBudget(16, total=8).threads_per_worker == 1
+    assert ThreadBudget(2).total == len(available_cpus())
+
+
+def test_cores_are_shared_round_robin():
+    budget = ThreadBudget(3, threads_per_worker=2, pin=True)
+    budget.cpus = [10, 11, 12, 13]
+    assert [budget.cores(worker) for worker in range(3)] == \
+        [[10, 11], [12, 13], [10, 11]]
+
+
+def test_candidate_splits():
+    assert candidate_splits(6) == [(0, 6), (1, 6), (2, 3), (4, 1), (6, 1)]
+    assert candidate_splits(4) == [(0, 4), (1, 4), (2, 2), (4, 1)]
+
+
+def test_apply_and_restore(monkeypatch):
+    for name in THREAD_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('OMP_NUM_THREADS', '7')
+    threads = torch.get_num_threads()
+    budget = ThreadBudget(0, threads_per_worker=1)
+    budget.apply()
+    try:
+        assert torch.get_num_threads() == 1
+        assert all(os.environ[name] == '1' for name in THREAD_VARIABLES)
+        # a copy for the workers does not carry the state of apply
+        assert pickle.loads(pickle.dumps(budget))._previous is None
+    finally:
+        budget.restore()
+    assert torch.get_num_threads() == threads
+    assert os.environ['OMP_NUM_THREADS'] == '7'
+    assert 'MKL_NUM_THREADS' not in os.environ
+
+
+def test_workers_run_with_their_budget():
+    calls = []
+    budget = ThreadBudget(2, threads_per_worker=1,
+                          worker_init_fn=calls.append)
+    loader = torch.utils.data.DataLoader(Samples(), batch_size=2,
+                                         num_workers=2,
+                                         worker_init_fn=budget)
+    batches = list(loader)
+    assert sorted({int(worker) for batch in batches
+                   for worker in batch['worker']}) == [0, 1]
+    assert all((batch['threads'] == 1).all() for batch in batches)
+    # worker_init_fn ran in the workers, not here
+    assert calls == []
+
+
+def test_autotune_times_every_split():
+    best = autotune(Samples(), splits=[(0, 1), (1, 1)], samples=8)
+    assert isinstance(best, ThreadBudget)
+    assert [(timing['num_workers'], timing['threads_per_worker'])
+            for timing in best.timings] == [(0, 1), (1, 1)]
+    assert all(timing['samples_per_sec'] > 0 for timing in best.timings)
@@ -0,0 +1,62 @@
+""" Tests of the TileStore metadata and tile histograms."""
+
+import os
+import numpy as np
+from boxsupdataset.labels import ClassEncoder
+from boxsupdataset.nasa_box_sup_dataset import NasaBoxSupDataset
+from boxsupdataset.tiles import TileStore, tile_histograms, to_tiles
+
+
+def test_color_histogram_separates_colors_with_the_same_red():
+    label = np.zeros((4, 4, 3), dtype=np.uint8)
+    label[:2] = (200, 10, 10)
+    label[2:] = (200, 99, 10)
+    palette = {}
+    histogram = tile_histograms(to_tiles(label, 2), palette)
+    assert sorted(palette) == [0xc80a0a, 0xc8630a]
+    assert histogram.shape == (4, 2)
+    assert histogram.sum(axis=1).tolist() == [4, 4, 4, 4]
+    assert histogram[:2, palette[0xc80a0a]].tolist() == [4, 4]
+    assert histogram[2:, palette[0xc8630a]].tolist() == [4, 4]
+
+
+def test_mask_histogram_counts_values():
+    mask = np.array([[0, 1], [3, 3]], dtype=np.uint8)
+    histogram = tile_histograms(to_tiles(mask, 2), {})
+    assert histogram.tolist() == [[1, 1, 0, 2]]
+
+
+def test_store_matches_its_settings(root_dir, classfile, tmp_path):
+    dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray)
+    encoder = ClassEncoder(dataset.classes)
+    store = TileStore(tmp_path / 'tiles')
+    store.build(dataset.imgs, 'mask', 16)
+    assert store.matches(dataset.imgs, 16)
+    assert not store.matches(dataset.imgs, 32)
+    assert not store.matches(dataset.imgs, 16, 'image')
+    assert not store.matches(dataset.imgs, 16, 'mask', encoder)
+    store.build(dataset.imgs, 'mask', 16, encoder)
+    assert store.matches(dataset.imgs, 16, 'mask',
+                         ClassEncoder(dataset.classes))
+    assert not store.matches(dataset.imgs, 16, 'mask', None)
+
+
+def test_store_sees_rewritten_sources(root_dir, classfile, tmp_path):
+    dataset = NasaBoxSupDataset(classfile, root_dir, transform=np.asarray)
+    store = TileStore(tmp_path / 'tiles')
+    store.build(dataset.imgs, 'mask', 16)
+    img_path = dataset.imgs[0][0]
+    stat = os.stat(img_path)
+    os.utime(img_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert not store.matches(dataset.imgs, 16)
+
+
+def test_histogram_skips_padding():
+    mask = np.ones((3, 3), dtype=np.uint8)
+    histogram = tile_histograms(to_tiles(mask, 2), {}, mask.shape)
+    assert histogram.tolist() == [[0, 4], [0, 2], [0, 2], [0, 1]]
+    label = np.full((3, 3, 3), 7, dtype=np.uint8)
+    palette = {}
+    histogram = tile_histograms(to_tiles(label, 2), palette, label.shape)
+    assert list(palette) == [0x070707]
+    assert histogram[:, 0].tolist() == [4, 2, 2, 1]
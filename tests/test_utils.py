@@ -0,0 +1,35 @@
+""" Tests of the atomic file writes and the progress printer."""
+
+import pytest
+from boxsupdataset.utils import Progress, atomic_write
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = tmp_path / 'index.json'
+    path.write_text('old')
+    with atomic_write(path, 'w') as out_file:
+        out_file.write('new')
+        assert path.read_text() == 'old'
+    assert path.read_text() == 'new'
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_atomic_write_keeps_file_on_error(tmp_path):
+    path = tmp_path / 'index.json'
+    path.write_text('old')
+    with pytest.raises(ValueError):
+        with atomic_write(path, 'w') as out_file:
+            out_file.write('partial')
+            raise ValueError('interrupted')
+    assert path.read_text() == 'old'
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_progress_prints_done_items(capsys):
+    with Progress(5, 'images') as counter:
+        counter.update(2)
+        assert counter.update(3) == 5
+    assert capsys.readouterr().err == '\r2/5 images\r5/5 images\n'
+    with Progress(5, enabled=False) as counter:
+        counter.update(5)
+    assert capsys.readouterr().err == ''